@@ -0,0 +1,477 @@
+"""
+Aktivitetsdata fra klokker og helseapper (Apple Health, Health Connect, Polar, Garmin).
+
+Mobilappen sender samples i store batcher (POST /api/activity/samples, titusenvis per kall):
+
+    {"source": "apple_health", "samples": [
+        {"type": "steps", "start": "2026-10-18T08:00:00Z", "end": "2026-10-18T08:01:00Z", "value": 87},
+        {"type": "heart_rate", "start": "2026-10-18T08:00:00Z", "value": 72},
+        {"type": "workout", "start": "...", "end": "...", "value": 430, "activity": "running"}
+    ]}
+
+Tidspunkt er ISO 8601 (uten tidssone = UTC) eller Unix-sekunder. Batchen valideres i én
+løkke. Skritt og puls (høyfrekvent) flettes inn i komprimerte dagsbiter i activity_chunks
+(app/timeseries.py); treningsøkter lastes med COPY til en midlertidig tabell og flettes inn
+i activity_samples med én INSERT ... SELECT ... ON CONFLICT – samme mønster som off_import.
+Duplikater (samme kilde, type og starttid) fjernes både i batchen (siste vinner) og mot
+lagrede data, og uendrede dager skrives ikke på nytt. Samme batch kan derfor sendes om igjen
+etter tidsavbrudd. Berørte dager får oppdatert activity_daily i samme transaksjon.
+
+Skritt/puls som ble lagret som rader før dagsbitene fantes flyttes med:
+    python -m app.activity compact
+"""
+import argparse
+import csv
+import io
+import math
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import orjson
+import psycopg2
+
+from .database import get_connection, get_cursor
+from .timeseries import (
+    ACTIVITY_TIMEZONE,
+    MAX_SAMPLE_SECONDS,
+    daily_summary,
+    decode,
+    diff_counts,
+    encode,
+    hour_labels,
+    hourly_heart_rate,
+    hourly_steps,
+    hours_in_day,
+    local_day,
+    merge,
+    split_by_day,
+)
+
+ACTIVITY_MAX_SAMPLES = int(os.getenv("ACTIVITY_MAX_SAMPLES", "50000"))
+ACTIVITY_MAX_BODY_BYTES = int(os.getenv("ACTIVITY_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+
+ACTIVITY_SOURCES = ("apple_health", "health_connect", "polar", "garmin")
+# type → (min, maks) for value: skritt per sample, slag/min, kcal per økt
+SAMPLE_TYPES = {
+    "steps": (0, 100_000),
+    "heart_rate": (20, 250),
+    "workout": (0, 10_000),
+}
+# Lagres i dagsbiter (activity_chunks); resten som rader i activity_samples
+SERIES_TYPES = ("steps", "heart_rate")
+_MIN_TS = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_MAX_AHEAD = timedelta(days=1)
+_MAX_DURATION = timedelta(seconds=MAX_SAMPLE_SECONDS)
+
+# Kolonner i staging-tabellen (samme rekkefølge som COPY-raden)
+_COLUMNS = ("seq", "kind", "started_at", "ended_at", "value", "activity")
+
+
+class Batch:
+    """Validert batch: COPY-rader for økter og (tidspunkt, varighet, verdi)-lister per serie."""
+
+    __slots__ = ("source", "received", "workouts", "series", "days", "last_sample_at")
+
+    def __init__(self, source: str, received: int):
+        self.source = source
+        self.received = received
+        self.workouts: list[tuple] = []
+        self.series: dict[str, tuple[list, list, list]] = {k: ([], [], []) for k in SERIES_TYPES}
+        self.days: set[date] = set()
+        self.last_sample_at: datetime | None = None
+
+
+def _parse_ts(value, field: str, i: int) -> tuple[datetime, str]:
+    """(tidspunkt for validering, tekst til COPY). ISO-tekst sendes uendret – Postgres parser
+    den uansett, og isoformat() per sample er den dyreste delen av en stor batch."""
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            ts = datetime.fromtimestamp(value, timezone.utc)
+            return ts, ts.isoformat()
+        ts = datetime.fromisoformat(value)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError(f"samples[{i}].{field}: ugyldig tidspunkt")
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts, value
+
+
+def parse_batch(body: bytes) -> Batch:
+    """Body → Batch. ValueError med norsk melding ved ugyldig innhold."""
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise ValueError("Ugyldig JSON")
+    if not isinstance(payload, dict):
+        raise ValueError("Forventet objekt med source og samples")
+    source = payload.get("source")
+    if source not in ACTIVITY_SOURCES:
+        raise ValueError(f"Ugyldig source. Tillatt: {', '.join(ACTIVITY_SOURCES)}")
+    samples = payload.get("samples")
+    if not isinstance(samples, list):
+        raise ValueError("samples må være en liste")
+    if len(samples) > ACTIVITY_MAX_SAMPLES:
+        raise ValueError(f"For mange samples (maks {ACTIVITY_MAX_SAMPLES} per kall)")
+
+    latest = datetime.now(timezone.utc) + _MAX_AHEAD
+    batch = Batch(source, len(samples))
+    last = None
+    for i, s in enumerate(samples):
+        if not isinstance(s, dict):
+            raise ValueError(f"samples[{i}]: forventet objekt")
+        kind = s.get("type")
+        bounds = SAMPLE_TYPES.get(kind)
+        if bounds is None:
+            raise ValueError(f"samples[{i}].type: tillatt er {', '.join(SAMPLE_TYPES)}")
+        value = s.get("value")
+        if (
+            not isinstance(value, (int, float)) or isinstance(value, bool)
+            or not math.isfinite(value) or not bounds[0] <= value <= bounds[1]
+        ):
+            raise ValueError(f"samples[{i}].value: må være et tall mellom {bounds[0]} og {bounds[1]}")
+        start, start_text = _parse_ts(s.get("start"), "start", i)
+        if not _MIN_TS <= start <= latest:
+            raise ValueError(f"samples[{i}].start: utenfor gyldig periode")
+        end, end_text = start, ""
+        if s.get("end") is not None:
+            end, end_text = _parse_ts(s["end"], "end", i)
+            if end < start:
+                raise ValueError(f"samples[{i}].end: før start")
+            if end > latest:
+                raise ValueError(f"samples[{i}].end: utenfor gyldig periode")
+            if end - start > _MAX_DURATION:
+                raise ValueError(f"samples[{i}].end: maks {MAX_SAMPLE_SECONDS // 3600} timer etter start")
+        if last is None or end > last:
+            last = end
+        if kind in SERIES_TYPES:
+            epochs, durations, values = batch.series[kind]
+            epoch = int(start.timestamp())
+            epochs.append(epoch)
+            durations.append(int(end.timestamp()) - epoch)
+            values.append(value)
+            continue
+        activity = s.get("activity")
+        if activity is not None and (not isinstance(activity, str) or len(activity) > 40):
+            raise ValueError(f"samples[{i}].activity: maks 40 tegn")
+        batch.workouts.append((i, kind, start_text, end_text, value, activity or ""))
+        batch.days.add(local_day(start.timestamp()))
+    batch.last_sample_at = last
+    return batch
+
+
+def _copy_rows(cur, rows: list[tuple]) -> None:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY activity_import ({', '.join(_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _merge_workouts(cur, user_id: str, source: str, rows: list[tuple]) -> tuple[int, int]:
+    """COPY → staging → én INSERT ... ON CONFLICT. Returnerer (nye, endrede)."""
+    cur.execute(
+        """
+        CREATE TEMP TABLE activity_import (
+            seq INTEGER, kind VARCHAR(20), started_at TIMESTAMPTZ, ended_at TIMESTAMPTZ,
+            value DOUBLE PRECISION, activity VARCHAR(40)
+        ) ON COMMIT DROP
+        """
+    )
+    try:
+        _copy_rows(cur, rows)
+    except psycopg2.DataError as e:
+        raise ValueError(f"Ugyldig verdi i batch: {e.diag.message_primary}")
+    cur.execute(
+        """
+        WITH merged AS (
+            INSERT INTO activity_samples (user_id, source, kind, started_at, ended_at, value, activity)
+            SELECT DISTINCT ON (kind, started_at)
+                   %(user_id)s, %(source)s, kind, started_at, ended_at, value, NULLIF(activity, '')
+            FROM activity_import
+            ORDER BY kind, started_at, seq DESC
+            ON CONFLICT (user_id, kind, started_at, source) DO UPDATE SET
+                ended_at = EXCLUDED.ended_at,
+                value = EXCLUDED.value,
+                activity = EXCLUDED.activity,
+                received_at = NOW()
+            WHERE (activity_samples.ended_at, activity_samples.value, activity_samples.activity)
+                  IS DISTINCT FROM (EXCLUDED.ended_at, EXCLUDED.value, EXCLUDED.activity)
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged
+        """,
+        {"user_id": user_id, "source": source},
+    )
+    return cur.fetchone()
+
+
+def _store_series(cur, user_id: str, source: str, kind: str, lists: tuple[list, list, list]) -> tuple[int, int, set]:
+    """Flett nye samples inn i dagsbitene. Returnerer (nye, endrede, berørte dager)."""
+    by_day = split_by_day(
+        np.array(lists[0], dtype=np.int64), np.array(lists[1], dtype=np.int64), np.array(lists[2], dtype=np.float64)
+    )
+    cur.execute(
+        """
+        SELECT day, n, data FROM activity_chunks
+        WHERE user_id = %s AND kind = %s AND source = %s AND day = ANY(%s::date[])
+        """,
+        (user_id, kind, source, list(by_day)),
+    )
+    existing = {day: decode(bytes(data), n) for day, n, data in cur.fetchall()}
+    inserted = updated = 0
+    out = []
+    for day, series in by_day.items():
+        old = existing.get(day)
+        if old is None:
+            inserted += len(series[0])
+        else:
+            new_count, changed = diff_counts(old, series)
+            inserted += new_count
+            updated += changed
+            if not new_count and not changed:
+                continue
+            series = merge(old, series)
+        out.append((day, len(series[0]), psycopg2.Binary(encode(series))))
+    if out:
+        days, counts, blobs = zip(*out)
+        cur.execute(
+            """
+            INSERT INTO activity_chunks (user_id, day, kind, source, n, data)
+            SELECT %s, c.day, %s, %s, c.n, c.data
+            FROM unnest(%s::date[], %s::int[], %s::bytea[]) AS c(day, n, data)
+            ON CONFLICT (user_id, day, kind, source) DO UPDATE SET
+                n = EXCLUDED.n, data = EXCLUDED.data, updated_at = NOW()
+            """,
+            (user_id, kind, source, list(days), list(counts), list(blobs)),
+        )
+    return inserted, updated, {d for d, _n, _b in out}
+
+
+def _load_chunks(cur, user_id: str, from_date: date, to_date: date) -> dict[date, dict[str, list]]:
+    """Alle dagsbiter i perioden (én indeksskann på primærnøkkelen), dekodet per dag og type."""
+    cur.execute(
+        """
+        SELECT day, kind, n, data FROM activity_chunks
+        WHERE user_id = %s AND day BETWEEN %s AND %s
+        ORDER BY day
+        """,
+        (user_id, from_date, to_date),
+    )
+    out: dict[date, dict[str, list]] = {}
+    for day, kind, n, data in cur.fetchall():
+        out.setdefault(day, {}).setdefault(kind, []).append(decode(bytes(data), n))
+    return out
+
+
+def refresh_daily(cur, user_id: str, days: set[date]) -> None:
+    """Regn ut activity_daily for dagene: skritt/puls fra dagsbitene, økter fra activity_samples."""
+    if not days:
+        return
+    days = sorted(days)
+    chunks = _load_chunks(cur, user_id, days[0], days[-1])
+    rows = [daily_summary(chunks.get(d, {}), d) for d in days]
+    cur.execute(
+        """
+        INSERT INTO activity_daily (user_id, day, steps, hr_avg, hr_min, hr_max, hr_samples,
+                                    workouts, workout_kcal, workout_minutes, updated_at)
+        SELECT %(user_id)s, d.day, d.steps, d.hr_avg, d.hr_min, d.hr_max, d.hr_samples,
+               COALESCE(w.n, 0), COALESCE(w.kcal, 0), COALESCE(w.minutes, 0), NOW()
+        FROM unnest(%(days)s::date[], %(steps)s::int[], %(hr_avg)s::real[], %(hr_min)s::real[],
+                    %(hr_max)s::real[], %(hr_samples)s::int[])
+             AS d(day, steps, hr_avg, hr_min, hr_max, hr_samples)
+        LEFT JOIN LATERAL (
+            SELECT COUNT(*) AS n, SUM(s.value) AS kcal,
+                   SUM(EXTRACT(EPOCH FROM s.ended_at - s.started_at)) / 60 AS minutes
+            FROM activity_samples s
+            WHERE s.user_id = %(user_id)s AND s.kind = 'workout'
+              AND s.started_at >= d.day::timestamp AT TIME ZONE %(tz)s
+              AND s.started_at < (d.day + 1)::timestamp AT TIME ZONE %(tz)s
+        ) w ON TRUE
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            steps = EXCLUDED.steps, hr_avg = EXCLUDED.hr_avg, hr_min = EXCLUDED.hr_min,
+            hr_max = EXCLUDED.hr_max, hr_samples = EXCLUDED.hr_samples, workouts = EXCLUDED.workouts,
+            workout_kcal = EXCLUDED.workout_kcal, workout_minutes = EXCLUDED.workout_minutes,
+            updated_at = EXCLUDED.updated_at
+        """,
+        {
+            "user_id": user_id,
+            "tz": ACTIVITY_TIMEZONE,
+            "days": days,
+            "steps": [r["steps"] for r in rows],
+            "hr_avg": [r["hr_avg"] for r in rows],
+            "hr_min": [r["hr_min"] for r in rows],
+            "hr_max": [r["hr_max"] for r in rows],
+            "hr_samples": [r["hr_samples"] for r in rows],
+        },
+    )
+
+
+def ingest(user_id, batch: Batch) -> dict:
+    """Lagre batchen i én transaksjon. Returnerer antall nye, endrede og duplikater."""
+    if not batch.received:
+        return {"received": 0, "inserted": 0, "updated": 0, "duplicates": 0}
+    user_id = str(user_id)
+    inserted = updated = 0
+    days = set(batch.days)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # Tidspunkt uten sone i COPY-teksten er UTC (som i parse_batch)
+            cur.execute("SET LOCAL TIME ZONE 'UTC'")
+            # Dagsbitene leses og skrives tilbake: serialiser samtidige opplastinger per bruker
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('activity'), hashtext(%s))", (user_id,))
+            if batch.workouts:
+                i, u = _merge_workouts(cur, user_id, batch.source, batch.workouts)
+                inserted += i
+                updated += u
+            for kind, lists in batch.series.items():
+                if lists[0]:
+                    i, u, touched = _store_series(cur, user_id, batch.source, kind, lists)
+                    inserted += i
+                    updated += u
+                    days |= touched
+            cur.execute(
+                """
+                INSERT INTO activity_sources (user_id, source, last_sample_at, last_upload_at)
+                VALUES (%s, %s, %s, NOW())
+                ON CONFLICT (user_id, source) DO UPDATE SET
+                    last_sample_at = GREATEST(activity_sources.last_sample_at, EXCLUDED.last_sample_at),
+                    last_upload_at = EXCLUDED.last_upload_at
+                """,
+                (user_id, batch.source, batch.last_sample_at),
+            )
+            refresh_daily(cur, user_id, days)
+        finally:
+            cur.close()
+    return {
+        "received": batch.received,
+        "inserted": inserted,
+        "updated": updated,
+        "duplicates": batch.received - inserted - updated,
+    }
+
+
+def ingest_batch(user_id, body: bytes) -> dict:
+    """Parse + lagring (kjøres i trådpool fra endepunktet)."""
+    batch = parse_batch(body)
+    return {"source": batch.source, **ingest(user_id, batch)}
+
+
+# --- Lesing: dag- og timeaggregater (Analyse) ---
+def daily_activity(user_id, from_date: date, to_date: date) -> list[dict]:
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT day, steps, hr_avg, hr_min, hr_max, workouts, workout_kcal, workout_minutes
+                FROM activity_daily
+                WHERE user_id = %s AND day BETWEEN %s AND %s
+                ORDER BY day
+                """,
+                (str(user_id), from_date, to_date),
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    return [
+        {
+            "date": r["day"].isoformat(),
+            "steps": r["steps"],
+            "hr_avg": r["hr_avg"],
+            "hr_min": r["hr_min"],
+            "hr_max": r["hr_max"],
+            "workouts": r["workouts"],
+            "workout_kcal": round(r["workout_kcal"]),
+            "workout_minutes": round(r["workout_minutes"]),
+        }
+        for r in rows
+    ]
+
+
+def _nullable(values: np.ndarray, ndigits: int = 1) -> list:
+    return [round(float(v), ndigits) if np.isfinite(v) else None for v in values]
+
+
+def hourly_activity(user_id, from_date: date, to_date: date) -> list[dict]:
+    """Skritt og puls per time, dekodet og aggregert med NumPy fra dagsbitene."""
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = conn.cursor()
+        try:
+            chunks = _load_chunks(cur, str(user_id), from_date, to_date)
+        finally:
+            cur.close()
+    out = []
+    for day in sorted(chunks):
+        hours = hours_in_day(day)
+        steps = hourly_steps(chunks[day].get("steps", []), hours)
+        hr = hourly_heart_rate(chunks[day].get("heart_rate", []), hours)
+        out.append({
+            "date": day.isoformat(),
+            "hours": hour_labels(day),
+            "steps": [int(round(v)) for v in steps],
+            "hr_avg": _nullable(hr["avg"]),
+            "hr_min": _nullable(hr["min"], 0),
+            "hr_max": _nullable(hr["max"], 0),
+        })
+    return out
+
+
+# --- Engangsflytting: skritt/puls lagret som rader → dagsbiter ---
+def compact_rows(limit_users: int | None = None) -> dict:
+    """Flytt skritt/puls-rader fra activity_samples til activity_chunks, én bruker per transaksjon."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                "SELECT DISTINCT user_id FROM activity_samples WHERE kind = ANY(%s) LIMIT %s",
+                (list(SERIES_TYPES), limit_users),
+            )
+            users = [str(r[0]) for r in cur.fetchall()]
+        finally:
+            cur.close()
+    moved = 0
+    for user_id in users:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('activity'), hashtext(%s))", (user_id,))
+                cur.execute(
+                    """
+                    DELETE FROM activity_samples
+                    WHERE user_id = %s AND kind = ANY(%s)
+                    RETURNING source, kind, EXTRACT(EPOCH FROM started_at)::bigint,
+                              COALESCE(EXTRACT(EPOCH FROM ended_at - started_at), 0)::int, value
+                    """,
+                    (user_id, list(SERIES_TYPES)),
+                )
+                groups: dict[tuple[str, str], tuple[list, list, list]] = {}
+                for source, kind, epoch, duration, value in cur.fetchall():
+                    lists = groups.setdefault((source, kind), ([], [], []))
+                    lists[0].append(epoch)
+                    lists[1].append(duration)
+                    lists[2].append(value)
+                days: set[date] = set()
+                for (source, kind), lists in groups.items():
+                    moved += len(lists[0])
+                    days |= _store_series(cur, user_id, source, kind, lists)[2]
+                refresh_daily(cur, user_id, days)
+            finally:
+                cur.close()
+    return {"users": len(users), "moved": moved}
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Vedlikehold av aktivitetsdata")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="Flytt skritt/puls lagret som rader til dagsbiter")
+    c.add_argument("--limit-users", type=int, default=None)
+    args = p.parse_args(argv)
+    if args.cmd == "compact":
+        print(compact_rows(args.limit_users))  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
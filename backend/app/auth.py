@@ -1,4 +1,11 @@
+import ipaddress
+import multiprocessing
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from typing import Any
 
@@ -8,26 +15,176 @@ from jose import JWTError, jwt
 SECRET_KEY = os.getenv("JWT_SECRET", "hercules-dev-secret-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
-BCRYPT_ROUNDS = 12
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt (~250 ms CPU ved 12 runder) kjøres i egne prosesser, ikke i request-trådene.
+# 0 workers = kjør i samme prosess (lokal utvikling).
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Maks antall hash-jobber som venter/kjører samtidig; flere avvises (503) i stedet for å hope seg opp
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+PASSWORD_HASH_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_TIMEOUT_SECONDS", "10"))
+
+# Innloggingsforsøk per minutt (begrenser bcrypt-arbeid fra én IP / mot én konto)
+LOGIN_MAX_PER_IP_PER_MINUTE = int(os.getenv("LOGIN_MAX_PER_IP_PER_MINUTE", "20"))
+LOGIN_MAX_PER_ACCOUNT_PER_MINUTE = int(os.getenv("LOGIN_MAX_PER_ACCOUNT_PER_MINUTE", "5"))
+# Proxyer (IP-er/CIDR, kommaseparert) vi stoler på X-Forwarded-For fra. Tom = bruk TCP-avsender.
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False) for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+
+
+class PasswordHashBusy(Exception):
+    """Hash-køen er full – klienten bør prøve igjen om litt."""
+
+
+def _bcrypt_hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _bcrypt_check(plain: bytes, hashed: bytes) -> bool:
+    try:
+        return bcrypt.checkpw(plain, hashed)
+    except (ValueError, TypeError):
+        return False
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, PASSWORD_HASH_MAX_QUEUE))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _submit(fn, *args) -> Future:
+    """Legg jobben i poolen. Plassen i køen frigis først når jobben faktisk er ferdig i poolen."""
+    if not _slots.acquire(blocking=False):
+        raise PasswordHashBusy()
+    try:
+        future = _get_pool().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _f: _slots.release())
+    return future
+
+
+def _run_hash_job(fn, *args):
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    try:
+        try:
+            return _submit(fn, *args).result(timeout=PASSWORD_HASH_TIMEOUT_SECONDS)
+        except BrokenProcessPool:
+            _reset_pool()
+            return _submit(fn, *args).result(timeout=PASSWORD_HASH_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        # Jobben fortsetter i poolen og holder plassen sin til den er ferdig
+        raise PasswordHashBusy()
+
+
+def shutdown_password_pool() -> None:
+    _reset_pool()
 
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(
-        password.encode("utf-8"),
-        bcrypt.gensalt(rounds=BCRYPT_ROUNDS),
-    ).decode("utf-8")
+    return _run_hash_job(_bcrypt_hash, password.encode("utf-8"), BCRYPT_ROUNDS).decode("utf-8")
 
 
 def verify_password(plain: str, hashed: str) -> bool:
     try:
-        return bcrypt.checkpw(
-            plain.encode("utf-8"),
-            hashed.encode("utf-8"),
-        )
-    except (ValueError, TypeError):
+        hashed_bytes = hashed.encode("utf-8")
+    except (AttributeError, TypeError):
+        return False
+    return _run_hash_job(_bcrypt_check, plain.encode("utf-8"), hashed_bytes)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """True hvis hashen er laget med annet antall runder enn BCRYPT_ROUNDS ($2b$<runder>$...)."""
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (AttributeError, IndexError, ValueError):
         return False
 
 
+class _SlidingWindowLimiter:
+    """Teller hendelser per nøkkel siste `window` sekunder (per prosess)."""
+
+    def __init__(self, limit: int, window: float = 60.0):
+        self.limit = limit
+        self.window = window
+        self._events: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def hit(self, key: str) -> float:
+        """Registrer forsøk. Returnerer 0 hvis tillatt, ellers sekunder til neste ledige plass."""
+        if self.limit <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune > self.window:
+                self._events = {k: q for k, q in self._events.items() if q and q[-1] > now - self.window}
+                self._last_prune = now
+            q = self._events.setdefault(key, deque())
+            while q and q[0] <= now - self.window:
+                q.popleft()
+            if len(q) >= self.limit:
+                return max(0.0, q[0] + self.window - now)
+            q.append(now)
+            return 0.0
+
+
+_login_ip_limiter = _SlidingWindowLimiter(LOGIN_MAX_PER_IP_PER_MINUTE)
+_login_account_limiter = _SlidingWindowLimiter(LOGIN_MAX_PER_ACCOUNT_PER_MINUTE)
+
+
+def _is_trusted_proxy(ip: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(addr in net for net in TRUSTED_PROXIES)
+
+
+def client_ip(peer: str | None, forwarded_for: str | None) -> str | None:
+    """
+    Klientens IP bak betrodde proxyer. X-Forwarded-For leses fra høyre, og første adresse som
+    ikke er en betrodd proxy er klienten – det klienten selv har skrevet lenger til venstre ignoreres.
+    """
+    if not peer or not forwarded_for or not _is_trusted_proxy(peer):
+        return peer
+    hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+def login_throttle(ip: str | None, email: str | None) -> float:
+    """Sjekk innloggingsgrenser før bcrypt. Returnerer 0 hvis OK, ellers Retry-After i sekunder."""
+    wait = _login_ip_limiter.hit(f"ip:{ip}") if ip else 0.0
+    if not wait and email:
+        wait = _login_account_limiter.hit(f"acct:{email}")
+    return wait
+
+
 def create_access_token(data: dict[str, Any]) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -35,9 +192,46 @@ def create_access_token(data: dict[str, Any]) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def decode_access_token(token: str) -> dict[str, Any] | None:
+def create_upload_token(user_id: str, key: str, content_type: str, expires_in: int) -> str:
+    """Signert kvittering for en presignert opplasting (bindes til bruker, nøkkel og type)."""
+    expire = datetime.utcnow() + timedelta(seconds=expires_in)
+    return jwt.encode(
+        {"sub": user_id, "key": key, "ct": content_type, "typ": "upload", "exp": expire},
+        SECRET_KEY,
+        algorithm=ALGORITHM,
+    )
+
+
+def decode_upload_token(token: str) -> dict[str, Any] | None:
+    payload = _decode(token)
+    if not payload or payload.get("typ") != "upload":
+        return None
+    return payload
+
+
+def create_events_token(user_id: str, expires_in: int) -> str:
+    """Kortlevd token for /api/events (EventSource kan ikke sende Authorization-header)."""
+    expire = datetime.utcnow() + timedelta(seconds=expires_in)
+    return jwt.encode({"sub": user_id, "typ": "events", "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_events_token(token: str) -> dict[str, Any] | None:
+    payload = _decode(token)
+    if not payload or payload.get("typ") != "events":
+        return None
+    return payload
+
+
+def _decode(token: str) -> dict[str, Any] | None:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+
+
+def decode_access_token(token: str) -> dict[str, Any] | None:
+    payload = _decode(token)
+    # Opplastingskvitteringer og hendelsestokens er ikke innloggingstokens
+    if payload and payload.get("typ"):
+        return None
+    return payload
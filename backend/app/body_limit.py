@@ -0,0 +1,42 @@
+"""
+Hard grense for request-body på utvalgte ruter (f.eks. /api/upload).
+
+Sjekker Content-Length før noe leses, og teller faktiske bytes mens body strømmer inn
+(chunked upload har ingen Content-Length). Over grensen avbrytes lesingen med 413 før
+multipart-parseren har spoolet hele filen til disk.
+"""
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+class BodySizeLimitMiddleware:
+    """Ren ASGI-middleware. limits: {eksakt path: maks bytes}."""
+
+    def __init__(self, app, limits: dict[str, int], detail: str = "Forespørselen er for stor"):
+        self.app = app
+        self.limits = limits
+        self.detail = detail
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path", "")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await JSONResponse({"detail": self.detail}, status_code=413)(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI slipper HTTPException fra body-parsing videre → 413-svar
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,389 @@
+"""
+Delt cache for varme lesinger (coach-katalog, matsøk, /api/me-profil).
+
+To nivåer:
+  L1 – LRU i prosessen (alltid), maks CACHE_L1_MAX_ENTRIES oppføringer
+  L2 – valgfri delt backend (CACHE_BACKEND): "postgres" (UNLOGGED tabell app_cache) eller
+       "redis" (CACHE_REDIS_URL, krever pakken redis). "memory" (default) = kun L1.
+
+Nøkler er navnerom + nøkkel. Hvert navnerom har en versjon (cache_versions) som inngår i
+nøkkelen; invalidate(ns) øker versjonen (i samme transaksjon som endringen, om cur gis) og
+pg_notify når alle workere ved commit – gamle oppføringer blir da utilgjengelige, også i L2,
+uten å slettes. invalidate_key(ns, key) fjerner én nøkkel (f.eks. én brukers profil) fra L1
+og L2 i hver worker. En trigger på users sender invalidering for "me" og "coaches", så alle
+kodeveier som endrer brukere er dekket.
+
+Stampede: samtidige bommer på samme nøkkel i én prosess venter på én beregning
+(single-flight), og utløp spres mellom workere med sannsynlighetsbasert tidlig oppfrisking
+(XFetch). En beregning som overlapper en invalidering lagres ikke.
+
+Uten aktiv LISTEN-tilkobling (oppstart, DB-brudd) brukes ikke cachen – uten invalidering er
+det ingen garanti, så verdiene beregnes direkte. Verdier må være JSON-native
+(str/int/float/bool/None/list/dict), så de er like fra L1 og L2.
+"""
+import itertools
+import json
+import math
+import os
+import random
+import select
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+import orjson
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from .database import DATABASE_URL, get_connection, get_cursor
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "10000"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# XFetch: høyere beta = tidligere oppfrisking før utløp
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))
+# Så lenge venter en forespørsel på en annen som beregner samme nøkkel
+CACHE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv("CACHE_FLIGHT_TIMEOUT_SECONDS", "10"))
+CACHE_RECONNECT_SECONDS = float(os.getenv("CACHE_RECONNECT_SECONDS", "5"))
+CACHE_CHANNEL = "hercules_cache"
+
+
+# --- Backends ---
+class MemoryBackend:
+    """LRU i prosessen. Konvolutten lagres som objekt (ingen serialisering) – ikke muter verdier."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            env = self._data.get(key)
+            if env is None:
+                return None
+            if env["x"] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return env
+
+    def set(self, key: str, env: dict, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = env
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class PostgresBackend:
+    """UNLOGGED tabell app_cache. Utløpte rader ryddes ved hver CLEANUP_EVERY-te skriving."""
+
+    CLEANUP_EVERY = 200
+
+    def __init__(self):
+        self._writes = itertools.count(1)
+
+    def get(self, key: str) -> dict | None:
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute("SELECT value FROM app_cache WHERE key = %s AND expires_at > NOW()", (key,))
+                row = cur.fetchone()
+            finally:
+                cur.close()
+        return orjson.loads(bytes(row["value"])) if row else None
+
+    def set(self, key: str, env: dict, ttl: float) -> None:
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute(
+                    """
+                    INSERT INTO app_cache (key, value, expires_at)
+                    VALUES (%s, %s, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+                    """,
+                    (key, orjson.dumps(env), ttl),
+                )
+                if next(self._writes) % self.CLEANUP_EVERY == 0:
+                    cur.execute("DELETE FROM app_cache WHERE expires_at < NOW()")
+            finally:
+                cur.close()
+
+    def delete(self, key: str) -> None:
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute("DELETE FROM app_cache WHERE key = %s", (key,))
+            finally:
+                cur.close()
+
+
+class RedisBackend:
+    PREFIX = "hercules:cache:"
+
+    def __init__(self, url: str):
+        import redis  # valgfri avhengighet, kun for CACHE_BACKEND=redis
+
+        self._r = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+
+    def get(self, key: str) -> dict | None:
+        data = self._r.get(self.PREFIX + key)
+        return orjson.loads(data) if data else None
+
+    def set(self, key: str, env: dict, ttl: float) -> None:
+        self._r.set(self.PREFIX + key, orjson.dumps(env), ex=max(1, math.ceil(ttl)))
+
+    def delete(self, key: str) -> None:
+        self._r.delete(self.PREFIX + key)
+
+
+def _make_l2():
+    if CACHE_BACKEND == "postgres":
+        return PostgresBackend()
+    if CACHE_BACKEND == "redis":
+        return RedisBackend(CACHE_REDIS_URL)
+    return None
+
+
+_l1 = MemoryBackend(CACHE_L1_MAX_ENTRIES)
+_l2 = _make_l2()
+
+
+def _l2_call(method: str, *args):
+    """L2-feil skal aldri stoppe en forespørsel: logg og oppfør deg som bom."""
+    try:
+        return getattr(_l2, method)(*args)
+    except Exception as e:
+        print(f"[cache] L2 {method} feilet: {e}")  # noqa: T201
+        return None
+
+
+# --- Versjoner og invalidering ---
+_state_lock = threading.Lock()
+_versions: dict[str, int] = {}
+_listening = False
+# Teller for mottatte invalideringer; en beregning startet før siste invalidering av sin
+# nøkkel/sitt navnerom lagres ikke (ville lagt inn data lest før endringen)
+_generation = 0
+_reset_generation = 0
+_ns_generation: dict[str, int] = {}
+_key_generation: OrderedDict[tuple[str, str], int] = OrderedDict()
+_KEY_GENERATION_MAX = 10_000
+
+
+def _namespace_version(namespace: str) -> int:
+    version = _versions.get(namespace)
+    if version is not None:
+        return version
+    # Primær: en replika kan ligge bak cache_bump og gi en versjon som alt er invalidert
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT version FROM cache_versions WHERE namespace = %s", (namespace,))
+            row = cur.fetchone()
+        finally:
+            cur.close()
+    version = row["version"] if row else 0
+    with _state_lock:
+        # Kan ha fått nyere versjon via NOTIFY mens vi leste
+        version = max(version, _versions.get(namespace, version))
+        _versions[namespace] = version
+    return version
+
+
+def _invalidated_since(namespace: str, key: str, generation: int) -> bool:
+    with _state_lock:
+        return max(
+            _reset_generation,
+            _ns_generation.get(namespace, 0),
+            _key_generation.get((namespace, key), 0),
+        ) > generation
+
+
+def _on_message(payload: str) -> None:
+    global _generation
+    try:
+        msg = json.loads(payload)
+        namespace = msg["ns"]
+    except (ValueError, KeyError, TypeError):
+        return
+    key = msg.get("key")
+    with _state_lock:
+        _generation += 1
+        if key is None:
+            _ns_generation[namespace] = _generation
+            version = int(msg.get("v") or 0)
+            if version > _versions.get(namespace, -1):
+                _versions[namespace] = version
+            return
+        _key_generation[(namespace, key)] = _generation
+        _key_generation.move_to_end((namespace, key))
+        while len(_key_generation) > _KEY_GENERATION_MAX:
+            _key_generation.popitem(last=False)
+    full_key = f"{namespace}:{_namespace_version(namespace)}:{key}"
+    _l1.delete(full_key)
+    if _l2 is not None:
+        _l2_call("delete", full_key)
+
+
+def _reset() -> None:
+    """Ny LISTEN-tilkobling: invalideringer kan ha gått tapt, så start L1/versjoner på nytt."""
+    global _generation, _reset_generation
+    with _state_lock:
+        _generation += 1
+        _reset_generation = _generation
+        _versions.clear()
+        _ns_generation.clear()
+        _key_generation.clear()
+    _l1.clear()
+
+
+def invalidate(namespace: str, cur=None) -> None:
+    """Øk navnerommets versjon. Med cur: i samme transaksjon (gjelder fra commit)."""
+    if cur is not None:
+        cur.execute("SELECT cache_bump(%s)", (namespace,))
+        return
+    with get_connection() as conn:
+        c = get_cursor(conn)
+        try:
+            c.execute("SELECT cache_bump(%s)", (namespace,))
+        finally:
+            c.close()
+
+
+def invalidate_key(namespace: str, key: str, cur=None) -> None:
+    if cur is not None:
+        cur.execute("SELECT cache_invalidate_key(%s, %s)", (namespace, key))
+        return
+    with get_connection() as conn:
+        c = get_cursor(conn)
+        try:
+            c.execute("SELECT cache_invalidate_key(%s, %s)", (namespace, key))
+        finally:
+            c.close()
+
+
+# --- Oppslag ---
+class _Flight:
+    __slots__ = ("done", "value", "ok")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.ok = False
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _refresh_early(env: dict) -> bool:
+    """XFetch: sannsynligheten for oppfrisking øker mot utløp, skalert med beregningstiden."""
+    return time.time() - env["d"] * CACHE_XFETCH_BETA * math.log(1.0 - random.random()) >= env["x"]
+
+
+def _compute_and_store(namespace: str, key: str, full_key: str, ttl: float, compute: Callable[[], Any]):
+    generation = _generation
+    start = time.time()
+    value = compute()
+    now = time.time()
+    if _invalidated_since(namespace, key, generation):
+        return value
+    env = {"v": value, "d": now - start, "x": now + ttl}
+    _l1.set(full_key, env, ttl)
+    if _l2 is not None:
+        _l2_call("set", full_key, env, ttl)
+    return value
+
+
+def get_or_compute(namespace: str, key: str, ttl: float, compute: Callable[[], Any]) -> Any:
+    """Verdi fra cache, ellers compute() (én gang per nøkkel og prosess) og lagre i ttl sekunder."""
+    if not CACHE_ENABLED or not _listening:
+        return compute()
+    full_key = f"{namespace}:{_namespace_version(namespace)}:{key}"
+    env = _l1.get(full_key)
+    if env is None and _l2 is not None:
+        env = _l2_call("get", full_key)
+        if env is not None:
+            _l1.set(full_key, env, env["x"] - time.time())
+    if env is not None and not _refresh_early(env):
+        return env["v"]
+
+    with _flights_lock:
+        flight = _flights.get(full_key)
+        leader = flight is None
+        if leader:
+            flight = _flights[full_key] = _Flight()
+    if not leader:
+        if env is not None:
+            return env["v"]  # tidlig oppfrisking pågår allerede – bruk gjeldende verdi
+        if flight.done.wait(CACHE_FLIGHT_TIMEOUT_SECONDS) and flight.ok:
+            return flight.value
+        return compute()
+    try:
+        flight.value = _compute_and_store(namespace, key, full_key, ttl, compute)
+        flight.ok = True
+        return flight.value
+    finally:
+        with _flights_lock:
+            _flights.pop(full_key, None)
+        flight.done.set()
+
+
+# --- LISTEN-tråd ---
+def _listen(stop: threading.Event) -> None:
+    global _listening
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {CACHE_CHANNEL}")
+            cur.close()
+            _reset()
+            _listening = True
+            while not stop.is_set():
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _on_message(conn.notifies.pop(0).payload)
+        except (psycopg2.Error, OSError) as e:
+            print(f"[cache] LISTEN-feil, cache av til tilkoblingen er tilbake: {e}")  # noqa: T201
+            _listening = False
+            stop.wait(CACHE_RECONNECT_SECONDS)
+        finally:
+            _listening = False
+            if conn is not None:
+                conn.close()
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def start_cache_listener() -> None:
+    """Start LISTEN-tråden (idempotent). Gjør ingenting hvis CACHE_ENABLED er av."""
+    global _thread
+    if not CACHE_ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_listen, args=(_stop,), name="cache-listen", daemon=True)
+    _thread.start()
+
+
+def stop_cache_listener() -> None:
+    _stop.set()
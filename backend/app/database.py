@@ -1,8 +1,13 @@
+import itertools
 import os
+import threading
+import time
 from contextlib import contextmanager
-from typing import Generator
+from contextvars import ContextVar
+from typing import Callable, Generator
 
 import psycopg2
+from psycopg2.extensions import cursor as _BaseCursor
 from psycopg2.extras import RealDictCursor
 
 DATABASE_URL = os.getenv(
@@ -10,10 +15,173 @@ DATABASE_URL = os.getenv(
     "postgresql://hercules:hercules@db:5432/hercules",
 )
 
+# Lesereplikaer (kommaseparert). Tom = all lesing går mot DATABASE_URL.
+DATABASE_READ_URLS = [u.strip() for u in os.getenv("DATABASE_READ_URLS", "").split(",") if u.strip()]
+REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.getenv("REPLICA_CONNECT_TIMEOUT_SECONDS", "2"))
+# Replika som ikke svarer / ligger for langt etter hoppes over så lenge
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL_SECONDS", "5"))
+# Etter at en klient har skrevet, leser den fra primær så lenge (les-egne-skrivinger). Aldri kortere
+# enn en replika kan ligge etter før den hoppes over (maks lag + intervallet mellom lag-sjekkene).
+READ_YOUR_WRITES_SECONDS = max(
+    float(os.getenv("READ_YOUR_WRITES_SECONDS", "15")),
+    REPLICA_MAX_LAG_SECONDS + REPLICA_LAG_CHECK_INTERVAL_SECONDS,
+)
+
+# Hooks for måling (metrics/profilering): kalles etter hver execute og hver ny tilkobling.
+# Query-hook: (statement, params, varighet_sek, rowcount). Connect-hook: (varighet_sek).
+_query_hooks: list[Callable] = []
+_connect_hooks: list[Callable] = []
+
+
+def register_query_hook(hook: Callable) -> None:
+    if hook not in _query_hooks:
+        _query_hooks.append(hook)
+
+
+def register_connect_hook(hook: Callable) -> None:
+    if hook not in _connect_hooks:
+        _connect_hooks.append(hook)
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        if not _query_hooks:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in _query_hooks:
+                hook(query, vars, elapsed, self.rowcount)
+
+
+class TimedCursor(_TimedCursorMixin, _BaseCursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedCursorMixin, RealDictCursor):
+    pass
+
+
+def _connect(url: str, **kwargs):
+    start = time.perf_counter()
+    conn = psycopg2.connect(url, cursor_factory=TimedCursor, **kwargs)
+    for hook in _connect_hooks:
+        hook(time.perf_counter() - start)
+    return conn
+
+
+class _Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.down_until = 0.0
+        self.lag_checked_at = 0.0
+
+
+_replicas = [_Replica(u) for u in DATABASE_READ_URLS]
+_replica_rr = itertools.count()
+
+# Epoch-tidspunkt der klienten bak gjeldende forespørsel igjen kan lese fra replika. Markøren
+# følger klienten (cookie/header, se read_your_writes.py), så den gjelder på tvers av workere og replikaer.
+_primary_until: ContextVar[float] = ContextVar("primary_until", default=0.0)
+
+
+def replicas_enabled() -> bool:
+    return bool(_replicas)
+
+
+def new_write_marker() -> str:
+    """Markør for en skrivende forespørsel: les fra primær til og med returnert tidspunkt."""
+    until = time.time() + READ_YOUR_WRITES_SECONDS
+    _primary_until.set(until)
+    return f"{until:.3f}"
+
+
+def use_write_marker(value: str | None) -> None:
+    """Markør fra klienten. Ugyldig, utløpt eller urimelig langt frem i tid ignoreres."""
+    try:
+        until = float(value)
+    except (TypeError, ValueError):
+        return
+    now = time.time()
+    if now < until <= now + READ_YOUR_WRITES_SECONDS + 1:
+        _primary_until.set(until)
+
+
+def _wrote_recently(user_id) -> bool:
+    if user_id is None:
+        return False
+    return _primary_until.get() > time.time()
+
+
+def _replica_lag_seconds(conn) -> float:
+    # Ingen ventende WAL = à jour (også når primær er i ro); ikke-replika (pg_is_in_recovery false) = 0
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+            END
+            """
+        )
+        return float(cur.fetchone()[0])
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+def _replica_connection():
+    """Round-robin over friske replikaer. None hvis ingen er tilgjengelig (→ primær)."""
+    n = len(_replicas)
+    first = next(_replica_rr)
+    for i in range(n):
+        r = _replicas[(first + i) % n]
+        now = time.monotonic()
+        if r.down_until > now:
+            continue
+        try:
+            conn = _connect(r.url, connect_timeout=REPLICA_CONNECT_TIMEOUT_SECONDS)
+        except psycopg2.OperationalError as e:
+            r.down_until = now + REPLICA_RETRY_SECONDS
+            print(f"Lesereplika utilgjengelig, bruker neste/primær i {REPLICA_RETRY_SECONDS:.0f}s: {e}")  # noqa: T201
+            continue
+        if now - r.lag_checked_at >= REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+            try:
+                lag = _replica_lag_seconds(conn)
+            except psycopg2.Error:
+                lag = float("inf")
+            r.lag_checked_at = now
+            if lag > REPLICA_MAX_LAG_SECONDS:
+                r.down_until = now + REPLICA_RETRY_SECONDS
+                conn.close()
+                print(f"Lesereplika {lag:.1f}s etter primær, hoppes over i {REPLICA_RETRY_SECONDS:.0f}s")  # noqa: T201
+                continue
+        return conn
+    return None
+
 
 @contextmanager
-def get_connection() -> Generator:
-    conn = psycopg2.connect(DATABASE_URL)
+def get_connection(read_only: bool = False, user_id=None) -> Generator:
+    """
+    Tilkobling i én transaksjon (commit ved suksess, rollback ved feil).
+
+    read_only=True: ren lesing som kan gå til en replika (DATABASE_READ_URLS) – round-robin,
+    med fallback til primær når ingen replika er frisk. Oppgi user_id så en bruker som
+    nettopp har skrevet leser fra primær og ser sine egne endringer.
+    """
+    conn = None
+    if read_only and _replicas and not _wrote_recently(user_id):
+        conn = _replica_connection()
+    if conn is None:
+        conn = _connect(DATABASE_URL)
+    if read_only:
+        conn.set_session(readonly=True)
     try:
         yield conn
         conn.commit()
@@ -24,5 +192,15 @@ def get_connection() -> Generator:
         conn.close()
 
 
+def get_autocommit_connection():
+    """
+    Kortlevd primærtilkobling i autocommit (f.eks. for sesjonslåser), med de samme
+    tilkoblings- og spørringshookene som get_connection. Kalleren lukker den.
+    """
+    conn = _connect(DATABASE_URL)
+    conn.autocommit = True
+    return conn
+
+
 def get_cursor(conn):
-    return conn.cursor(cursor_factory=RealDictCursor)
+    return conn.cursor(cursor_factory=TimedRealDictCursor)
@@ -0,0 +1,232 @@
+"""
+Estimert energiforbruk (TDEE) fra logget inntak og vektutvikling – nattlig batch (jobben
+energy-estimates).
+
+Over tid er energibalansen: inntak − forbruk = endring i kroppsvekt × ~7700 kcal/kg. Med
+snittinntaket og vekttrenden (minste kvadraters stigning) over de siste ENERGY_WINDOW_DAYS
+dagene blir forbruket
+
+    tdee = snitt kcal/dag − stigning (kg/dag) × ENERGY_KCAL_PER_KG
+
+Jobben henter daglig kcal og vekt for alle brukere med måltider i vinduet i to spørringer,
+legger dem i to matriser (bruker × dag, NaN der det mangler) og regner ut snitt, regresjon
+og usikkerhet for alle brukere samtidig med NumPy – ingen løkke per bruker. Resultatet
+skrives til energy_estimates med én upsert og vises i GET /api/me (energy).
+
+Dager med under ENERGY_MIN_DAY_KCAL regnes som ufullstendig logget og telles ikke. Brukere
+uten nok data (ENERGY_MIN_INTAKE_DAYS / ENERGY_MIN_WEIGHT_DAYS / ENERGY_MIN_SPAN_DAYS) eller
+med urimelig resultat får ingen estimat, og et gammelt estimat slettes.
+"""
+import os
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from .cache import invalidate
+from .database import get_connection, get_cursor
+
+ENERGY_WINDOW_DAYS = int(os.getenv("ENERGY_WINDOW_DAYS", "56"))
+ENERGY_MIN_INTAKE_DAYS = int(os.getenv("ENERGY_MIN_INTAKE_DAYS", "14"))
+ENERGY_MIN_WEIGHT_DAYS = int(os.getenv("ENERGY_MIN_WEIGHT_DAYS", "4"))
+# Avstand mellom første og siste veiing – kortere trend er mest vann og tarminnhold
+ENERGY_MIN_SPAN_DAYS = int(os.getenv("ENERGY_MIN_SPAN_DAYS", "28"))
+ENERGY_MIN_DAY_KCAL = float(os.getenv("ENERGY_MIN_DAY_KCAL", "800"))
+ENERGY_KCAL_PER_KG = float(os.getenv("ENERGY_KCAL_PER_KG", "7700"))
+# Forslag: underskudd for ~0,5 kg/uke ned, overskudd for rolig oppbygging
+ENERGY_DEFICIT_KCAL = float(os.getenv("ENERGY_DEFICIT_KCAL", "500"))
+ENERGY_SURPLUS_KCAL = float(os.getenv("ENERGY_SURPLUS_KCAL", "250"))
+ENERGY_MIN_TARGET_KCAL = float(os.getenv("ENERGY_MIN_TARGET_KCAL", "1200"))
+# Estimater utenfor dette skyldes nesten alltid mangelfull logging
+_TDEE_RANGE = (1000.0, 6000.0)
+
+_DAILY_KCAL_SQL = """
+    WITH e AS (
+        SELECT m.user_id, me.log_date, me.food_product_id, me.recipe_id, me.amount_gram, me.portions
+        FROM meal_entries me
+        JOIN meals m ON m.id = me.meal_id AND m.log_date = me.log_date
+        WHERE m.log_date >= %(from)s AND m.log_date < %(to)s
+          AND me.log_date >= %(from)s AND me.log_date < %(to)s
+    ),
+    rt AS (
+        SELECT ri.recipe_id, SUM(fp.kcal_per_100 * ri.grams / 100) AS kcal
+        FROM recipe_ingredients ri
+        JOIN food_products fp ON fp.id = ri.food_product_id
+        WHERE ri.recipe_id IN (SELECT recipe_id FROM e WHERE recipe_id IS NOT NULL)
+        GROUP BY ri.recipe_id
+    )
+    SELECT e.user_id::text, e.log_date - %(from)s::date,
+           SUM(COALESCE(fp.kcal_per_100 * e.amount_gram / 100, rt.kcal * e.portions, 0))::float8
+    FROM e
+    LEFT JOIN food_products fp ON fp.id = e.food_product_id
+    LEFT JOIN rt ON rt.recipe_id = e.recipe_id
+    GROUP BY 1, 2
+"""
+
+_WEIGHT_SQL = """
+    SELECT user_id::text, log_date - %(from)s::date, weight_kg::float8
+    FROM weight_entries
+    WHERE log_date >= %(from)s AND log_date < %(to)s
+"""
+
+
+def _matrix(rows: list[tuple], users: np.ndarray, days: int) -> np.ndarray:
+    """(bruker, dagindeks, verdi)-rader → matrise bruker × dag, NaN der det mangler."""
+    out = np.full((len(users), days), np.nan)
+    if not rows:
+        return out
+    ids, day_idx, values = zip(*rows)
+    ids = np.array(ids)
+    row = np.searchsorted(users, ids)
+    known = (row < len(users)) & (users[np.minimum(row, len(users) - 1)] == ids)
+    out[row[known], np.array(day_idx)[known]] = np.array(values, dtype=np.float64)[known]
+    return out
+
+
+def estimate(kcal: np.ndarray, weight: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    TDEE for alle brukere på én gang. kcal og weight er bruker × dag (NaN = ikke logget).
+    Returnerer arrays med én verdi per bruker; valid sier hvem som har nok data.
+    """
+    kcal = np.where(kcal >= ENERGY_MIN_DAY_KCAL, kcal, np.nan)
+    k_mask = ~np.isnan(kcal)
+    intake_days = k_mask.sum(axis=1)
+    k_n = np.maximum(intake_days, 1)
+    intake = np.where(k_mask, kcal, 0).sum(axis=1) / k_n
+    intake_var = np.where(k_mask, (kcal - intake[:, None]) ** 2, 0).sum(axis=1) / np.maximum(intake_days - 1, 1)
+
+    # Vekttrend: minste kvadraters stigning per rad, bare over dager med veiing
+    w_mask = ~np.isnan(weight)
+    weight_days = w_mask.sum(axis=1)
+    w_n = np.maximum(weight_days, 1)
+    x = np.arange(weight.shape[1], dtype=np.float64)
+    x_mean = (w_mask * x).sum(axis=1) / w_n
+    y_mean = np.where(w_mask, weight, 0).sum(axis=1) / w_n
+    dx = np.where(w_mask, x - x_mean[:, None], 0)
+    dy = np.where(w_mask, weight - y_mean[:, None], 0)
+    sxx = (dx**2).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (dx * dy).sum(axis=1) / sxx
+        resid = np.where(w_mask, dy - slope[:, None] * dx, 0)
+        slope_var = (resid**2).sum(axis=1) / np.maximum(weight_days - 2, 1) / sxx
+    first = np.where(w_mask, x, np.inf).min(axis=1)
+    last = np.where(w_mask, x, -np.inf).max(axis=1)
+
+    tdee = intake - slope * ENERGY_KCAL_PER_KG
+    # Usikkerhet (1 SD) fra både vekttrend og variasjon i inntaket
+    error = np.sqrt(slope_var * ENERGY_KCAL_PER_KG**2 + intake_var / k_n)
+    valid = (
+        (intake_days >= ENERGY_MIN_INTAKE_DAYS)
+        & (weight_days >= ENERGY_MIN_WEIGHT_DAYS)
+        & (last - first >= ENERGY_MIN_SPAN_DAYS)
+        & np.isfinite(tdee)
+        & (tdee >= _TDEE_RANGE[0])
+        & (tdee <= _TDEE_RANGE[1])
+    )
+    return {
+        "valid": valid,
+        "intake_days": intake_days,
+        "weight_days": weight_days,
+        "intake": intake,
+        "trend_kg_week": slope * 7,
+        "tdee": tdee,
+        "error": error,
+        "lose": np.maximum(tdee - ENERGY_DEFICIT_KCAL, ENERGY_MIN_TARGET_KCAL),
+        "gain": tdee + ENERGY_SURPLUS_KCAL,
+    }
+
+
+def _kcal(values: np.ndarray) -> list[int]:
+    """Avrundet til nærmeste 10 kcal – mer presisjon enn det er grunnlag for."""
+    return (np.round(values / 10) * 10).astype(int).tolist()
+
+
+def compute_estimates(today: date | None = None) -> dict:
+    """Jobben energy-estimates: beregn og lagre estimat for alle aktive brukere."""
+    to_date = today or date.today()
+    from_date = to_date - timedelta(days=ENERGY_WINDOW_DAYS)
+    params = {"from": from_date, "to": to_date}
+    started = datetime.now(timezone.utc)
+    with get_connection(read_only=True) as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(_DAILY_KCAL_SQL, params)
+            kcal_rows = cur.fetchall()
+            cur.execute(_WEIGHT_SQL, params)
+            weight_rows = cur.fetchall()
+        finally:
+            cur.close()
+
+    users = np.unique(np.array([r[0] for r in kcal_rows], dtype=str))
+    result = estimate(
+        _matrix(kcal_rows, users, ENERGY_WINDOW_DAYS),
+        _matrix(weight_rows, users, ENERGY_WINDOW_DAYS),
+    )
+    v = result["valid"]
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            if v.any():
+                cur.execute(
+                    """
+                    INSERT INTO energy_estimates (
+                        user_id, window_start, window_end, intake_days, weight_days, intake_kcal,
+                        weight_trend_kg_week, tdee_kcal, tdee_error_kcal, target_lose_kcal, target_gain_kcal,
+                        computed_at
+                    )
+                    SELECT e.user_id, %s, %s, e.intake_days, e.weight_days, e.intake, e.trend, e.tdee, e.error,
+                           e.lose, e.gain, %s
+                    FROM unnest(%s::uuid[], %s::int[], %s::int[], %s::int[], %s::float8[], %s::int[], %s::int[],
+                                %s::int[], %s::int[])
+                         AS e(user_id, intake_days, weight_days, intake, trend, tdee, error, lose, gain)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        window_start = EXCLUDED.window_start, window_end = EXCLUDED.window_end,
+                        intake_days = EXCLUDED.intake_days, weight_days = EXCLUDED.weight_days,
+                        intake_kcal = EXCLUDED.intake_kcal, weight_trend_kg_week = EXCLUDED.weight_trend_kg_week,
+                        tdee_kcal = EXCLUDED.tdee_kcal, tdee_error_kcal = EXCLUDED.tdee_error_kcal,
+                        target_lose_kcal = EXCLUDED.target_lose_kcal, target_gain_kcal = EXCLUDED.target_gain_kcal,
+                        computed_at = EXCLUDED.computed_at
+                    """,
+                    (
+                        from_date,
+                        to_date - timedelta(days=1),
+                        started,
+                        users[v].tolist(),
+                        result["intake_days"][v].tolist(),
+                        result["weight_days"][v].tolist(),
+                        _kcal(result["intake"][v]),
+                        np.round(result["trend_kg_week"][v], 2).tolist(),
+                        _kcal(result["tdee"][v]),
+                        _kcal(result["error"][v]),
+                        _kcal(result["lose"][v]),
+                        _kcal(result["gain"][v]),
+                    ),
+                )
+            # Brukere som ikke lenger har nok data skal ikke se et gammelt estimat
+            cur.execute("DELETE FROM energy_estimates WHERE computed_at < %s", (started,))
+            removed = cur.rowcount
+            invalidate("me", cur)
+        finally:
+            cur.close()
+    return {"users": len(users), "estimated": int(v.sum()), "removed": removed}
+
+
+def energy_payload(row: dict) -> dict | None:
+    """energy_estimates-rad (eller None) → JSON-native del av /api/me."""
+    if not row or row.get("tdee_kcal") is None:
+        return None
+    return {
+        "tdee_kcal": row["tdee_kcal"],
+        "tdee_error_kcal": row["tdee_error_kcal"],
+        "intake_kcal": row["intake_kcal"],
+        "weight_trend_kg_week": float(row["weight_trend_kg_week"]),
+        "intake_days": row["intake_days"],
+        "weight_days": row["weight_days"],
+        "window_start": row["window_start"].isoformat(),
+        "window_end": row["window_end"].isoformat(),
+        "computed_at": row["computed_at"].isoformat(),
+        "targets": {
+            "lose": row["target_lose_kcal"],
+            "maintain": row["tdee_kcal"],
+            "gain": row["target_gain_kcal"],
+        },
+    }
@@ -0,0 +1,201 @@
+"""
+Sanntidshendelser til innloggede økter (Server-Sent Events) via Postgres LISTEN/NOTIFY.
+
+Skriving (måltid, vekt, coach-tilgang start/slutt) kaller publish* på samme cursor som
+endringen, så NOTIFY sendes først ved commit – og aldri for en rullet tilbake transaksjon.
+Hver worker-prosess har én LISTEN-tilkobling (bakgrunnstråd) som fordeler hendelsene til
+abonnentene sine. En åpen SSE-strøm er bare en asyncio-kø: ingen tråd og ingen DB-tilkobling
+per klient, så tusenvis av ledige tilkoblinger per worker er greit.
+
+Hendelse (SSE "data:"): {"type": "meal_logged", "data": {"user_id": ..., "log_date": ...}}.
+"resync" betyr at hendelser kan ha gått tapt (full kø / LISTEN koblet til på nytt) –
+klienten henter da data på nytt som før.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from .database import DATABASE_URL
+
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+EVENTS_CHANNEL = "hercules_events"
+# Kommentar-linje så proxyer/lastbalanserere ikke lukker ledige strømmer
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "25"))
+EVENTS_MAX_CONNECTIONS = int(os.getenv("EVENTS_MAX_CONNECTIONS", "5000"))  # per worker
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_RECONNECT_SECONDS = float(os.getenv("EVENTS_RECONNECT_SECONDS", "5"))
+# Kortlevd token for EventSource (som ikke kan sende Authorization-header)
+EVENTS_TOKEN_EXPIRES_SECONDS = int(os.getenv("EVENTS_TOKEN_EXPIRES_SECONDS", "60"))
+
+
+# --- Publisering (kalles i samme transaksjon som endringen) ---
+def publish(cur, user_ids, event_type: str, data: dict | None = None) -> None:
+    payload = {"u": [str(u) for u in user_ids], "t": event_type, "d": data or {}}
+    cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, json.dumps(payload)))
+
+
+def publish_to_user_and_coaches(cur, user_id, event_type: str, data: dict | None = None) -> None:
+    """Brukeren selv (andre enheter/faner) og aktive coacher, i én setning."""
+    cur.execute(
+        """
+        SELECT pg_notify(%s, json_build_object(
+            'u', ARRAY(SELECT coach_id::text FROM kunde_coach WHERE kunde_id = %s AND slutt_dato > NOW())
+                 || %s::text,
+            't', %s,
+            'd', %s::json
+        )::text)
+        """,
+        (EVENTS_CHANNEL, str(user_id), str(user_id), event_type, json.dumps(data or {})),
+    )
+
+
+# --- Abonnenter (per worker) ---
+class _Subscriber:
+    __slots__ = ("user_id", "queue", "loop", "overflowed")
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.loop = loop
+        self.overflowed = False
+
+    def offer(self, event: dict) -> None:
+        """Kjøres i event-loopen (call_soon_threadsafe)."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+_subscribers: dict[str, set[_Subscriber]] = defaultdict(set)
+_subscriber_count = 0
+_lock = threading.Lock()
+
+
+def connection_count() -> int:
+    return _subscriber_count
+
+
+def _subscribe(user_id: str) -> _Subscriber:
+    global _subscriber_count
+    sub = _Subscriber(user_id, asyncio.get_running_loop())
+    with _lock:
+        _subscribers[user_id].add(sub)
+        _subscriber_count += 1
+    return sub
+
+
+def _unsubscribe(sub: _Subscriber) -> None:
+    global _subscriber_count
+    with _lock:
+        subs = _subscribers.get(sub.user_id)
+        if subs and sub in subs:
+            subs.discard(sub)
+            _subscriber_count -= 1
+            if not subs:
+                del _subscribers[sub.user_id]
+
+
+def _deliver(targets: list[_Subscriber], event: dict) -> None:
+    for sub in targets:
+        try:
+            sub.loop.call_soon_threadsafe(sub.offer, event)
+        except RuntimeError:  # loopen er lukket (shutdown)
+            pass
+
+
+def _dispatch(payload: str) -> None:
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        return
+    event = {"type": msg.get("t"), "data": msg.get("d") or {}}
+    with _lock:
+        targets = [sub for uid in msg.get("u", ()) for sub in _subscribers.get(uid, ())]
+    _deliver(targets, event)
+
+
+def _broadcast_resync() -> None:
+    with _lock:
+        targets = [sub for subs in _subscribers.values() for sub in subs]
+    _deliver(targets, {"type": "resync", "data": {}})
+
+
+# --- LISTEN-tråd ---
+def _listen(stop: threading.Event) -> None:
+    first = True
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            cur.execute(f"LISTEN {EVENTS_CHANNEL}")
+            cur.close()
+            if not first:
+                _broadcast_resync()  # hendelser mens vi var frakoblet er tapt
+            first = False
+            while not stop.is_set():
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _dispatch(conn.notifies.pop(0).payload)
+        except (psycopg2.Error, OSError) as e:
+            print(f"[events] LISTEN-feil: {e}")  # noqa: T201
+            stop.wait(EVENTS_RECONNECT_SECONDS)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def start_listener() -> None:
+    """Start LISTEN-tråden (idempotent). Gjør ingenting hvis EVENTS_ENABLED er av."""
+    global _thread
+    if not EVENTS_ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_listen, args=(_stop,), name="events-listen", daemon=True)
+    _thread.start()
+
+
+def stop_listener() -> None:
+    _stop.set()
+
+
+# --- SSE-strøm ---
+def _format(event: dict) -> bytes:
+    # Kun "data:" (ingen "event:"), så EventSource.onmessage får alle typer
+    return f"data: {json.dumps(event)}\n\n".encode()
+
+
+async def stream(user_id: str):
+    """Asynkron generator for StreamingResponse. Avsluttes (finally) når klienten kobler fra."""
+    sub = _subscribe(user_id)
+    try:
+        yield f"retry: {int(EVENTS_RECONNECT_SECONDS * 1000)}\n\n".encode()
+        yield _format({"type": "ready", "data": {}})
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if sub.overflowed:
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.overflowed = False
+                event = {"type": "resync", "data": {}}
+            yield _format(event)
+    finally:
+        _unsubscribe(sub)
@@ -0,0 +1,444 @@
+"""
+Dataeksport for brukeren (GDPR art. 15 og 20): GET /api/me/export.
+
+Zip med profil, måltider (én rad per ingrediens; et tomt måltid gir én rad uten ingrediens),
+måltidsmaler, vekt, aktivitet, oppskrifter, egne matvarer, coach-forhold og salgsdokumenter – CSV for tabeller (UTF-8 med BOM, så Excel viser æøå),
+JSON for profil og oppskrifter (med ingredienser).
+
+Minnebruken er flat uansett hvor mange år med logger brukeren har:
+- radene leses med server-side cursor (DECLARE/FETCH, EXPORT_FETCH_ROWS om gangen),
+- zip-filen skrives inkrementelt (zipfile mot en ikke-søkbar strøm, data descriptor per
+  fil), og ferdige bytes sendes videre med en gang i stedet for å samle arkivet i minnet.
+Alt leses i én REPEATABLE READ-transaksjon, så filene er et konsistent øyeblikksbilde.
+
+Små eksporter strømmes rett i svaret. Store (flere enn EXPORT_STREAM_MAX_ROWS måltider og
+vektrader til sammen) bygges i bakgrunnen til en tempfil, lastes opp til objektlagring
+under exports/ og hentes via kortlevd presignert URL (GET /api/me/exports/<id>).
+Jobben export-cleanup sletter filene etter EXPORT_RETENTION_HOURS.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+import zipfile
+from datetime import date, datetime
+from typing import Iterator
+
+from .database import get_connection, get_cursor
+from .storage import STORAGE_ENABLED, delete_object, presign_get, upload_fileobj
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "2000"))
+# Over dette (måltider + vektrader) bygges eksporten i bakgrunnen og leveres via lagring
+EXPORT_STREAM_MAX_ROWS = int(os.getenv("EXPORT_STREAM_MAX_ROWS", "10000"))
+EXPORT_RETENTION_HOURS = int(os.getenv("EXPORT_RETENTION_HOURS", "24"))
+EXPORT_URL_EXPIRES_SECONDS = int(os.getenv("EXPORT_URL_EXPIRES_SECONDS", "900"))
+# Bakgrunnseksport som ikke er ferdig etter så lenge (pod restartet) regnes som feilet
+EXPORT_STALE_MINUTES = int(os.getenv("EXPORT_STALE_MINUTES", "60"))
+# Private objekter – /api/media nekter dette prefikset
+EXPORT_PREFIX = "exports/"
+
+_FLUSH_BYTES = 64 * 1024
+
+# (filnavn, kolonner, SQL med %(user_id)s) – SELECT-listen følger kolonnene
+_CSV_SECTIONS = (
+    (
+        "maltider.csv",
+        (
+            "dato", "maltid_id", "maltid", "klokkeslett", "matvare_id", "matvare", "merke", "strekkode",
+            "gram", "oppskrift_id", "oppskrift", "porsjoner", "kcal", "protein", "karbohydrater", "fett",
+        ),
+        """
+        WITH recipe_totals AS (
+            SELECT ri.recipe_id,
+                   SUM(fp.kcal_per_100 * ri.grams / 100) AS kcal,
+                   SUM(fp.protein_per_100 * ri.grams / 100) AS protein,
+                   SUM(fp.carbs_per_100 * ri.grams / 100) AS carbs,
+                   SUM(fp.fat_per_100 * ri.grams / 100) AS fat
+            FROM recipes r
+            JOIN recipe_ingredients ri ON ri.recipe_id = r.id
+            JOIN food_products fp ON fp.id = ri.food_product_id
+            WHERE r.user_id = %(user_id)s
+            GROUP BY ri.recipe_id
+        )
+        SELECT m.log_date, m.id, m.name, m.time_slot, fp.id, fp.name, fp.brand, fp.barcode,
+               me.amount_gram, r.id, r.name, me.portions,
+               ROUND(COALESCE(fp.kcal_per_100 * me.amount_gram / 100, rt.kcal * me.portions, 0), 1),
+               ROUND(COALESCE(fp.protein_per_100 * me.amount_gram / 100, rt.protein * me.portions, 0), 1),
+               ROUND(COALESCE(fp.carbs_per_100 * me.amount_gram / 100, rt.carbs * me.portions, 0), 1),
+               ROUND(COALESCE(fp.fat_per_100 * me.amount_gram / 100, rt.fat * me.portions, 0), 1)
+        FROM meals m
+        LEFT JOIN meal_entries me ON me.meal_id = m.id AND me.log_date = m.log_date
+        LEFT JOIN food_products fp ON fp.id = me.food_product_id
+        LEFT JOIN recipes r ON r.id = me.recipe_id
+        LEFT JOIN recipe_totals rt ON rt.recipe_id = me.recipe_id
+        WHERE m.user_id = %(user_id)s
+        ORDER BY m.log_date, m.time_slot NULLS LAST, m.created_at, m.id
+        """,
+    ),
+    (
+        "maltidsmaler.csv",
+        (
+            "mal_id", "mal", "klokkeslett", "matvare_id", "matvare", "merke", "strekkode", "gram",
+            "oppskrift_id", "oppskrift", "porsjoner", "opprettet",
+        ),
+        """
+        SELECT t.id, t.name, t.time_slot, fp.id, fp.name, fp.brand, fp.barcode, te.amount_gram,
+               r.id, r.name, te.portions, t.created_at
+        FROM meal_templates t
+        LEFT JOIN meal_template_entries te ON te.template_id = t.id
+        LEFT JOIN food_products fp ON fp.id = te.food_product_id
+        LEFT JOIN recipes r ON r.id = te.recipe_id
+        WHERE t.user_id = %(user_id)s
+        ORDER BY t.created_at, t.id, fp.name NULLS LAST, r.name
+        """,
+    ),
+    (
+        "vekt.csv",
+        ("dato", "vekt_kg", "registrert"),
+        """
+        SELECT log_date, weight_kg, created_at
+        FROM weight_entries
+        WHERE user_id = %(user_id)s
+        ORDER BY log_date
+        """,
+    ),
+    (
+        "aktivitet_per_dag.csv",
+        (
+            "dato", "skritt", "puls_snitt", "puls_min", "puls_maks", "treningsokter", "trening_kcal",
+            "trening_minutter",
+        ),
+        """
+        SELECT day, steps, hr_avg, hr_min, hr_max, workouts, ROUND(workout_kcal), ROUND(workout_minutes)
+        FROM activity_daily
+        WHERE user_id = %(user_id)s
+        ORDER BY day
+        """,
+    ),
+    (
+        "treningsokter.csv",
+        ("kilde", "type", "start", "slutt", "kcal"),
+        """
+        SELECT source, activity, started_at, ended_at, value
+        FROM activity_samples
+        WHERE user_id = %(user_id)s AND kind = 'workout'
+        ORDER BY started_at
+        """,
+    ),
+    (
+        "egne_matvarer.csv",
+        (
+            "id", "navn", "merke", "strekkode", "kcal_per_100", "protein_per_100", "karbohydrater_per_100",
+            "fett_per_100", "opprettet",
+        ),
+        """
+        SELECT id, name, brand, barcode, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100, created_at
+        FROM food_products
+        WHERE user_id = %(user_id)s
+        ORDER BY created_at
+        """,
+    ),
+    (
+        "coach.csv",
+        ("rolle", "coach", "kunde", "start", "slutt", "opprettet"),
+        """
+        SELECT CASE WHEN kc.kunde_id = %(user_id)s THEN 'kunde' ELSE 'coach' END,
+               COALESCE(c.navn, c.email), COALESCE(k.navn, k.email),
+               kc.start_dato, kc.slutt_dato, kc.opprettet
+        FROM kunde_coach kc
+        JOIN users c ON c.id = kc.coach_id
+        JOIN users k ON k.id = kc.kunde_id
+        WHERE kc.kunde_id = %(user_id)s OR kc.coach_id = %(user_id)s
+        ORDER BY kc.start_dato
+        """,
+    ),
+    (
+        "salgsdokumenter.csv",
+        (
+            "type", "fakturanummer", "dato", "selger", "beskrivelse", "belop_eks_mva_ore", "mva_ore",
+            "total_ore", "valuta", "betalingsstatus", "kvittering_url",
+        ),
+        """
+        SELECT document_type, invoice_number, document_date, seller_name, description, amount_ex_vat_ore,
+               vat_ore, total_ore, currency, payment_status, stripe_pdf_url
+        FROM sales_documents
+        WHERE customer_id = %(user_id)s
+        ORDER BY document_date, created_at
+        """,
+    ),
+)
+
+_PROFILE_SQL = """
+    SELECT id, email, navn, rolle, coach_sokt, coach_godkjent, coach_beskrivelse, coach_spesialiseringer,
+           coach_bilde, coach_program_lengder, trial_ends_at, first_charge_done, payment_method_type,
+           account_blocked_at, opprettet, oppdatert
+    FROM users
+    WHERE id = %(user_id)s
+"""
+
+_RECIPES_SQL = """
+    SELECT r.id, r.name, r.description, r.created_at,
+           COALESCE(json_agg(json_build_object(
+               'matvare_id', fp.id, 'matvare', fp.name, 'gram', ri.grams
+           ) ORDER BY fp.name) FILTER (WHERE ri.id IS NOT NULL), '[]') AS ingredients
+    FROM recipes r
+    LEFT JOIN recipe_ingredients ri ON ri.recipe_id = r.id
+    LEFT JOIN food_products fp ON fp.id = ri.food_product_id
+    WHERE r.user_id = %(user_id)s
+    GROUP BY r.id
+    ORDER BY r.created_at
+"""
+
+
+class _ChunkSink(io.RawIOBase):
+    """Skrivbar, ikke-søkbar strøm: samler zip-bytes til de hentes med drain()."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._buf += b
+        return len(b)
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def _value(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def _fetch(conn, sql: str, user_id: str) -> Iterator[tuple]:
+    """Server-side cursor: bare EXPORT_FETCH_ROWS rader i minnet om gangen."""
+    cur = conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}")
+    cur.itersize = EXPORT_FETCH_ROWS
+    try:
+        cur.execute(sql, {"user_id": user_id})
+        yield from cur
+    finally:
+        cur.close()
+
+
+def _csv_entry(zf: zipfile.ZipFile, sink: _ChunkSink, conn, filename, columns, sql, user_id) -> Iterator[bytes]:
+    with zf.open(filename, "w", force_zip64=True) as f:
+        text = io.StringIO()
+        writer = csv.writer(text)
+        text.write("\ufeff")
+        writer.writerow(columns)
+        for row in _fetch(conn, sql, user_id):
+            writer.writerow([_value(v) for v in row])
+            if text.tell() >= _FLUSH_BYTES:
+                f.write(text.getvalue().encode())
+                text.seek(0)
+                text.truncate()
+                yield sink.drain()
+        f.write(text.getvalue().encode())
+    yield sink.drain()
+
+
+def _recipes_entry(zf: zipfile.ZipFile, sink: _ChunkSink, conn, user_id) -> Iterator[bytes]:
+    with zf.open("oppskrifter.json", "w", force_zip64=True) as f:
+        sep = b"[\n"
+        for rid, name, description, created_at, ingredients in _fetch(conn, _RECIPES_SQL, user_id):
+            item = {
+                "id": str(rid),
+                "navn": name,
+                "beskrivelse": description,
+                "opprettet": created_at.isoformat(),
+                "ingredienser": ingredients,
+            }
+            f.write(sep + json.dumps(item, ensure_ascii=False, default=str).encode())
+            sep = b",\n"
+            yield sink.drain()
+        f.write(b"[]\n" if sep == b"[\n" else b"\n]\n")
+    yield sink.drain()
+
+
+def _profile(conn, user_id: str) -> dict:
+    cur = get_cursor(conn)
+    try:
+        cur.execute(_PROFILE_SQL, {"user_id": user_id})
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    return {k: _value(v) for k, v in (row or {}).items()}
+
+
+def iter_export(user_id) -> Iterator[bytes]:
+    """Zip-arkivet som bytes-biter (for StreamingResponse eller fil)."""
+    user_id = str(user_id)
+    sink = _ChunkSink()
+    # Primær, ikke replika: en lang lesetransaksjon på en replika kan avbrytes av replikeringen
+    with get_connection() as conn:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            profile = json.dumps(_profile(conn, user_id), ensure_ascii=False, default=str, indent=2)
+            zf.writestr("profil.json", profile)
+            for filename, columns, sql in _CSV_SECTIONS:
+                for chunk in _csv_entry(zf, sink, conn, filename, columns, sql, user_id):
+                    if chunk:
+                        yield chunk
+            for chunk in _recipes_entry(zf, sink, conn, user_id):
+                if chunk:
+                    yield chunk
+    yield sink.drain()
+
+
+def export_filename(on: date | None = None) -> str:
+    return f"hercules-eksport-{(on or date.today()).isoformat()}.zip"
+
+
+def estimate_rows(user_id) -> int:
+    """Måltider + vektrader (indeksskann per partisjon) – avgjør strøm eller bakgrunn."""
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT (SELECT COUNT(*) FROM meals WHERE user_id = %(user_id)s)
+                     + (SELECT COUNT(*) FROM weight_entries WHERE user_id = %(user_id)s) AS n
+                """,
+                {"user_id": str(user_id)},
+            )
+            return cur.fetchone()["n"]
+        finally:
+            cur.close()
+
+
+# --- Bakgrunnseksport via objektlagring ---
+def create_export(user_id) -> dict:
+    """Ny eksport (status pending), eller brukerens pågående hvis det finnes en."""
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                INSERT INTO data_exports (user_id) VALUES (%s)
+                ON CONFLICT (user_id) WHERE status = 'pending' DO NOTHING
+                RETURNING id, status, created_at
+                """,
+                (str(user_id),),
+            )
+            row = cur.fetchone()
+            created = row is not None
+            if row is None:
+                cur.execute(
+                    "SELECT id, status, created_at FROM data_exports WHERE user_id = %s AND status = 'pending'",
+                    (str(user_id),),
+                )
+                row = cur.fetchone()
+        finally:
+            cur.close()
+    return {"id": str(row["id"]), "status": row["status"], "created_at": row["created_at"], "created": created}
+
+
+def _finish(export_id: str, status: str, storage_key=None, size_bytes=None, error=None) -> None:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE data_exports
+                SET status = %s, storage_key = %s, size_bytes = %s, error = %s, finished_at = NOW(),
+                    expires_at = NOW() + make_interval(hours => %s)
+                WHERE id = %s
+                """,
+                (status, storage_key, size_bytes, error, EXPORT_RETENTION_HOURS, export_id),
+            )
+        finally:
+            cur.close()
+
+
+def build_export(export_id, user_id) -> None:
+    """Bakgrunnsjobb: zip til tempfil (disk, ikke minne), last opp, marker klar."""
+    export_id = str(export_id)
+    key = f"{EXPORT_PREFIX}{user_id}/{export_id}.zip"
+    try:
+        with tempfile.TemporaryFile() as tmp:
+            for chunk in iter_export(user_id):
+                tmp.write(chunk)
+            size = tmp.tell()
+            tmp.seek(0)
+            upload_fileobj(tmp, key, "application/zip", cache_control="private, no-store")
+    except Exception as e:
+        print(f"[export] {export_id} feilet: {e}")  # noqa: T201
+        _finish(export_id, "failed", error=f"{type(e).__name__}: {e}")
+        return
+    _finish(export_id, "ready", storage_key=key, size_bytes=size)
+
+
+def get_export(export_id, user_id) -> dict | None:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT id, status, storage_key, size_bytes, created_at, finished_at, expires_at
+                FROM data_exports
+                WHERE id = %s AND user_id = %s
+                """,
+                (str(export_id), str(user_id)),
+            )
+            row = cur.fetchone()
+        finally:
+            cur.close()
+    if row is None:
+        return None
+    out = {
+        "id": str(row["id"]),
+        "status": row["status"],
+        "size_bytes": row["size_bytes"],
+        "created_at": row["created_at"],
+        "finished_at": row["finished_at"],
+        "expires_at": row["expires_at"],
+    }
+    if row["status"] == "ready" and STORAGE_ENABLED:
+        out["download_url"] = presign_get(
+            row["storage_key"],
+            expires_in=EXPORT_URL_EXPIRES_SECONDS,
+            filename=export_filename(row["created_at"].date()),
+        )
+    return out
+
+
+def cleanup_exports() -> dict:
+    """Planlagt jobb: marker hengende eksporter som feilet og slett utløpte filer og rader."""
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE data_exports
+                SET status = 'failed', error = 'Avbrutt', finished_at = NOW(),
+                    expires_at = NOW() + make_interval(hours => %s)
+                WHERE status = 'pending' AND created_at < NOW() - make_interval(mins => %s)
+                """,
+                (EXPORT_RETENTION_HOURS, EXPORT_STALE_MINUTES),
+            )
+            stale = cur.rowcount
+            cur.execute("SELECT id, storage_key FROM data_exports WHERE expires_at < NOW()")
+            expired = cur.fetchall()
+        finally:
+            cur.close()
+    removed = []
+    for r in expired:
+        if r["storage_key"] and not delete_object(r["storage_key"]):
+            continue  # prøv igjen ved neste kjøring
+        removed.append(str(r["id"]))
+    if removed:
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute("DELETE FROM data_exports WHERE id = ANY(%s::uuid[])", (removed,))
+            finally:
+                cur.close()
+    return {"stale": stale, "deleted": len(removed)}
@@ -1,62 +1,209 @@
 """
 Matoppslag: alltid lokal DB først, deretter fallback Open Food Facts → Nutritionix → Edamam.
 Ved treff i ekstern API lagres produktet permanent i lokal DB (caching).
+
+Skanner flere samtidig samme nye vare, gjøres den eksterne kjeden én gang: i prosessen
+venter de andre på første forespørsel (single-flight), og mellom workere serialiseres
+oppslaget med en advisory lock per strekkode – den som får låsen etter en annen finner
+produktet lokalt. Låsen holdes på en egen tilkobling uten åpen transaksjon; bare lagringen
+er en transaksjon, én upsert (ON CONFLICT (barcode) … RETURNING).
+
+Oppslaget er en ren SELECT. Skann telles i minnet per worker og skrives samlet hvert
+FOOD_SCAN_FLUSH_SECONDS (start_scan_flusher) – én UPDATE per produkt og intervall i stedet
+for en radlåsende skriving per skann. scan_count er indeksert (oppfrisking, bildespeiling),
+så hver skriving gir indeksoppdateringer; batching holder dem få.
 """
 import os
 import re
+import threading
 from typing import Any
 from uuid import UUID
 
 import httpx
+import psycopg2.errors
 from psycopg2.extras import RealDictCursor
 
-from .database import get_connection, get_cursor
+from .cache import invalidate
+from .database import get_autocommit_connection, get_connection, get_cursor
+from .metrics import cache_result, external_call
+from .payloads import PRODUCT_COLUMNS, product_payload
+
+# Maks ventetid på et pågående oppslag av samme strekkode (tre leverandører × 10 s timeout)
+FOOD_LOOKUP_WAIT_SECONDS = float(os.getenv("FOOD_LOOKUP_WAIT_SECONDS", "30"))
+FOOD_SCAN_FLUSH_SECONDS = float(os.getenv("FOOD_SCAN_FLUSH_SECONDS", "60"))
+
+# GTIN-lengder: EAN-8, UPC-A, EAN-13, GTIN-14
+_GTIN_LENGTHS = (8, 12, 13, 14)
+
+
+def _gtin_check_digit_ok(digits: str) -> bool:
+    """GS1-kontrollsiffer: vekt 3 og 1 vekselvis fra høyre (sifferet før kontrollsifferet har vekt 3)."""
+    body = digits[:-1]
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == int(digits[-1])
+
 
-# Normaliser strekkode: fjern mellomrom, behold siffer
 def _normalize_barcode(barcode: str | None) -> str | None:
+    """
+    Kanonisk GTIN, eller None for ugyldig skann (feil lengde eller kontrollsiffer).
+
+    Samme vare kan skannes som UPC-A (12 siffer), EAN-13 med ledende 0 eller GTIN-14 med
+    ledende 00. Alle er samme tall med nuller foran, så vi fjerner ledende nuller ned til
+    13 siffer (EAN-13), eller 8 for EAN-8. GTIN-14 med emballasjeindikator (1–9 først) er
+    en egen vare og beholdes. UPC-E (komprimert UPC-A) utvides ikke.
+    """
     if not barcode or not isinstance(barcode, str):
         return None
-    cleaned = re.sub(r"\s+", "", barcode).strip()
-    return cleaned if cleaned and cleaned.isdigit() else None
+    cleaned = re.sub(r"\s+", "", barcode)
+    if not cleaned.isdigit() or len(cleaned) not in _GTIN_LENGTHS or not _gtin_check_digit_ok(cleaned):
+        return None
+    gtin14 = cleaned.zfill(14)
+    if gtin14.startswith("000000"):
+        return gtin14[6:]
+    return gtin14[1:] if gtin14[0] == "0" else gtin14
 
 
-def _row_to_product(r: dict) -> dict:
-    return {
-        "id": str(r["id"]),
-        "name": r["name"],
-        "barcode": r.get("barcode"),
-        "source": r.get("source") or "local",
-        "brand": r.get("brand"),
-        "image_url": r.get("image_url"),
-        "user_id": str(r["user_id"]) if r.get("user_id") else None,
-        "kcal_per_100": float(r["kcal_per_100"]),
-        "protein_per_100": float(r["protein_per_100"]),
-        "carbs_per_100": float(r["carbs_per_100"]),
-        "fat_per_100": float(r["fat_per_100"]),
-    }
+def barcode_variants(canonical: str) -> list[str]:
+    """Alle skrivemåter av en kanonisk GTIN (med ledende nuller) – kanonisk først."""
+    significant = canonical.lstrip("0") or "0"
+    return [canonical] + [
+        significant.zfill(n) for n in _GTIN_LENGTHS if n != len(canonical) and n >= len(significant)
+    ]
 
 
-def find_by_barcode_local(barcode: str, user_id: UUID | None = None) -> dict | None:
-    """Sjekk lokal database først (global + brukerens egne)."""
+def _exact_barcode(barcode: str | None) -> str | None:
+    """Kode som ikke er en GTIN, trimmet som skrevet. None hvis tom eller lengre enn kolonnen."""
+    if not barcode or not isinstance(barcode, str):
+        return None
+    cleaned = barcode.strip()
+    return cleaned if 0 < len(cleaned) <= 20 else None
+
+
+def user_barcode(barcode: str | None) -> str | None:
+    """
+    Strekkode for en egen matvare: kanonisk GTIN, ellers egen kode (f.eks. butikkens interne)
+    lagret som skrevet. None for tom eller for lang kode, og for siffer med GTIN-lengde og feil
+    kontrollsiffer – nesten alltid en tastefeil.
+    """
     b = _normalize_barcode(barcode)
-    if not b:
+    if b:
+        return b
+    exact = _exact_barcode(barcode)
+    digits = re.sub(r"\s+", "", exact or "")
+    if not exact or (digits.isdigit() and len(digits) in _GTIN_LENGTHS):
         return None
+    return exact
+
+
+def find_by_barcode_local(barcode: str, user_id: UUID | None = None) -> dict | None:
+    """
+    Sjekk lokal database først (global + brukerens egne). Alle skrivemåter av en GTIN slås
+    opp i én indeksert spørring (barcode = ANY), så rader lagret før kanonisering også treffes.
+    Andre koder (egne matvarer med fri kode, også fra før kanoniseringen) må treffe eksakt.
+    """
+    b = _normalize_barcode(barcode)
+    if b:
+        variants = barcode_variants(b)
+    else:
+        b = _exact_barcode(barcode)
+        if not b:
+            return None
+        variants = [b]
     with get_connection() as conn:
-        cur = get_cursor(conn)
-        cur.execute(
-            """
-            SELECT id, name, barcode, source, brand, image_url, user_id,
-                   kcal_per_100, protein_per_100, carbs_per_100, fat_per_100
-            FROM food_products
-            WHERE barcode = %s AND (user_id IS NULL OR user_id = %s)
-            LIMIT 1
-            """,
-            (b, str(user_id) if user_id else None),
-        )
-        row = cur.fetchone()
+        row = _find_local(get_cursor(conn), b, variants, user_id)
     if not row:
         return None
-    return _row_to_product(dict(row))
+    return product_payload(row)
+
+
+def _find_local(cur, b: str, variants: list[str], user_id: UUID | None) -> dict | None:
+    cur.execute(
+        f"""
+        SELECT {PRODUCT_COLUMNS} FROM food_products
+        WHERE barcode = ANY(%s) AND (user_id IS NULL OR user_id = %s)
+        ORDER BY barcode = %s DESC, scan_count DESC
+        LIMIT 1
+        """,
+        (variants, str(user_id) if user_id else None, b),
+    )
+    row = cur.fetchone()
+    if row:
+        # Treff teller som skann (scan_count styrer bakgrunnsoppfrisking, se product_refresh)
+        record_scan(row["id"])
+    return row
+
+
+# --- Skanntelling (batchet per worker) ---
+_pending_scans: dict[str, int] = {}
+_scans_lock = threading.Lock()
+
+
+def record_scan(product_id) -> None:
+    with _scans_lock:
+        key = str(product_id)
+        _pending_scans[key] = _pending_scans.get(key, 0) + 1
+
+
+def flush_scans() -> int:
+    """Skriv oppsamlede skann (én UPDATE). Ved feil legges de tilbake til neste forsøk."""
+    global _pending_scans
+    with _scans_lock:
+        pending, _pending_scans = _pending_scans, {}
+    if not pending:
+        return 0
+    ids = sorted(pending)
+    try:
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute(
+                    """
+                    UPDATE food_products f
+                    SET scan_count = f.scan_count + s.n, last_scanned_at = NOW()
+                    FROM unnest(%s::uuid[], %s::int[]) AS s(id, n)
+                    WHERE f.id = s.id
+                    """,
+                    (ids, [pending[i] for i in ids]),
+                )
+            finally:
+                cur.close()
+    except Exception:
+        with _scans_lock:
+            for key, n in pending.items():
+                _pending_scans[key] = _pending_scans.get(key, 0) + n
+        raise
+    return len(ids)
+
+
+def _flush_loop(stop: threading.Event) -> None:
+    while not stop.wait(FOOD_SCAN_FLUSH_SECONDS):
+        try:
+            flush_scans()
+        except Exception as e:
+            print(f"[food_lookup] skanntelling feilet: {e}")  # noqa: T201
+
+
+_flush_stop = threading.Event()
+_flush_thread: threading.Thread | None = None
+
+
+def start_scan_flusher() -> None:
+    """Start tråden som skriver skanntelling (idempotent)."""
+    global _flush_thread
+    if _flush_thread and _flush_thread.is_alive():
+        return
+    _flush_stop.clear()
+    _flush_thread = threading.Thread(target=_flush_loop, args=(_flush_stop,), name="scan-flush", daemon=True)
+    _flush_thread.start()
+
+
+def stop_scan_flusher() -> None:
+    """Stopp tråden og skriv det som gjenstår (ved nedstenging)."""
+    _flush_stop.set()
+    try:
+        flush_scans()
+    except Exception as e:
+        print(f"[food_lookup] skanntelling feilet: {e}")  # noqa: T201
 
 
 def _save_product(
@@ -72,14 +219,23 @@ def _save_product(
     protein_per_100: float,
     carbs_per_100: float,
     fat_per_100: float,
-) -> UUID:
+) -> dict | None:
+    """
+    Lagre eksternt produkt og returner raden (PRODUCT_COLUMNS). Finnes strekkoden allerede
+    (lagret av en worker som ikke ventet på låsen), telles skannet og den raden returneres.
+    None hvis strekkoden tilhører en brukers egen matvare – den overskrives ikke.
+    """
     cur = get_cursor(conn)
     cur.execute(
-        """
+        f"""
         INSERT INTO food_products
-        (name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
+        (name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100,
+         fetched_at, scan_count, last_scanned_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), 1, NOW())
+        ON CONFLICT (barcode) WHERE barcode IS NOT NULL AND barcode != '' DO UPDATE
+        SET barcode = EXCLUDED.barcode  -- uendret verdi (HOT); trengs bare for RETURNING
+        WHERE food_products.user_id IS NULL
+        RETURNING {PRODUCT_COLUMNS}, xmax = 0 AS inserted
         """,
         (
             name.strip()[:255],
@@ -94,11 +250,16 @@ def _save_product(
             max(0, float(fat_per_100)),
         ),
     )
-    return cur.fetchone()["id"]
+    row = cur.fetchone()
+    if row and row["inserted"]:
+        invalidate("food_products", cur)  # ny global vare i cachet matsøk
+    elif row:
+        record_scan(row["id"])
+    return row
 
 
 # --- Open Food Facts (gratis, ingen API-nøkkel) ---
-OFF_BASE = "https://world.openfoodfacts.net/api/v2/product"
+OFF_BASE = os.getenv("OFF_BASE_URL", "https://world.openfoodfacts.net/api/v2/product").rstrip("/")
 
 def _fetch_openfoodfacts(barcode: str) -> dict | None:
     b = _normalize_barcode(barcode)
@@ -107,39 +268,44 @@ def _fetch_openfoodfacts(barcode: str) -> dict | None:
     url = f"{OFF_BASE}/{b}"
     try:
         with httpx.Client(timeout=10.0) as client:
-            r = client.get(url, params={"fields": "product_name,brands,image_url,image_front_url,nutriments"})
+            with external_call("openfoodfacts"):
+                r = client.get(url, params={"fields": "product_name,brands,image_url,image_front_url,nutriments"})
             if r.status_code != 200:
                 return None
             data = r.json()
             if data.get("status") != 1 or not data.get("product"):
                 return None
-            p = data["product"]
-            nut = p.get("nutriments") or {}
-            name = (p.get("product_name") or "").strip() or "Ukjent produkt"
-            kcal = nut.get("energy-kcal_100g")
-            if kcal is None:
-                kj = nut.get("energy-kj_100g") or nut.get("energy_100g")
-                if kj is not None:
-                    kcal = float(kj) / 4.184
-                else:
-                    kcal = 0
-            else:
-                kcal = float(kcal)
-            return {
-                "name": name[:255],
-                "barcode": b,
-                "source": "openfoodfacts",
-                "brand": (p.get("brands") or "").strip()[:255] or None,
-                "image_url": (p.get("image_url") or p.get("image_front_url") or "").strip()[:2048] or None,
-                "kcal_per_100": round(kcal, 2),
-                "protein_per_100": round(float(nut.get("proteins_100g") or 0), 2),
-                "carbs_per_100": round(float(nut.get("carbohydrates_100g") or 0), 2),
-                "fat_per_100": round(float(nut.get("fat_100g") or 0), 2),
-            }
+            return _map_openfoodfacts_product(b, data["product"])
     except Exception:
         return None
 
 
+def _map_openfoodfacts_product(barcode: str, p: dict) -> dict:
+    """OFF-produkt (API eller dump) → felter for food_products. Brukes også av off_import."""
+    nut = p.get("nutriments") or {}
+    name = (p.get("product_name") or "").strip() or "Ukjent produkt"
+    kcal = nut.get("energy-kcal_100g")
+    if kcal is None:
+        kj = nut.get("energy-kj_100g") or nut.get("energy_100g")
+        if kj is not None:
+            kcal = float(kj) / 4.184
+        else:
+            kcal = 0
+    else:
+        kcal = float(kcal)
+    return {
+        "name": name[:255],
+        "barcode": barcode,
+        "source": "openfoodfacts",
+        "brand": (p.get("brands") or "").strip()[:255] or None,
+        "image_url": (p.get("image_url") or p.get("image_front_url") or "").strip()[:2048] or None,
+        "kcal_per_100": round(kcal, 2),
+        "protein_per_100": round(float(nut.get("proteins_100g") or 0), 2),
+        "carbs_per_100": round(float(nut.get("carbohydrates_100g") or 0), 2),
+        "fat_per_100": round(float(nut.get("fat_100g") or 0), 2),
+    }
+
+
 # --- Nutritionix (krever NUTRITIONIX_APP_ID og NUTRITIONIX_APP_KEY) ---
 def _fetch_nutritionix(barcode: str) -> dict | None:
     app_id = os.getenv("NUTRITIONIX_APP_ID")
@@ -153,11 +319,12 @@ def _fetch_nutritionix(barcode: str) -> dict | None:
     url = "https://trackapi.nutritionix.com/v2/search/item"
     try:
         with httpx.Client(timeout=10.0) as client:
-            r = client.get(
-                url,
-                params={"upc": b},
-                headers={"x-app-id": app_id, "x-app-key": app_key},
-            )
+            with external_call("nutritionix"):
+                r = client.get(
+                    url,
+                    params={"upc": b},
+                    headers={"x-app-id": app_id, "x-app-key": app_key},
+                )
             if r.status_code != 200:
                 return None
             data = r.json()
@@ -216,10 +383,11 @@ def _fetch_edamam(barcode: str) -> dict | None:
     url = "https://api.edamam.com/api/food-database/v2/parser"
     try:
         with httpx.Client(timeout=10.0) as client:
-            r = client.get(
-                url,
-                params={"upc": b, "app_id": app_id, "app_key": app_key},
-            )
+            with external_call("edamam"):
+                r = client.get(
+                    url,
+                    params={"upc": b, "app_id": app_id, "app_key": app_key},
+                )
             if r.status_code != 200:
                 return None
             data = r.json()
@@ -245,66 +413,93 @@ def _fetch_edamam(barcode: str) -> dict | None:
         return None
 
 
+class _Flight:
+    __slots__ = ("done", "value", "ok")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.ok = False
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _fetch_and_save(b: str, user_id: UUID | None) -> dict | None:
+    """
+    Ekstern kjede for kanonisk strekkode b, under en advisory lock per strekkode (på tvers av
+    workere). Låsen er på sesjonsnivå på en egen kortlevd tilkobling i autocommit, så ingen
+    transaksjon står åpen mens vi venter på låsen eller kaller leverandørene; bare upserten
+    er en transaksjon. Den som får låsen etter en annen finner produktet lokalt. Venter vi
+    lenger enn FOOD_LOOKUP_WAIT_SECONDS (lock_timeout), henter vi selv – upserten tåler at
+    to lagrer samme vare.
+    """
+    lock_conn = get_autocommit_connection()
+    try:
+        cur = lock_conn.cursor()
+        try:
+            cur.execute("SET lock_timeout = %s", (f"{int(FOOD_LOOKUP_WAIT_SECONDS * 1000)}ms",))
+            try:
+                cur.execute("SELECT pg_advisory_lock(hashtext('barcode'), hashtext(%s))", (b,))
+            except psycopg2.errors.LockNotAvailable:
+                pass
+        finally:
+            cur.close()
+
+        local = find_by_barcode_local(b, user_id)
+        if local:
+            return local
+        # 2) Open Food Facts → 3) Nutritionix → 4) Edamam; første treff lagres og returneres
+        for fetch in (_fetch_openfoodfacts, _fetch_nutritionix, _fetch_edamam):
+            found = fetch(b)
+            if found:
+                with get_connection() as conn:
+                    row = _save_product(conn, user_id=None, **found)
+                return product_payload(row) if row else None
+        return None
+    finally:
+        # Sesjonslåsen slippes når tilkoblingen lukkes
+        lock_conn.close()
+
+
 def lookup_by_barcode(barcode: str, user_id: UUID | None = None) -> dict | None:
     """
     Steg 1: Sjekk lokal DB. Steg 2: Open Food Facts. Steg 3: Nutritionix. Steg 4: Edamam.
-    Ved treff i ekstern API lagres produktet i food_products og returneres.
+    Ved treff i ekstern API lagres produktet i food_products og returneres. Samtidige
+    oppslag av samme strekkode i prosessen venter på ett felles eksternt oppslag.
     """
-    # 1) Lokal database
-    local = find_by_barcode_local(barcode, user_id)
-    if local:
-        return local
-
     b = _normalize_barcode(barcode)
     if not b:
-        return None
+        # Ikke en GTIN (fri kode på en egen matvare, skanner som leste feil): bare eksakt
+        # lokalt treff – leverandørene kjenner bare GTIN, så de spørres ikke
+        local = find_by_barcode_local(barcode, user_id)
+        cache_result("food_barcode", local is not None)
+        return local
 
-    # 2) Open Food Facts
-    off = _fetch_openfoodfacts(barcode)
-    if off:
-        with get_connection() as conn:
-            try:
-                pid = _save_product(conn, user_id=None, **off)
-                cur = get_cursor(conn)
-                cur.execute(
-                    "SELECT id, name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100 FROM food_products WHERE id = %s",
-                    (str(pid),),
-                )
-                row = cur.fetchone()
-                return _row_to_product(dict(row)) if row else None
-            except Exception:
-                return find_by_barcode_local(barcode, user_id) or None
-
-    # 3) Nutritionix
-    nix = _fetch_nutritionix(barcode)
-    if nix:
-        with get_connection() as conn:
-            try:
-                pid = _save_product(conn, user_id=None, **nix)
-                cur = get_cursor(conn)
-                cur.execute(
-                    "SELECT id, name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100 FROM food_products WHERE id = %s",
-                    (str(pid),),
-                )
-                row = cur.fetchone()
-                return _row_to_product(dict(row)) if row else None
-            except Exception:
-                return find_by_barcode_local(barcode, user_id) or None
-
-    # 4) Edamam
-    ed = _fetch_edamam(barcode)
-    if ed:
-        with get_connection() as conn:
-            try:
-                pid = _save_product(conn, user_id=None, **ed)
-                cur = get_cursor(conn)
-                cur.execute(
-                    "SELECT id, name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100 FROM food_products WHERE id = %s",
-                    (str(pid),),
-                )
-                row = cur.fetchone()
-                return _row_to_product(dict(row)) if row else None
-            except Exception:
-                return find_by_barcode_local(barcode, user_id) or None
+    # 1) Lokal database
+    local = find_by_barcode_local(b, user_id)
+    cache_result("food_barcode", local is not None)
+    if local:
+        return local
 
-    return None
+    with _flights_lock:
+        flight = _flights.get(b)
+        leader = flight is None
+        if leader:
+            flight = _flights[b] = _Flight()
+    if not leader:
+        # Bare globale produkter deles – lederen kan ha funnet sin egen matvare
+        if flight.done.wait(FOOD_LOOKUP_WAIT_SECONDS) and flight.ok and (
+            flight.value is None or flight.value["user_id"] is None
+        ):
+            return flight.value
+        return _fetch_and_save(b, user_id)
+    try:
+        flight.value = _fetch_and_save(b, user_id)
+        flight.ok = True
+        return flight.value
+    finally:
+        with _flights_lock:
+            _flights.pop(b, None)
+        flight.done.set()
@@ -0,0 +1,275 @@
+"""
+Speiling av eksterne produktbilder (Open Food Facts / Nutritionix / Edamam) til egen lagring.
+
+food_products.image_url pekte rett på leverandørenes CDN-er, så hvert matsøk lastet
+tredjepartsbilder. Denne jobben henter hvert bilde én gang, lagrer et normalisert WebP-
+miniatyrbilde i objektlagring og skriver om produktet til /api/media/<key>. Originalt
+URL beholdes i image_source_url (oppfrisking/import overskriver da ikke speilet bilde).
+
+Like bilder (samme SHA-256 av nedlastede bytes) lagres kun én gang – media_images mapper
+hash → nøkkel, så f.eks. samme produktbilde på flere strekkoder deler objekt.
+
+Bare globale produkter fra leverandørene speiles – brukerens egne matvarer (image_url satt
+via POST /api/food) hentes aldri av serveren. Vertsnavnet slås opp én gang, alle adressene
+må være offentlige, og forespørselen går til den kontrollerte IP-en (Host/SNI = vertsnavnet),
+så DNS ikke kan peke et annet sted mellom sjekk og tilkobling.
+
+Aktiveres med IMAGE_MIRROR_ENABLED=true (bakgrunnstråd fra app.main, henter bare på
+planleggerens leder), eller manuelt:
+    python -m app.image_mirror [--limit 500]
+"""
+import argparse
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import sys
+import threading
+from urllib.parse import urlparse
+
+import httpx
+from PIL import Image, ImageOps
+
+from .cache import invalidate
+from .database import get_connection, get_cursor
+from .media import VARIANT_CACHE_CONTROL
+from .metrics import external_call
+from .product_refresh import _RateLimiter
+from .scheduler import is_leader
+from .storage import STORAGE_ENABLED, delete_object, make_key, upload_fileobj
+
+IMAGE_MIRROR_ENABLED = os.getenv("IMAGE_MIRROR_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+IMAGE_MIRROR_BATCH_SIZE = int(os.getenv("IMAGE_MIRROR_BATCH_SIZE", "50"))
+IMAGE_MIRROR_INTERVAL_SECONDS = int(os.getenv("IMAGE_MIRROR_INTERVAL_SECONDS", "300"))
+IMAGE_MIRROR_RATE_PER_MINUTE = int(os.getenv("IMAGE_MIRROR_RATE_PER_MINUTE", "60"))
+IMAGE_MIRROR_MAX_BYTES = int(os.getenv("IMAGE_MIRROR_MAX_BYTES", str(5 * 1024 * 1024)))
+# Mislykket nedlasting prøves igjen etter så mange dager
+IMAGE_MIRROR_RETRY_DAYS = int(os.getenv("IMAGE_MIRROR_RETRY_DAYS", "7"))
+IMAGE_MIRROR_THUMB_SIZE = int(os.getenv("IMAGE_MIRROR_THUMB_SIZE", "400"))
+
+_limiter = _RateLimiter(IMAGE_MIRROR_RATE_PER_MINUTE)
+
+
+def _pinned_request(url: str) -> tuple[str, dict, dict] | None:
+    """
+    (URL mot IP, headers, extensions) for en http(s)-URL der alle adressene vertsnavnet
+    slår opp til er offentlige, ellers None. URL-ene kommer fra eksterne API-er.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return None
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+        addrs = [ipaddress.ip_address(info[4][0]) for info in infos]
+    except (socket.gaierror, ValueError):
+        return None
+    if not addrs or not all(a.is_global for a in addrs):
+        return None
+    ip = addrs[0]
+    host = f"[{ip}]" if ip.version == 6 else str(ip)
+    pinned = parsed._replace(netloc=f"{host}:{port}").geturl()
+    headers = {
+        "Host": parsed.netloc.rsplit("@", 1)[-1],
+        "User-Agent": "Hercules/1.0 (image mirror)",
+    }
+    extensions = {"sni_hostname": parsed.hostname} if parsed.scheme == "https" else {}
+    return pinned, headers, extensions
+
+
+def _download(url: str) -> bytes | None:
+    request = _pinned_request(url)
+    if request is None:
+        return None
+    pinned, headers, extensions = request
+    try:
+        with external_call("image_mirror"), httpx.Client(timeout=15.0, follow_redirects=False) as client:
+            with client.stream("GET", pinned, headers=headers, extensions=extensions) as r:
+                if r.status_code != 200 or not r.headers.get("content-type", "").startswith("image/"):
+                    return None
+                buf = io.BytesIO()
+                for chunk in r.iter_bytes():
+                    buf.write(chunk)
+                    if buf.tell() > IMAGE_MIRROR_MAX_BYTES:
+                        return None
+                return buf.getvalue()
+    except httpx.HTTPError:
+        return None
+
+
+def normalize_thumbnail(data: bytes) -> bytes:
+    """WebP, maks IMAGE_MIRROR_THUMB_SIZE px, riktig rotasjon og uten metadata."""
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (IMAGE_MIRROR_THUMB_SIZE, IMAGE_MIRROR_THUMB_SIZE))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        img.thumbnail((IMAGE_MIRROR_THUMB_SIZE, IMAGE_MIRROR_THUMB_SIZE), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "WEBP", quality=80, method=4)
+        return out.getvalue()
+
+
+def store_image(data: bytes) -> tuple[str, bool]:
+    """Lagre (eller gjenbruk) bildet. Returnerer (media-URL, gjenbrukt)."""
+    digest = hashlib.sha256(data).hexdigest()
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT storage_key FROM media_images WHERE content_hash = %s", (digest,))
+            row = cur.fetchone()
+        finally:
+            cur.close()
+    if row:
+        return f"/api/media/{row['storage_key']}", True
+    key = make_key("food", "thumb.webp")
+    upload_fileobj(io.BytesIO(normalize_thumbnail(data)), key, "image/webp", cache_control=VARIANT_CACHE_CONTROL)
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                INSERT INTO media_images (content_hash, storage_key) VALUES (%s, %s)
+                ON CONFLICT (content_hash) DO NOTHING
+                RETURNING storage_key
+                """,
+                (digest, key),
+            )
+            if cur.fetchone():
+                return f"/api/media/{key}", False
+            # En annen worker lagret samme bilde samtidig – bruk deres, fjern vårt
+            cur.execute("SELECT storage_key FROM media_images WHERE content_hash = %s", (digest,))
+            existing = cur.fetchone()["storage_key"]
+        finally:
+            cur.close()
+    delete_object(key)
+    return f"/api/media/{existing}", True
+
+
+def _claim_batch(limit: int) -> list[dict]:
+    """
+    Mest skannede globale leverandørprodukter med eksternt bilde; SKIP LOCKED som i
+    product_refresh. Brukerens egne matvarer tas aldri med (vilkårlig URL → SSRF).
+    """
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE food_products
+                SET image_mirror_attempted_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM food_products
+                    WHERE image_url LIKE 'http%%'
+                      AND user_id IS NULL
+                      AND source IN ('openfoodfacts', 'nutritionix', 'edamam')
+                      AND (image_mirror_attempted_at IS NULL
+                           OR image_mirror_attempted_at < NOW() - make_interval(days => %s))
+                    ORDER BY scan_count DESC
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, image_url
+                """,
+                (IMAGE_MIRROR_RETRY_DAYS, limit),
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+
+def _rewrite(product_id, source_url: str, media_url: str) -> None:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            # Bare hvis image_url ikke er endret underveis
+            cur.execute(
+                """
+                UPDATE food_products SET image_source_url = image_url, image_url = %s
+                WHERE id = %s AND image_url = %s
+                """,
+                (media_url, str(product_id), source_url),
+            )
+            if cur.rowcount:
+                invalidate("food_products", cur)
+        finally:
+            cur.close()
+
+
+def mirror_product_images(limit: int = IMAGE_MIRROR_BATCH_SIZE) -> dict:
+    """Én batch. Feil (nedlasting/dekoding) lar produktet stå med eksternt bilde til neste forsøk."""
+    if not STORAGE_ENABLED:
+        return {"checked": 0, "mirrored": 0, "reused": 0, "failed": 0}
+    rows = _claim_batch(limit)
+    mirrored = reused = failed = 0
+    for r in rows:
+        _limiter.wait()
+        data = _download(r["image_url"])
+        if not data:
+            failed += 1
+            continue
+        try:
+            media_url, was_reused = store_image(data)
+        except Exception as e:
+            print(f"[image_mirror] {r['image_url']}: {e}")  # noqa: T201
+            failed += 1
+            continue
+        _rewrite(r["id"], r["image_url"], media_url)
+        mirrored += 1
+        reused += was_reused
+    return {"checked": len(rows), "mirrored": mirrored, "reused": reused, "failed": failed}
+
+
+def _loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        if not is_leader():
+            stop.wait(IMAGE_MIRROR_INTERVAL_SECONDS)
+            continue
+        try:
+            result = mirror_product_images()
+            if result["checked"]:
+                print(  # noqa: T201
+                    f"[image_mirror] {result['checked']} sjekket, {result['mirrored']} speilet "
+                    f"({result['reused']} gjenbrukt), {result['failed']} feilet"
+                )
+                continue
+        except Exception as e:
+            print(f"[image_mirror] feil: {e}")  # noqa: T201
+        stop.wait(IMAGE_MIRROR_INTERVAL_SECONDS)
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def start_background_mirror() -> None:
+    """Start bakgrunnstråd (idempotent). Gjør ingenting hvis IMAGE_MIRROR_ENABLED ikke er satt."""
+    global _thread
+    if not IMAGE_MIRROR_ENABLED or not STORAGE_ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(_stop,), name="image-mirror", daemon=True)
+    _thread.start()
+
+
+def stop_background_mirror() -> None:
+    _stop.set()
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Speil eksterne produktbilder til objektlagring")
+    p.add_argument("--limit", type=int, default=IMAGE_MIRROR_BATCH_SIZE, help="Maks produkter totalt")
+    args = p.parse_args(argv)
+    left = args.limit
+    while left > 0:
+        result = mirror_product_images(min(left, IMAGE_MIRROR_BATCH_SIZE))
+        if not result["checked"]:
+            break
+        left -= result["checked"]
+        print(result)  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
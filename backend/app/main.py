@@ -1,30 +1,98 @@
 import os
+import re
 from calendar import monthrange
 from datetime import datetime, timedelta, timezone
 from uuid import UUID
 
-from fastapi import Depends, FastAPI, File, HTTPException, Request, UploadFile
+from fastapi import BackgroundTasks, Depends, FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel, EmailStr
+from starlette.concurrency import run_in_threadpool
 
+from app.activity import ACTIVITY_MAX_BODY_BYTES, daily_activity, hourly_activity, ingest_batch
 from app.auth import (
+    PasswordHashBusy,
+    client_ip,
     create_access_token,
+    create_events_token,
+    create_upload_token,
     decode_access_token,
+    decode_events_token,
+    decode_upload_token,
     hash_password,
+    login_throttle,
+    needs_rehash,
+    shutdown_password_pool,
     verify_password,
 )
+from app.body_limit import BodySizeLimitMiddleware
+from app.cache import get_or_compute, start_cache_listener, stop_cache_listener
+from app.compression import CompressionMiddleware
 from app.database import get_connection, get_cursor
-from app.food_lookup import lookup_by_barcode
+from app.events import (
+    EVENTS_ENABLED,
+    EVENTS_MAX_CONNECTIONS,
+    EVENTS_TOKEN_EXPIRES_SECONDS,
+    connection_count,
+    publish,
+    publish_to_user_and_coaches,
+    start_listener,
+    stop_listener,
+)
+from app.energy import compute_estimates, energy_payload
+from app.events import stream as event_stream
+from app.export import (
+    EXPORT_PREFIX,
+    EXPORT_STREAM_MAX_ROWS,
+    build_export,
+    cleanup_exports,
+    create_export,
+    estimate_rows,
+    export_filename,
+    get_export,
+    iter_export,
+)
+from app.food_lookup import lookup_by_barcode, start_scan_flusher, stop_scan_flusher, user_barcode
+from app.image_mirror import start_background_mirror, stop_background_mirror
+from app.media import (
+    VARIANT_CACHE_CONTROL,
+    VARIANT_NAMES,
+    is_video,
+    shutdown_media_pool,
+    submit_upload_processing,
+    variant_key,
+)
+from app.metrics import MetricsMiddleware, external_call, render_metrics
+from app.partitions import ensure_partition_for, ensure_upcoming_partitions, parse_log_date, with_partition_retry
+from app.payloads import PRODUCT_COLUMNS, product_payload, weight_payload
+from app.product_refresh import start_background_refresher, stop_background_refresher
+from app.profiling import ProfilingMiddleware, get_trace, list_traces
+from app.read_your_writes import HEADER_NAME as RYW_HEADER, ReadYourWritesMiddleware
+from app.scheduler import (
+    job_status,
+    parse_hours,
+    register_job,
+    registered_jobs,
+    run_soon,
+    start_scheduler,
+    stop_scheduler,
+)
 from app.storage import (
     STORAGE_ENABLED,
+    copy_object,
+    delete_object,
     get_object_stream,
+    head_object,
+    list_objects,
     make_key,
+    presign_post,
     upload_fileobj,
 )
 
-app = FastAPI(title="Hercules API", version="1.0.0")
+# orjson som standard: raskere enn stdlib json og håndterer UUID/datetime direkte
+app = FastAPI(title="Hercules API", version="1.0.0", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,11 +100,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[RYW_HEADER],
 )
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
 security = HTTPBearer(auto_error=False)
 
 
+@app.on_event("startup")
+def _start_background_jobs() -> None:
+    ensure_upcoming_partitions()
+    start_background_refresher()
+    start_background_mirror()
+    start_scan_flusher()
+    start_listener()
+    start_cache_listener()
+    start_scheduler()
+
+
+@app.on_event("shutdown")
+def _stop_background_jobs() -> None:
+    stop_background_refresher()
+    stop_background_mirror()
+    stop_scan_flusher()
+    stop_listener()
+    stop_cache_listener()
+    stop_scheduler()
+    shutdown_password_pool()
+    shutdown_media_pool()
+
+
+@app.exception_handler(PasswordHashBusy)
+def _password_hash_busy(request: Request, exc: PasswordHashBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Mange innlogginger akkurat nå. Prøv igjen om noen sekunder."},
+        headers={"Retry-After": "2"},
+    )
+
+
 # --- Schemas ---
 class LoginRequest(BaseModel):
     email: str
@@ -64,9 +169,10 @@ def get_current_user_id(
     if not payload or "sub" not in payload:
         return None
     try:
-        return UUID(payload["sub"])
+        user_id = UUID(payload["sub"])
     except (ValueError, TypeError):
         return None
+    return user_id
 
 
 def require_admin(
@@ -97,10 +203,36 @@ def require_user(
     return user_id
 
 
+def require_coach(
+    user_id: UUID | None = Depends(get_current_user_id),
+) -> UUID:
+    """Godkjent coach (kunde_og_coach) eller admin."""
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                "SELECT rolle, coach_godkjent FROM users WHERE id = %s",
+                (str(user_id),),
+            )
+            row = cur.fetchone()
+            if not row or not (
+                row["rolle"] == "admin"
+                or (row["rolle"] == "kunde_og_coach" and row["coach_godkjent"])
+            ):
+                raise HTTPException(status_code=403, detail="Coach only")
+            return user_id
+        finally:
+            cur.close()
+
+
 # --- Stripe (første trekk – bruker opprettes kun ved godkjent betaling) ---
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "").strip()
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "").strip()
 STRIPE_ENABLED = bool(STRIPE_SECRET_KEY)
+# Valgfri: pek Stripe-klienten mot annen base-URL (f.eks. lokal fake i benchmark)
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "").strip()
 
 PRIS_PER_MANED_KR = 100
 PRIS_HALV_MANED_KR = 50
@@ -154,8 +286,38 @@ def _first_payment_kr() -> int:
     return current + PRIS_PER_MANED_KR
 
 
+def _throttle_or_429(request: Request, email: str | None) -> None:
+    ip = client_ip(request.client.host if request.client else None, request.headers.get("x-forwarded-for"))
+    wait = login_throttle(ip, email)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="For mange forsøk. Vent litt og prøv igjen.",
+            headers={"Retry-After": str(int(wait) + 1)},
+        )
+
+
+def _rehash_password(user_id, password: str, old_hash: str) -> None:
+    """Oppgrader hash til gjeldende BCRYPT_ROUNDS etter vellykket innlogging (bakgrunn)."""
+    try:
+        new_hash = hash_password(password)
+    except PasswordHashBusy:
+        return  # tas ved neste innlogging
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                "UPDATE users SET passord_hash = %s WHERE id = %s AND passord_hash = %s",
+                (new_hash, str(user_id), old_hash),
+            )
+        finally:
+            cur.close()
+
+
 @app.post("/api/auth/login")
-def login(body: LoginRequest):
+def login(body: LoginRequest, request: Request, background_tasks: BackgroundTasks):
+    email = body.email.strip().lower()
+    _throttle_or_429(request, email)
     with get_connection() as conn:
         cur = get_cursor(conn)
         try:
@@ -164,13 +326,15 @@ def login(body: LoginRequest):
                 SELECT id, email, passord_hash, rolle, navn
                 FROM users WHERE email = %s
                 """,
-                (body.email.strip().lower(),),
+                (email,),
             )
             row = cur.fetchone()
         finally:
             cur.close()
     if not row or not verify_password(body.password, row["passord_hash"]):
         raise HTTPException(status_code=401, detail="Ugyldig e-post eller passord")
+    if needs_rehash(row["passord_hash"]):
+        background_tasks.add_task(_rehash_password, row["id"], body.password, row["passord_hash"])
     token = create_access_token({"sub": str(row["id"])})
     return {
         "access_token": token,
@@ -185,8 +349,9 @@ def login(body: LoginRequest):
 
 
 @app.post("/api/auth/signup")
-def signup(body: SignupRequest):
+def signup(body: SignupRequest, request: Request):
     email = body.email.strip().lower()
+    _throttle_or_429(request, None)
     trial_ends_at = None
     stripe_customer_id = None
     payment_method_type = (body.payment_method_type or "kort").strip().lower() or "kort"
@@ -201,16 +366,21 @@ def signup(body: SignupRequest):
             )
         import stripe
         stripe.api_key = STRIPE_SECRET_KEY
+        if STRIPE_API_BASE:
+            stripe.api_base = STRIPE_API_BASE
         try:
-            customer = stripe.Customer.create(email=email)
-            stripe.PaymentMethod.attach(
-                body.payment_method_id,
-                customer=customer.id,
-            )
-            stripe.Customer.modify(
-                customer.id,
-                invoice_settings={"default_payment_method": body.payment_method_id},
-            )
+            with external_call("stripe"):
+                customer = stripe.Customer.create(email=email)
+            with external_call("stripe"):
+                stripe.PaymentMethod.attach(
+                    body.payment_method_id,
+                    customer=customer.id,
+                )
+            with external_call("stripe"):
+                stripe.Customer.modify(
+                    customer.id,
+                    invoice_settings={"default_payment_method": body.payment_method_id},
+                )
             stripe_customer_id = customer.id
             trial_ends_at = datetime.now(timezone.utc) + timedelta(days=7)
         except stripe.error.CardError as e:
@@ -258,8 +428,14 @@ def signup(body: SignupRequest):
     }
 
 
-@app.get("/api/me")
-def me(user_id: UUID = Depends(require_user)):
+ME_CACHE_TTL_SECONDS = int(os.getenv("ME_CACHE_TTL_SECONDS", "300"))
+
+
+def _load_me_profile(user_id: UUID) -> dict | None:
+    """
+    users-raden /api/me trenger, med siste energiestimat, JSON-native (cache-verdi).
+    Invalideres av trigger på users og av jobben energy-estimates.
+    """
     with get_connection() as conn:
         cur = get_cursor(conn)
         try:
@@ -267,17 +443,41 @@ def me(user_id: UUID = Depends(require_user)):
                 """
                 SELECT id, email, rolle, navn, coach_sokt, coach_godkjent,
                        trial_ends_at, stripe_customer_id, first_charge_done,
-                       account_blocked_at
+                       payment_failed_at, payment_action_required_at, account_blocked_at
                 FROM users WHERE id = %s
                 """,
                 (str(user_id),),
             )
             row = cur.fetchone()
+            cur.execute("SELECT * FROM energy_estimates WHERE user_id = %s", (str(user_id),))
+            energy = cur.fetchone()
         finally:
             cur.close()
+    if not row:
+        return None
+    return {
+        "id": str(row["id"]),
+        "email": row["email"],
+        "rolle": row["rolle"],
+        "navn": row["navn"],
+        "coach_sokt": row["coach_sokt"],
+        "coach_godkjent": row["coach_godkjent"],
+        "trial_ends_at": row["trial_ends_at"].isoformat() if row["trial_ends_at"] else None,
+        "stripe_customer_id": row["stripe_customer_id"],
+        "first_charge_done": row["first_charge_done"],
+        "payment_failed": row["payment_failed_at"] is not None,
+        "payment_action_required": row["payment_action_required_at"] is not None,
+        "account_blocked": row["account_blocked_at"] is not None,
+        "energy": energy_payload(energy),
+    }
+
+
+@app.get("/api/me")
+def me(user_id: UUID = Depends(require_user)):
+    row = get_or_compute("me", str(user_id), ME_CACHE_TTL_SECONDS, lambda: _load_me_profile(user_id))
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
-    if row.get("account_blocked_at"):
+    if row["account_blocked"]:
         raise HTTPException(
             status_code=403,
             detail="Kontoen er sperret fordi betaling mislyktes etter siste frist (siste dag i måneden). Oppdater betalingsmetode for å låse opp.",
@@ -285,73 +485,66 @@ def me(user_id: UUID = Depends(require_user)):
     rolle = row["rolle"]
     kan_bytte_view = rolle == "admin" or (rolle == "kunde_og_coach" and row["coach_godkjent"])
 
-    # Etter trial (1 uke): utfør første trekk automatisk ved innlogging
-    payment_required = False
-    if STRIPE_ENABLED and row.get("trial_ends_at") and row.get("stripe_customer_id") and not row.get("first_charge_done"):
-        trial_end = row["trial_ends_at"]
-        if trial_end.tzinfo is None:
-            trial_end = trial_end.replace(tzinfo=timezone.utc)
-        if datetime.now(timezone.utc) >= trial_end:
-            import stripe
-            stripe.api_key = STRIPE_SECRET_KEY
-            amount_ore = _first_payment_kr() * 100
-            try:
-                pi = stripe.PaymentIntent.create(
-                    amount=amount_ore,
-                    currency="nok",
-                    customer=row["stripe_customer_id"],
-                    off_session=True,
-                    confirm=True,
-                    metadata={"user_id": str(row["id"]), "type": "first_after_trial"},
-                    expand=["latest_charge"],
-                )
-                if pi.status == "succeeded":
-                    with get_connection() as conn2:
-                        cur2 = get_cursor(conn2)
-                        try:
-                            cur2.execute(
-                                "UPDATE users SET first_charge_done = TRUE, payment_failed_at = NULL, next_payment_retry_at = NULL, payment_retry_count = 0, oppdatert = NOW() WHERE id = %s",
-                                (str(user_id),),
-                            )
-                        finally:
-                            cur2.close()
-                    try:
-                        from app.sales_documents import create_from_payment_success
-                        charge_id = pi.latest_charge.id if getattr(pi, "latest_charge", None) else None
-                        create_from_payment_success(
-                            user_id=user_id,
-                            customer_name=row.get("navn"),
-                            customer_email=row["email"],
-                            total_ore=amount_ore,
-                            description="Første betaling – abonnement (etter prøveuke)",
-                            stripe_payment_intent_id=pi.id,
-                            stripe_charge_id=charge_id,
-                        )
-                    except Exception:
-                        pass
-                elif pi.status == "requires_action":
-                    payment_required = True
-            except stripe.error.CardError:
-                payment_required = True
-                _record_payment_failure(user_id=user_id, email=row["email"], navn=row.get("navn"))
-            except Exception:
-                payment_required = True
-                _record_payment_failure(user_id=user_id, email=row["email"], navn=row.get("navn"))
+    # Første trekk etter trial gjøres av planleggeren (jobben trial-charges), ikke her.
+    # Brukeren må betale først når jobben har prøvd: trekket feilet eller venter på 3-D Secure.
+    payment_required = bool(
+        STRIPE_ENABLED
+        and not row.get("first_charge_done")
+        and (row.get("payment_failed") or row.get("payment_action_required"))
+    )
 
     return {
-        "id": str(row["id"]),
+        "id": row["id"],
         "email": row["email"],
         "rolle": row["rolle"],
         "navn": row["navn"] or row["email"],
         "coach_sokt": row["coach_sokt"],
         "coach_godkjent": row["coach_godkjent"],
         "kan_bytte_view": kan_bytte_view,
-        "trial_ends_at": row["trial_ends_at"].isoformat() if row.get("trial_ends_at") else None,
+        "trial_ends_at": row["trial_ends_at"],
         "first_charge_done": row.get("first_charge_done", False),
         "payment_required": payment_required,
+        # Estimert forbruk og forslag til daglige mål (jobben energy-estimates), None uten nok data
+        "energy": row.get("energy"),
     }
 
 
+# --- Bruker: dataeksport (GDPR) ---
+@app.get("/api/me/export")
+def export_my_data(
+    background_tasks: BackgroundTasks,
+    background: bool = False,
+    user_id: UUID = Depends(require_user),
+):
+    """
+    Alle brukerens data som zip (CSV/JSON). Små eksporter strømmes direkte med flat minnebruk.
+    Store (eller background=true) bygges i bakgrunnen: 202 med id, lenken hentes fra
+    GET /api/me/exports/{id} når status er ready.
+    """
+    if STORAGE_ENABLED and (background or estimate_rows(user_id) > EXPORT_STREAM_MAX_ROWS):
+        job = create_export(user_id)
+        if job.pop("created"):
+            background_tasks.add_task(build_export, job["id"], user_id)
+        return ORJSONResponse(job, status_code=202)
+    return StreamingResponse(
+        iter_export(user_id),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{export_filename()}"',
+            "Cache-Control": "private, no-store",
+        },
+    )
+
+
+@app.get("/api/me/exports/{export_id}")
+def get_my_export(export_id: UUID, user_id: UUID = Depends(require_user)):
+    """Status for bakgrunnseksport; download_url (presignert, kortlevd) når den er klar."""
+    job = get_export(export_id, user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Eksport ikke funnet")
+    return job
+
+
 # --- Cron: ukentlig retry av mislykkede betalinger; siste dag i måneden = sperr konto ---
 CRON_SECRET = os.getenv("CRON_SECRET", "").strip()
 
@@ -368,6 +561,11 @@ def _require_cron_secret(
 
 @app.post("/api/cron/retry-payments")
 def retry_payments(_: None = Depends(_require_cron_secret)):
+    """Manuell/ekstern utløsning av jobben retry-payments (kjøres ellers av planleggeren)."""
+    return _retry_failed_payments()
+
+
+def _retry_failed_payments() -> dict:
     """Run daily: retry failed payments; on last day of month, block account if still failing."""
     now = datetime.now(timezone.utc)
     today = now.date()
@@ -396,6 +594,8 @@ def retry_payments(_: None = Depends(_require_cron_secret)):
 
     import stripe
     stripe.api_key = STRIPE_SECRET_KEY
+    if STRIPE_API_BASE:
+        stripe.api_base = STRIPE_API_BASE
     amount_ore = _first_payment_kr() * 100
     succeeded = 0
     blocked = 0
@@ -403,21 +603,22 @@ def retry_payments(_: None = Depends(_require_cron_secret)):
     for row in rows:
         uid = row["id"]
         try:
-            pi = stripe.PaymentIntent.create(
-                amount=amount_ore,
-                currency="nok",
-                customer=row["stripe_customer_id"],
-                off_session=True,
-                confirm=True,
-                metadata={"user_id": str(uid), "type": "retry_after_failure"},
-                expand=["latest_charge"],
-            )
+            with external_call("stripe"):
+                pi = stripe.PaymentIntent.create(
+                    amount=amount_ore,
+                    currency="nok",
+                    customer=row["stripe_customer_id"],
+                    off_session=True,
+                    confirm=True,
+                    metadata={"user_id": str(uid), "type": "retry_after_failure"},
+                    expand=["latest_charge"],
+                )
             if pi.status == "succeeded":
                 with get_connection() as conn2:
                     cur2 = get_cursor(conn2)
                     try:
                         cur2.execute(
-                            "UPDATE users SET first_charge_done = TRUE, payment_failed_at = NULL, next_payment_retry_at = NULL, payment_retry_count = 0, oppdatert = NOW() WHERE id = %s",
+                            "UPDATE users SET first_charge_done = TRUE, payment_failed_at = NULL, payment_action_required_at = NULL, next_payment_retry_at = NULL, payment_retry_count = 0, oppdatert = NOW() WHERE id = %s",
                             (str(uid),),
                         )
                     finally:
@@ -471,6 +672,173 @@ def retry_payments(_: None = Depends(_require_cron_secret)):
     return {"ok": True, "processed": len(rows), "succeeded": succeeded, "blocked": blocked}
 
 
+def _charge_expired_trials() -> dict:
+    """Første trekk for brukere med utløpt prøveuke (tidligere gjort i GET /api/me)."""
+    if not STRIPE_ENABLED:
+        return {"charged": 0, "requires_action": 0, "failed": 0}
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT id, email, navn, stripe_customer_id
+                FROM users
+                WHERE trial_ends_at <= NOW() AND first_charge_done = FALSE
+                  AND account_blocked_at IS NULL AND next_payment_retry_at IS NULL
+                  AND stripe_customer_id IS NOT NULL
+                ORDER BY trial_ends_at
+                LIMIT 500
+                """
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    if not rows:
+        return {"charged": 0, "requires_action": 0, "failed": 0}
+
+    import stripe
+    stripe.api_key = STRIPE_SECRET_KEY
+    if STRIPE_API_BASE:
+        stripe.api_base = STRIPE_API_BASE
+    amount_ore = _first_payment_kr() * 100
+    today = datetime.now(timezone.utc).date().isoformat()
+    charged = requires_action = failed = 0
+    for row in rows:
+        uid = row["id"]
+        try:
+            with external_call("stripe"):
+                pi = stripe.PaymentIntent.create(
+                    amount=amount_ore,
+                    currency="nok",
+                    customer=row["stripe_customer_id"],
+                    off_session=True,
+                    confirm=True,
+                    metadata={"user_id": str(uid), "type": "first_after_trial"},
+                    expand=["latest_charge"],
+                    # Maks ett forsøk per bruker og døgn, også om jobben kjøres flere ganger
+                    idempotency_key=f"first-after-trial-{uid}-{today}",
+                )
+        except Exception:
+            failed += 1
+            _record_payment_failure(user_id=uid, email=row["email"], navn=row.get("navn"))
+            continue
+        if pi.status == "succeeded":
+            with get_connection() as conn2:
+                cur2 = get_cursor(conn2)
+                try:
+                    cur2.execute(
+                        "UPDATE users SET first_charge_done = TRUE, payment_failed_at = NULL, payment_action_required_at = NULL, next_payment_retry_at = NULL, payment_retry_count = 0, oppdatert = NOW() WHERE id = %s",
+                        (str(uid),),
+                    )
+                finally:
+                    cur2.close()
+            try:
+                from app.sales_documents import create_from_payment_success
+                charge_id = pi.latest_charge.id if getattr(pi, "latest_charge", None) else None
+                create_from_payment_success(
+                    user_id=uid,
+                    customer_name=row.get("navn"),
+                    customer_email=row["email"],
+                    total_ore=amount_ore,
+                    description="Første betaling – abonnement (etter prøveuke)",
+                    stripe_payment_intent_id=pi.id,
+                    stripe_charge_id=charge_id,
+                )
+            except Exception:
+                pass
+            charged += 1
+        elif pi.status == "requires_action":
+            with get_connection() as conn2:
+                cur2 = get_cursor(conn2)
+                try:
+                    cur2.execute(
+                        "UPDATE users SET payment_action_required_at = COALESCE(payment_action_required_at, NOW()), oppdatert = NOW() WHERE id = %s",
+                        (str(uid),),
+                    )
+                finally:
+                    cur2.close()
+            requires_action += 1
+    return {"charged": charged, "requires_action": requires_action, "failed": failed}
+
+
+def _expire_coach_access() -> dict:
+    """Varsle (coach_ended) for coach-tilganger som har nådd slutt_dato av seg selv."""
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE kunde_coach SET slutt_varslet = TRUE
+                WHERE slutt_dato <= NOW() AND slutt_varslet = FALSE
+                RETURNING kunde_id, coach_id
+                """
+            )
+            ended = cur.fetchall()
+            for r in ended:
+                publish(
+                    cur,
+                    [r["kunde_id"], r["coach_id"]],
+                    "coach_ended",
+                    {"user_id": str(r["kunde_id"]), "coach_id": str(r["coach_id"])},
+                )
+        finally:
+            cur.close()
+    return {"expired": len(ended)}
+
+
+def _ensure_partitions_job() -> dict:
+    ensure_upcoming_partitions()
+    return {"ok": True}
+
+
+# Batchjobber spres i lavtrafikk-vinduet (UTC)
+BATCH_JOB_HOURS = parse_hours(os.getenv("BATCH_JOB_HOURS", "1-5"))
+
+register_job(
+    "retry-payments",
+    _retry_failed_payments,
+    24 * 3600,
+    hours=BATCH_JOB_HOURS,
+    description="Ukentlig nytt forsøk på mislykkede betalinger; sperr konto siste dag i måneden",
+)
+register_job("trial-charges", _charge_expired_trials, 3600, description="Første trekk etter prøveuke")
+register_job(
+    "coach-access-expiry",
+    _expire_coach_access,
+    300,
+    description="Send coach_ended når en coach-periode er utløpt",
+)
+register_job("export-cleanup", cleanup_exports, 3600, description="Slett utløpte dataeksporter fra lagring")
+register_job(
+    "energy-estimates",
+    compute_estimates,
+    24 * 3600,
+    hours=BATCH_JOB_HOURS,
+    description="Estimert energiforbruk (TDEE) og forslag til kcal-mål fra inntak og vekttrend",
+)
+register_job(
+    "ensure-partitions",
+    _ensure_partitions_job,
+    24 * 3600,
+    hours=BATCH_JOB_HOURS,
+    description="Opprett månedspartisjoner PARTITION_MONTHS_AHEAD frem i tid",
+)
+
+
+# --- Admin: planlagte jobber ---
+@app.get("/api/admin/jobs")
+def list_scheduled_jobs(_admin_id: UUID = Depends(require_admin)):
+    return job_status()
+
+
+@app.post("/api/admin/jobs/{name}/run")
+def run_scheduled_job(name: str, _admin_id: UUID = Depends(require_admin)):
+    """Kjør jobben ved planleggerens neste tikk (på lederen)."""
+    if name not in registered_jobs() or not run_soon(name):
+        raise HTTPException(status_code=404, detail="Jobb ikke funnet")
+    return {"ok": True}
+
+
 # --- Stripe webhooks: salgsdokumenter + PowerOffice (invoice.paid, subscription.deleted, charge.refunded) ---
 @app.post("/api/webhooks/stripe")
 async def stripe_webhook(request: Request):
@@ -481,6 +849,8 @@ async def stripe_webhook(request: Request):
     sig = request.headers.get("Stripe-Signature", "")
     import stripe
     stripe.api_key = STRIPE_SECRET_KEY
+    if STRIPE_API_BASE:
+        stripe.api_base = STRIPE_API_BASE
     try:
         event = stripe.Webhook.construct_event(body, sig, STRIPE_WEBHOOK_SECRET)
     except ValueError:
@@ -498,7 +868,11 @@ async def stripe_webhook(request: Request):
         inv_id = sub.get("latest_invoice")
         if inv_id:
             try:
-                inv = stripe.Invoice.retrieve(inv_id) if isinstance(inv_id, str) else inv_id
+                if isinstance(inv_id, str):
+                    with external_call("stripe"):
+                        inv = stripe.Invoice.retrieve(inv_id)
+                else:
+                    inv = inv_id
                 inv_obj = inv if isinstance(inv, dict) else inv
                 inv_no = sd.create_from_stripe_invoice(inv_obj)
                 if inv_no:
@@ -575,55 +949,148 @@ class MealIn(BaseModel):
     entries: list[MealEntryProductIn | MealEntryRecipeIn] = []
 
 
-@app.get("/api/food-products", response_model=list[FoodProductOut])
-def list_food_products(q: str = "", user_id: UUID = Depends(require_user)):
-    """Søk i matdatabasen (global + brukerens egne matvarer)."""
+class MealTemplateIn(BaseModel):
+    name: str
+    time_slot: str | None = None  # HH:MM
+    entries: list[MealEntryProductIn | MealEntryRecipeIn] = []
+
+
+class MealTemplateApplyIn(BaseModel):
+    log_date: str  # YYYY-MM-DD
+    time_slot: str | None = None  # HH:MM, overstyrer malens tid
+
+
+class MealCopyIn(BaseModel):
+    from_date: str  # YYYY-MM-DD
+    to_date: str  # YYYY-MM-DD
+    meal_ids: list[UUID] | None = None  # None = alle måltider fra from_date
+
+
+FOOD_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("FOOD_SEARCH_CACHE_TTL_SECONDS", "300"))
+FOOD_SEARCH_LIMIT = 50
+FOOD_BROWSE_LIMIT = 100
+
+
+def _load_global_foods(q: str, limit: int) -> list[dict]:
+    """
+    Global katalog (user_id IS NULL) sortert på navn – lik for alle brukere, så den caches.
+    Leses fra primær: en replika som ligger etter ville lagt gamle data i cachen etter en invalidering.
+    """
     with get_connection() as conn:
         cur = get_cursor(conn)
         try:
-            if q.strip():
+            if q:
                 cur.execute(
-                    """
-                    SELECT id, name, barcode, source, brand, image_url, user_id,
-                           kcal_per_100, protein_per_100, carbs_per_100, fat_per_100
+                    f"""
+                    SELECT {PRODUCT_COLUMNS}
                     FROM food_products
-                    WHERE (user_id IS NULL OR user_id = %s) AND LOWER(name) LIKE LOWER(%s)
+                    WHERE user_id IS NULL AND LOWER(name) LIKE LOWER(%s)
                     ORDER BY name
-                    LIMIT 50
+                    LIMIT %s
                     """,
-                    (str(user_id), f"%{q.strip()}%"),
+                    (f"%{q}%", limit),
                 )
             else:
                 cur.execute(
-                    """
-                    SELECT id, name, barcode, source, brand, image_url, user_id,
-                           kcal_per_100, protein_per_100, carbs_per_100, fat_per_100
+                    f"SELECT {PRODUCT_COLUMNS} FROM food_products WHERE user_id IS NULL ORDER BY name LIMIT %s",
+                    (limit,),
+                )
+            return [product_payload(r) for r in cur.fetchall()]
+        finally:
+            cur.close()
+
+
+@app.get("/api/food-products", response_model=list[FoodProductOut])
+def list_food_products(q: str = "", user_id: UUID = Depends(require_user)):
+    """
+    Søk i matdatabasen (global + brukerens egne matvarer). Treff brukeren logger ofte/nylig
+    kommer først. Den globale delen caches per søkeord (FOOD_SEARCH_CACHE_TTL_SECONDS); det
+    brukerspesifikke (egne matvarer, user_food_usage) leses med indekserte oppslag per bruker.
+    """
+    q = q.strip()
+    limit = FOOD_SEARCH_LIMIT if q else FOOD_BROWSE_LIMIT
+    global_foods = get_or_compute(
+        "food_products", f"{limit}:{q.lower()}", FOOD_SEARCH_CACHE_TTL_SECONDS, lambda: _load_global_foods(q, limit)
+    )
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = get_cursor(conn)
+        try:
+            if q:
+                cur.execute(
+                    f"""
+                    SELECT {PRODUCT_COLUMNS}, u.rank
+                    FROM (SELECT food_product_id AS id, rank FROM user_food_usage WHERE user_id = %(user_id)s) u
+                    JOIN food_products USING (id)
+                    WHERE (user_id IS NULL OR user_id = %(user_id)s) AND LOWER(name) LIKE LOWER(%(q)s)
+                    UNION ALL
+                    SELECT {PRODUCT_COLUMNS}, NULL
+                    FROM food_products
+                    WHERE user_id = %(user_id)s AND LOWER(name) LIKE LOWER(%(q)s)
+                    """,
+                    {"user_id": str(user_id), "q": f"%{q}%"},
+                )
+            else:
+                cur.execute(
+                    f"""
+                    SELECT {PRODUCT_COLUMNS}, NULL AS rank
                     FROM food_products
-                    WHERE user_id IS NULL OR user_id = %s
+                    WHERE user_id = %s
                     ORDER BY name
-                    LIMIT 100
+                    LIMIT %s
                     """,
-                    (str(user_id),),
+                    (str(user_id), limit),
                 )
             rows = cur.fetchall()
-            return [
-                {
-                    "id": str(r["id"]),
-                    "name": r["name"],
-                    "barcode": r.get("barcode"),
-                    "source": r.get("source"),
-                    "brand": r.get("brand"),
-                    "image_url": r.get("image_url"),
-                    "user_id": str(r["user_id"]) if r.get("user_id") else None,
-                    "kcal_per_100": float(r["kcal_per_100"]),
-                    "protein_per_100": float(r["protein_per_100"]),
-                    "carbs_per_100": float(r["carbs_per_100"]),
-                    "fat_per_100": float(r["fat_per_100"]),
-                }
-                for r in rows
-            ]
         finally:
             cur.close()
+    # Rangerte (brukt før) først etter rank, deretter resten etter navn – som én ORDER BY før
+    ranked = sorted((r for r in rows if r["rank"] is not None), key=lambda r: r["rank"], reverse=True)
+    out = [product_payload(r) for r in ranked]
+    seen = {p["id"] for p in out}
+    rest = [product_payload(r) for r in rows if r["rank"] is None]
+    for p in sorted(global_foods + rest, key=lambda p: p["name"].lower()):
+        if p["id"] not in seen:
+            seen.add(p["id"])
+            out.append(p)
+    # Payload er allerede i FoodProductOut-form; ORJSONResponse hopper over ny validering/encoding
+    return ORJSONResponse(out[:limit])
+
+
+@app.get("/api/food-products/recent")
+def list_recent_food_products(limit: int = 30, user_id: UUID = Depends(require_user)):
+    """
+    Brukerens mest brukte/nylige matvarer (user_food_usage, rangert etter frecency), med
+    sist brukte mengde i last_amount_gram. Én indeksert lesing av (user_id, rank DESC).
+    """
+    limit = max(1, min(limit, 100))
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                f"""
+                SELECT {PRODUCT_COLUMNS}, u.last_amount_gram
+                FROM (
+                    SELECT food_product_id, rank, last_amount_gram FROM user_food_usage
+                    WHERE user_id = %s
+                    ORDER BY rank DESC
+                    LIMIT %s
+                ) u
+                JOIN food_products ON food_products.id = u.food_product_id
+                WHERE user_id IS NULL OR user_id = %s
+                ORDER BY u.rank DESC
+                """,
+                (str(user_id), limit, str(user_id)),
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    return ORJSONResponse([
+        {
+            **product_payload(r),
+            "last_amount_gram": float(r["last_amount_gram"]) if r["last_amount_gram"] is not None else None,
+        }
+        for r in rows
+    ])
 
 
 @app.get("/api/food/by-barcode", response_model=FoodProductOut | None)
@@ -643,17 +1110,21 @@ def get_food_by_barcode(barcode: str = "", user_id: UUID = Depends(require_user)
 @app.post("/api/food", response_model=FoodProductOut)
 def create_user_food(body: UserFoodIn, user_id: UUID = Depends(require_user)):
     """Registrer brukerens egen matvare (manuell registrering når strekkode ikke finnes)."""
-    barcode = (body.barcode or "").strip() or None
-    if barcode and len(barcode) > 20:
-        barcode = barcode[:20]
+    barcode = None
+    if (body.barcode or "").strip():
+        # GTIN i samme kanoniske form som oppslag, så varen finnes igjen uansett hvordan den
+        # skannes; egne koder lagres som skrevet og finnes med eksakt oppslag
+        barcode = user_barcode(body.barcode)
+        if not barcode:
+            raise HTTPException(status_code=400, detail="Ugyldig strekkode (sjekk antall siffer og kontrollsiffer)")
     with get_connection() as conn:
         cur = get_cursor(conn)
         cur.execute(
-            """
+            f"""
             INSERT INTO food_products
             (name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100)
             VALUES (%s, %s, 'user', %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, name, barcode, source, brand, image_url, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100
+            RETURNING {PRODUCT_COLUMNS}
             """,
             (
                 body.name.strip()[:255],
@@ -668,19 +1139,7 @@ def create_user_food(body: UserFoodIn, user_id: UUID = Depends(require_user)):
             ),
         )
         r = cur.fetchone()
-    return {
-        "id": str(r["id"]),
-        "name": r["name"],
-        "barcode": r.get("barcode"),
-        "source": r.get("source"),
-        "brand": r.get("brand"),
-        "image_url": r.get("image_url"),
-        "user_id": str(r["user_id"]) if r.get("user_id") else None,
-        "kcal_per_100": float(r["kcal_per_100"]),
-        "protein_per_100": float(r["protein_per_100"]),
-        "carbs_per_100": float(r["carbs_per_100"]),
-        "fat_per_100": float(r["fat_per_100"]),
-    }
+    return product_payload(r)
 
 
 def _recipe_totals(recipe_id: UUID) -> dict:
@@ -803,137 +1262,526 @@ def create_recipe(body: RecipeIn, user_id: UUID = Depends(require_user)):
     return {"id": str(recipe_id), "totals": _recipe_totals(UUID(str(recipe_id)))}
 
 
-@app.get("/api/meals")
-def list_meals(date: str, user_id: UUID = Depends(require_user)):
-    """Måltider for en gitt dag (log_date YYYY-MM-DD)."""
-    with get_connection() as conn:
+MEALS_MAX_RANGE_DAYS = 31
+
+
+def _load_meal_days(user_id: UUID, from_date: str, to_date: str, summary_only: bool = False) -> dict[str, dict]:
+    """
+    Måltider med linjer og næring for [from_date, to_date], gruppert per dag.
+    To spørringer uansett antall dager/måltider/linjer: måltidene, og alle linjer med
+    matvare, oppskrift og oppskriftens totaler (per 100 g × gram) i én join.
+    """
+    with get_connection(read_only=True, user_id=user_id) as conn:
         cur = get_cursor(conn)
         try:
             cur.execute(
-                "SELECT id, log_date, name, time_slot, created_at FROM meals WHERE user_id = %s AND log_date = %s ORDER BY time_slot NULLS LAST, created_at",
-                (str(user_id), date),
+                """
+                SELECT id, log_date, name, time_slot, created_at
+                FROM meals
+                WHERE user_id = %(user_id)s AND log_date BETWEEN %(from)s AND %(to)s
+                ORDER BY log_date, time_slot NULLS LAST, created_at
+                """,
+                {"user_id": str(user_id), "from": from_date, "to": to_date},
             )
             meals = cur.fetchall()
+            cur.execute(
+                """
+                WITH e AS (
+                    SELECT me.id, me.meal_id, me.food_product_id, me.recipe_id, me.amount_gram, me.portions
+                    FROM meal_entries me
+                    JOIN meals m ON m.id = me.meal_id AND m.log_date = me.log_date
+                    WHERE m.user_id = %(user_id)s
+                      AND m.log_date BETWEEN %(from)s AND %(to)s
+                      AND me.log_date BETWEEN %(from)s AND %(to)s
+                ),
+                rt AS (
+                    SELECT ri.recipe_id,
+                           SUM(fp.kcal_per_100 * ri.grams / 100) AS kcal,
+                           SUM(fp.protein_per_100 * ri.grams / 100) AS protein,
+                           SUM(fp.carbs_per_100 * ri.grams / 100) AS carbs,
+                           SUM(fp.fat_per_100 * ri.grams / 100) AS fat
+                    FROM recipe_ingredients ri
+                    JOIN food_products fp ON fp.id = ri.food_product_id
+                    WHERE ri.recipe_id IN (SELECT recipe_id FROM e WHERE recipe_id IS NOT NULL)
+                    GROUP BY ri.recipe_id
+                )
+                SELECT e.id, e.meal_id, e.food_product_id, e.recipe_id, e.amount_gram, e.portions,
+                       fp.name AS product_name, fp.kcal_per_100, fp.protein_per_100, fp.carbs_per_100, fp.fat_per_100,
+                       r.name AS recipe_name, rt.kcal AS r_kcal, rt.protein AS r_protein, rt.carbs AS r_carbs, rt.fat AS r_fat
+                FROM e
+                LEFT JOIN food_products fp ON fp.id = e.food_product_id
+                LEFT JOIN recipes r ON r.id = e.recipe_id
+                LEFT JOIN rt ON rt.recipe_id = e.recipe_id
+                """,
+                {"user_id": str(user_id), "from": from_date, "to": to_date},
+            )
+            entries = cur.fetchall()
         finally:
             cur.close()
-    result = []
+
+    entries_by_meal: dict[str, list] = {}
+    for e in entries:
+        if e["food_product_id"]:
+            g = float(e["amount_gram"]) / 100.0
+            has_fp = e["product_name"] is not None
+            item = {
+                "id": str(e["id"]),
+                "type": "product",
+                "food_product_id": str(e["food_product_id"]),
+                "name": e["product_name"] or "",
+                "amount_gram": float(e["amount_gram"]),
+                "kcal": round(float(e["kcal_per_100"]) * g, 1) if has_fp else 0,
+                "protein": round(float(e["protein_per_100"]) * g, 1) if has_fp else 0,
+                "carbs": round(float(e["carbs_per_100"]) * g, 1) if has_fp else 0,
+                "fat": round(float(e["fat_per_100"]) * g, 1) if has_fp else 0,
+            }
+        else:
+            # Samme avrunding som _recipe_totals: oppskriftstotal til én desimal, så × porsjoner
+            por = float(e["portions"] or 1)
+            item = {
+                "id": str(e["id"]),
+                "type": "recipe",
+                "recipe_id": str(e["recipe_id"]),
+                "name": e["recipe_name"] or "",
+                "portions": por,
+            }
+            for k in ("kcal", "protein", "carbs", "fat"):
+                item[k] = round(round(float(e[f"r_{k}"] or 0), 1) * por, 1)
+        entries_by_meal.setdefault(str(e["meal_id"]), []).append(item)
+
+    days: dict[str, dict] = {}
     for m in meals:
-        with get_connection() as conn2:
-            cur2 = get_cursor(conn2)
-            try:
-                cur2.execute(
-                    "SELECT id, food_product_id, recipe_id, amount_gram, portions FROM meal_entries WHERE meal_id = %s",
-                    (str(m["id"]),),
-                )
-                entries = cur2.fetchall()
-            finally:
-                cur2.close()
-        entries_with_nutrition = []
-        for e in entries:
-            if e["food_product_id"]:
-                with get_connection() as conn3:
-                    cur3 = get_cursor(conn3)
-                    try:
-                        cur3.execute(
-                            "SELECT name, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100 FROM food_products WHERE id = %s",
-                            (str(e["food_product_id"]),),
-                        )
-                        fp = cur3.fetchone()
-                    finally:
-                        cur3.close()
-                g = float(e["amount_gram"]) / 100.0
-                entries_with_nutrition.append({
-                    "id": str(e["id"]),
-                    "type": "product",
-                    "food_product_id": str(e["food_product_id"]),
-                    "name": fp["name"] if fp else "",
-                    "amount_gram": float(e["amount_gram"]),
-                    "kcal": round(float(fp["kcal_per_100"]) * g, 1) if fp else 0,
-                    "protein": round(float(fp["protein_per_100"]) * g, 1) if fp else 0,
-                    "carbs": round(float(fp["carbs_per_100"]) * g, 1) if fp else 0,
-                    "fat": round(float(fp["fat_per_100"]) * g, 1) if fp else 0,
-                })
-            else:
-                tot = _recipe_totals(UUID(str(e["recipe_id"])))
-                with get_connection() as conn3:
-                    cur3 = get_cursor(conn3)
-                    try:
-                        cur3.execute("SELECT name FROM recipes WHERE id = %s", (str(e["recipe_id"]),))
-                        rec = cur3.fetchone()
-                    finally:
-                        cur3.close()
-                por = float(e["portions"] or 1)
-                entries_with_nutrition.append({
-                    "id": str(e["id"]),
-                    "type": "recipe",
-                    "recipe_id": str(e["recipe_id"]),
-                    "name": rec["name"] if rec else "",
-                    "portions": por,
-                    "kcal": round(tot["kcal"] * por, 1),
-                    "protein": round(tot["protein"] * por, 1),
-                    "carbs": round(tot["carbs"] * por, 1),
-                    "fat": round(tot["fat"] * por, 1),
-                })
-        total_kcal = sum(x["kcal"] for x in entries_with_nutrition)
-        total_p = sum(x["protein"] for x in entries_with_nutrition)
-        total_c = sum(x["carbs"] for x in entries_with_nutrition)
-        total_f = sum(x["fat"] for x in entries_with_nutrition)
-        result.append({
-            "id": str(m["id"]),
-            "log_date": str(m["log_date"]),
-            "name": m["name"],
-            "time_slot": m["time_slot"].strftime("%H:%M") if m.get("time_slot") else None,
-            "entries": entries_with_nutrition,
-            "totals": {"kcal": total_kcal, "protein": total_p, "carbs": total_c, "fat": total_f},
+        day_key = m["log_date"].isoformat()
+        day = days.setdefault(day_key, {
+            "date": day_key,
+            "meal_count": 0,
+            "totals": {"kcal": 0, "protein": 0, "carbs": 0, "fat": 0},
+            "meals": [],
         })
-    return result
+        items = entries_by_meal.get(str(m["id"]), [])
+        totals = {k: sum(x[k] for x in items) for k in ("kcal", "protein", "carbs", "fat")}
+        day["meal_count"] += 1
+        for k, v in totals.items():
+            day["totals"][k] += v
+        if not summary_only:
+            day["meals"].append({
+                "id": str(m["id"]),
+                "log_date": day_key,
+                "name": m["name"],
+                "time_slot": m["time_slot"].strftime("%H:%M") if m.get("time_slot") else None,
+                "entries": items,
+                "totals": totals,
+            })
+    for day in days.values():
+        day["totals"] = {k: round(v, 1) for k, v in day["totals"].items()}
+        if summary_only:
+            del day["meals"]
+    return days
+
+
+@app.get("/api/meals")
+def list_meals(
+    date: str = "",
+    from_date: str = "",
+    to_date: str = "",
+    summary_only: bool = False,
+    user_id: UUID = Depends(require_user),
+):
+    """
+    Måltider for en gitt dag (date=YYYY-MM-DD) som liste, eller for et intervall
+    (from_date/to_date, maks MEALS_MAX_RANGE_DAYS dager) med totaler per dag:
+    {"from_date", "to_date", "days": [{"date", "meal_count", "totals", "meals"}]}.
+    summary_only=true utelater måltider og linjer (kun totaler per dag).
+    """
+    if date:
+        try:
+            day = parse_log_date(date).isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Ugyldig dato")
+        days = _load_meal_days(user_id, day, day)
+        return ORJSONResponse(days[day]["meals"] if day in days else [])
+    try:
+        start = parse_log_date(from_date)
+        end = parse_log_date(to_date or from_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Oppgi date eller from_date/to_date (YYYY-MM-DD)")
+    if end < start:
+        raise HTTPException(status_code=400, detail="to_date må være etter from_date")
+    if (end - start).days + 1 > MEALS_MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Maks {MEALS_MAX_RANGE_DAYS} dager per forespørsel")
+    days = _load_meal_days(user_id, start.isoformat(), end.isoformat(), summary_only)
+    out = []
+    d = start
+    while d <= end:
+        key = d.isoformat()
+        empty = {"date": key, "meal_count": 0, "totals": {"kcal": 0, "protein": 0, "carbs": 0, "fat": 0}}
+        if not summary_only:
+            empty["meals"] = []
+        out.append(days.get(key, empty))
+        d += timedelta(days=1)
+    return ORJSONResponse({"from_date": start.isoformat(), "to_date": end.isoformat(), "days": out})
+
+
+# Oppdaterer user_food_usage fra loggede linjer ({entries}: relasjon med food_product_id, amount_gram).
+# k loggføringer nå gir rank + ln(k); sammenslåing er ln(exp(a) + exp(b)) regnet stabilt.
+_FOOD_USAGE_UPSERT = """
+    INSERT INTO user_food_usage (user_id, food_product_id, use_count, last_used_at, last_amount_gram, rank)
+    SELECT %(user_id)s, food_product_id, COUNT(*), NOW(), (ARRAY_AGG(amount_gram))[1],
+           food_usage_rank(NOW()) + LN(COUNT(*))
+    FROM {entries}
+    WHERE food_product_id IS NOT NULL
+    GROUP BY food_product_id
+    ON CONFLICT (user_id, food_product_id) DO UPDATE SET
+        use_count = user_food_usage.use_count + EXCLUDED.use_count,
+        last_used_at = EXCLUDED.last_used_at,
+        last_amount_gram = EXCLUDED.last_amount_gram,
+        rank = GREATEST(user_food_usage.rank, EXCLUDED.rank)
+               + LN(1 + EXP(-ABS(user_food_usage.rank - EXCLUDED.rank)))
+"""
+
+
+def _parse_time_slot(value: str | None):
+    """HH:MM → time, ellers None (ugyldig tid ignoreres som før)."""
+    if not value or not value.strip():
+        return None
+    try:
+        from datetime import time as dt_time
+        parts = value.strip().split(":")
+        return dt_time(int(parts[0]), int(parts[1]) if len(parts) > 1 else 0)
+    except Exception:
+        return None
 
 
 @app.post("/api/meals")
 def create_meal(body: MealIn, user_id: UUID = Depends(require_user)):
     """Opprett måltid med valgfri tid og navn, og enten produkter (gram) eller oppskrifter (porsjoner)."""
-    time_val = None
-    if body.time_slot and body.time_slot.strip():
+    time_val = _parse_time_slot(body.time_slot)
+    try:
+        log_date = ensure_partition_for(body.log_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ugyldig dato")
+    def _write():
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute(
+                    "INSERT INTO meals (user_id, log_date, name, time_slot) VALUES (%s, %s, %s, %s) RETURNING id",
+                    (str(user_id), log_date, (body.name or "").strip() or None, time_val),
+                )
+                meal_id = cur.fetchone()["id"]
+                for e in body.entries:
+                    if getattr(e, "food_product_id", None) is not None:
+                        cur.execute(
+                            "INSERT INTO meal_entries (meal_id, log_date, food_product_id, amount_gram) VALUES (%s, %s, %s, %s)",
+                            (str(meal_id), log_date, e.food_product_id, e.amount_gram),
+                        )
+                    elif getattr(e, "recipe_id", None) is not None:
+                        cur.execute(
+                            "INSERT INTO meal_entries (meal_id, log_date, recipe_id, portions) VALUES (%s, %s, %s, %s)",
+                            (str(meal_id), log_date, e.recipe_id, getattr(e, "portions", 1.0)),
+                        )
+                cur.execute(
+                    _FOOD_USAGE_UPSERT.format(
+                        entries="(SELECT food_product_id, amount_gram FROM meal_entries"
+                        " WHERE meal_id = %(meal_id)s AND log_date = %(log_date)s) e"
+                    ),
+                    {"user_id": str(user_id), "meal_id": str(meal_id), "log_date": log_date},
+                )
+                publish_to_user_and_coaches(
+                    cur, user_id, "meal_logged", {"user_id": str(user_id), "log_date": log_date.isoformat()}
+                )
+            finally:
+                cur.close()
+        return meal_id
+
+    meal_id = with_partition_retry(log_date, _write)
+    return {"id": str(meal_id)}
+
+
+@app.delete("/api/meals/{meal_id}")
+def delete_meal(meal_id: UUID, log_date: str | None = None, user_id: UUID = Depends(require_user)):
+    """log_date (YYYY-MM-DD) er valgfri, men lar Postgres gå rett til riktig månedspartisjon."""
+    if log_date:
         try:
-            from datetime import time as dt_time
-            parts = body.time_slot.strip().split(":")
-            time_val = dt_time(int(parts[0]), int(parts[1]) if len(parts) > 1 else 0)
-        except Exception:
-            pass
+            log_date = parse_log_date(log_date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Ugyldig dato")
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            if log_date:
+                cur.execute(
+                    "DELETE FROM meals WHERE id = %s AND user_id = %s AND log_date = %s RETURNING log_date",
+                    (str(meal_id), str(user_id), log_date),
+                )
+            else:
+                cur.execute(
+                    "DELETE FROM meals WHERE id = %s AND user_id = %s RETURNING log_date", (str(meal_id), str(user_id))
+                )
+            row = cur.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Måltid ikke funnet")
+            publish_to_user_and_coaches(
+                cur, user_id, "meal_deleted", {"user_id": str(user_id), "log_date": row["log_date"].isoformat()}
+            )
+        finally:
+            cur.close()
+    return {"ok": True}
+
+
+@app.post("/api/meals/copy")
+def copy_meals(body: MealCopyIn, user_id: UUID = Depends(require_user)):
+    """
+    Kopier måltider (alle, eller meal_ids) fra from_date til to_date. Måltider og linjer
+    kopieres i én INSERT ... SELECT-setning, uten rundturer per måltid/linje.
+    """
+    try:
+        from_date = parse_log_date(body.from_date)
+        to_date = ensure_partition_for(body.to_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ugyldig dato")
+    if from_date == to_date:
+        raise HTTPException(status_code=400, detail="from_date og to_date må være forskjellige")
+    ids_filter = "AND id = ANY(%(meal_ids)s::uuid[])" if body.meal_ids is not None else ""
+    def _write():
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                # MATERIALIZED: nye id-er genereres én gang og deles av begge INSERT-ene
+                cur.execute(
+                    f"""
+                    WITH src AS MATERIALIZED (
+                        SELECT id, name, time_slot, gen_random_uuid() AS new_id
+                        FROM meals
+                        WHERE user_id = %(user_id)s AND log_date = %(from)s {ids_filter}
+                    ),
+                    m AS (
+                        INSERT INTO meals (id, user_id, log_date, name, time_slot)
+                        SELECT new_id, %(user_id)s, %(to)s, name, time_slot FROM src
+                        RETURNING id
+                    ),
+                    e AS (
+                        INSERT INTO meal_entries (meal_id, log_date, food_product_id, recipe_id, amount_gram, portions)
+                        SELECT src.new_id, %(to)s, me.food_product_id, me.recipe_id, me.amount_gram, me.portions
+                        FROM src
+                        JOIN meal_entries me ON me.meal_id = src.id AND me.log_date = %(from)s
+                        RETURNING food_product_id, amount_gram
+                    ),
+                    u AS ({_FOOD_USAGE_UPSERT.format(entries="e")})
+                    SELECT (SELECT COALESCE(array_agg(id::text), '{{}}') FROM m) AS meal_ids,
+                           (SELECT COUNT(*) FROM e) AS entry_count
+                    """,
+                    {
+                        "user_id": str(user_id),
+                        "from": from_date,
+                        "to": to_date,
+                        "meal_ids": [str(i) for i in body.meal_ids or []],
+                    },
+                )
+                row = cur.fetchone()
+                if row["meal_ids"]:
+                    publish_to_user_and_coaches(
+                        cur, user_id, "meal_logged", {"user_id": str(user_id), "log_date": to_date.isoformat()}
+                    )
+            finally:
+                cur.close()
+        return row
+
+    row = with_partition_retry(to_date, _write)
+    return {"meal_ids": row["meal_ids"], "meals": len(row["meal_ids"]), "entries": row["entry_count"]}
+
+
+# --- Måltidsmaler ---
+@app.get("/api/meal-templates")
+def list_meal_templates(user_id: UUID = Depends(require_user)):
+    """Brukerens maler med linjer (to spørringer, uavhengig av antall maler)."""
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                "SELECT id, name, time_slot FROM meal_templates WHERE user_id = %s ORDER BY name",
+                (str(user_id),),
+            )
+            templates = cur.fetchall()
+            cur.execute(
+                """
+                SELECT te.id, te.template_id, te.food_product_id, te.recipe_id, te.amount_gram, te.portions,
+                       COALESCE(fp.name, r.name) AS name
+                FROM meal_template_entries te
+                JOIN meal_templates t ON t.id = te.template_id
+                LEFT JOIN food_products fp ON fp.id = te.food_product_id
+                LEFT JOIN recipes r ON r.id = te.recipe_id
+                WHERE t.user_id = %s
+                """,
+                (str(user_id),),
+            )
+            entries = cur.fetchall()
+        finally:
+            cur.close()
+    by_template: dict[str, list] = {}
+    for e in entries:
+        if e["food_product_id"]:
+            item = {
+                "id": str(e["id"]),
+                "type": "product",
+                "food_product_id": str(e["food_product_id"]),
+                "name": e["name"] or "",
+                "amount_gram": float(e["amount_gram"]),
+            }
+        else:
+            item = {
+                "id": str(e["id"]),
+                "type": "recipe",
+                "recipe_id": str(e["recipe_id"]),
+                "name": e["name"] or "",
+                "portions": float(e["portions"]),
+            }
+        by_template.setdefault(str(e["template_id"]), []).append(item)
+    return ORJSONResponse([
+        {
+            "id": str(t["id"]),
+            "name": t["name"],
+            "time_slot": t["time_slot"].strftime("%H:%M") if t["time_slot"] else None,
+            "entries": by_template.get(str(t["id"]), []),
+        }
+        for t in templates
+    ])
+
+
+@app.post("/api/meal-templates")
+def create_meal_template(body: MealTemplateIn, user_id: UUID = Depends(require_user)):
+    name = body.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Navn er påkrevd")
     with get_connection() as conn:
         cur = get_cursor(conn)
         try:
             cur.execute(
-                "INSERT INTO meals (user_id, log_date, name, time_slot) VALUES (%s, %s, %s, %s) RETURNING id",
-                (str(user_id), body.log_date, (body.name or "").strip() or None, time_val),
+                "INSERT INTO meal_templates (user_id, name, time_slot) VALUES (%s, %s, %s) RETURNING id",
+                (str(user_id), name, _parse_time_slot(body.time_slot)),
             )
-            meal_id = cur.fetchone()["id"]
+            template_id = cur.fetchone()["id"]
             for e in body.entries:
                 if getattr(e, "food_product_id", None) is not None:
                     cur.execute(
-                        "INSERT INTO meal_entries (meal_id, food_product_id, amount_gram) VALUES (%s, %s, %s)",
-                        (str(meal_id), e.food_product_id, e.amount_gram),
+                        "INSERT INTO meal_template_entries (template_id, food_product_id, amount_gram) VALUES (%s, %s, %s)",
+                        (str(template_id), e.food_product_id, e.amount_gram),
                     )
                 elif getattr(e, "recipe_id", None) is not None:
                     cur.execute(
-                        "INSERT INTO meal_entries (meal_id, recipe_id, portions) VALUES (%s, %s, %s)",
-                        (str(meal_id), e.recipe_id, getattr(e, "portions", 1.0)),
+                        "INSERT INTO meal_template_entries (template_id, recipe_id, portions) VALUES (%s, %s, %s)",
+                        (str(template_id), e.recipe_id, getattr(e, "portions", 1.0)),
                     )
         finally:
             cur.close()
-    return {"id": str(meal_id)}
+    return {"id": str(template_id)}
 
 
-@app.delete("/api/meals/{meal_id}")
-def delete_meal(meal_id: UUID, user_id: UUID = Depends(require_user)):
+@app.post("/api/meals/{meal_id}/save-as-template")
+def save_meal_as_template(
+    meal_id: UUID, name: str | None = None, log_date: str | None = None, user_id: UUID = Depends(require_user),
+):
+    """Lagre et eksisterende måltid som mal (navn og tid fra måltidet hvis name ikke er oppgitt)."""
+    date_filter = "AND log_date = %(log_date)s" if log_date else ""
     with get_connection() as conn:
         cur = get_cursor(conn)
         try:
-            cur.execute("DELETE FROM meals WHERE id = %s AND user_id = %s RETURNING id", (str(meal_id), str(user_id)))
-            if not cur.fetchone():
+            cur.execute(
+                f"""
+                WITH src AS (
+                    SELECT id, log_date, name, time_slot FROM meals
+                    WHERE id = %(meal_id)s AND user_id = %(user_id)s {date_filter}
+                ),
+                t AS (
+                    INSERT INTO meal_templates (user_id, name, time_slot)
+                    SELECT %(user_id)s, COALESCE(NULLIF(%(name)s, ''), src.name, 'Måltid'), src.time_slot FROM src
+                    RETURNING id
+                ),
+                e AS (
+                    INSERT INTO meal_template_entries (template_id, food_product_id, recipe_id, amount_gram, portions)
+                    SELECT t.id, me.food_product_id, me.recipe_id, me.amount_gram, me.portions
+                    FROM t, src
+                    JOIN meal_entries me ON me.meal_id = src.id AND me.log_date = src.log_date
+                    RETURNING 1
+                )
+                SELECT t.id, (SELECT COUNT(*) FROM e) AS entry_count FROM t
+                """,
+                {"meal_id": str(meal_id), "user_id": str(user_id), "log_date": log_date, "name": (name or "").strip()},
+            )
+            row = cur.fetchone()
+            if not row:
                 raise HTTPException(status_code=404, detail="Måltid ikke funnet")
         finally:
             cur.close()
+    return {"id": str(row["id"]), "entries": row["entry_count"]}
+
+
+@app.post("/api/meal-templates/{template_id}/apply")
+def apply_meal_template(template_id: UUID, body: MealTemplateApplyIn, user_id: UUID = Depends(require_user)):
+    """Legg malen inn som måltid på log_date – måltid og linjer i én setning."""
+    try:
+        log_date = ensure_partition_for(body.log_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ugyldig dato")
+    def _write():
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            try:
+                cur.execute(
+                    f"""
+                    WITH t AS (
+                        SELECT id, name, time_slot FROM meal_templates
+                        WHERE id = %(template_id)s AND user_id = %(user_id)s
+                    ),
+                    m AS (
+                        INSERT INTO meals (user_id, log_date, name, time_slot)
+                        SELECT %(user_id)s, %(log_date)s, t.name, COALESCE(%(time_slot)s, t.time_slot) FROM t
+                        RETURNING id
+                    ),
+                    e AS (
+                        INSERT INTO meal_entries (meal_id, log_date, food_product_id, recipe_id, amount_gram, portions)
+                        SELECT m.id, %(log_date)s, te.food_product_id, te.recipe_id, te.amount_gram, te.portions
+                        FROM m, meal_template_entries te
+                        WHERE te.template_id = %(template_id)s
+                        RETURNING food_product_id, amount_gram
+                    ),
+                    u AS ({_FOOD_USAGE_UPSERT.format(entries="e")})
+                    SELECT m.id, (SELECT COUNT(*) FROM e) AS entry_count FROM m
+                    """,
+                    {
+                        "template_id": str(template_id),
+                        "user_id": str(user_id),
+                        "log_date": log_date,
+                        "time_slot": _parse_time_slot(body.time_slot),
+                    },
+                )
+                row = cur.fetchone()
+                if not row:
+                    raise HTTPException(status_code=404, detail="Mal ikke funnet")
+                publish_to_user_and_coaches(
+                    cur, user_id, "meal_logged", {"user_id": str(user_id), "log_date": log_date.isoformat()}
+                )
+            finally:
+                cur.close()
+        return row
+
+    row = with_partition_retry(log_date, _write)
+    return {"id": str(row["id"]), "entries": row["entry_count"]}
+
+
+@app.delete("/api/meal-templates/{template_id}")
+def delete_meal_template(template_id: UUID, user_id: UUID = Depends(require_user)):
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                "DELETE FROM meal_templates WHERE id = %s AND user_id = %s RETURNING id",
+                (str(template_id), str(user_id)),
+            )
+            if not cur.fetchone():
+                raise HTTPException(status_code=404, detail="Mal ikke funnet")
+        finally:
+            cur.close()
     return {"ok": True}
 
 
@@ -971,7 +1819,7 @@ def get_weight_history(
         to_date = today.isoformat()
     if not from_date:
         from_date = (today - timedelta(days=365)).isoformat()
-    with get_connection() as conn:
+    with get_connection(read_only=True, user_id=user_id) as conn:
         cur = get_cursor(conn)
         cur.execute(
             """
@@ -983,10 +1831,7 @@ def get_weight_history(
             (str(user_id), from_date, to_date),
         )
         rows = cur.fetchall()
-    return [
-        {"date": str(r["log_date"]), "weight_kg": float(r["weight_kg"])}
-        for r in rows
-    ]
+    return ORJSONResponse([weight_payload(r) for r in rows])
 
 
 @app.post("/api/weight")
@@ -995,19 +1840,102 @@ def upsert_weight(body: WeightIn, user_id: UUID = Depends(require_user)):
     weight_kg = round(float(body.weight_kg), 2)
     if weight_kg <= 0 or weight_kg > 500:
         raise HTTPException(status_code=400, detail="Ugyldig vekt")
-    with get_connection() as conn:
-        cur = get_cursor(conn)
-        cur.execute(
-            """
-            INSERT INTO weight_entries (user_id, log_date, weight_kg)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (user_id, log_date) DO UPDATE SET weight_kg = EXCLUDED.weight_kg, created_at = NOW()
-            """,
-            (str(user_id), body.date, weight_kg),
-        )
+    try:
+        log_date = ensure_partition_for(body.date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ugyldig dato")
+    def _write():
+        with get_connection() as conn:
+            cur = get_cursor(conn)
+            cur.execute(
+                """
+                INSERT INTO weight_entries (user_id, log_date, weight_kg)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (user_id, log_date) DO UPDATE SET weight_kg = EXCLUDED.weight_kg, created_at = NOW()
+                """,
+                (str(user_id), log_date, weight_kg),
+            )
+            publish_to_user_and_coaches(
+                cur, user_id, "weight_logged", {"user_id": str(user_id), "log_date": log_date.isoformat()}
+            )
+
+    with_partition_retry(log_date, _write)
     return {"date": body.date, "weight_kg": weight_kg}
 
 
+# --- Aktivitet fra klokker/helseapper (skritt, puls, treningsøkter) ---
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={"/api/activity/samples": ACTIVITY_MAX_BODY_BYTES},
+    detail=f"For stor batch (maks {ACTIVITY_MAX_BODY_BYTES // (1024 * 1024)} MB) – del opp i flere kall",
+)
+
+
+@app.post("/api/activity/samples")
+async def ingest_activity_samples(request: Request, user_id: UUID = Depends(require_user)):
+    """
+    Batch med samples fra mobilappen (se app/activity.py for format). Body leses rått og
+    parses med orjson i stedet for en Pydantic-modell per sample; lagring med COPY + merge.
+    Idempotent: samme batch på nytt gir bare duplikater.
+    """
+    body = await request.body()
+    try:
+        return await run_in_threadpool(ingest_batch, user_id, body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+ACTIVITY_DAILY_MAX_RANGE_DAYS = 366
+ACTIVITY_HOURLY_MAX_RANGE_DAYS = 31
+
+
+def _activity_range(from_date: str, to_date: str, max_days: int) -> tuple:
+    try:
+        start = parse_log_date(from_date)
+        end = parse_log_date(to_date or from_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Oppgi from_date/to_date (YYYY-MM-DD)")
+    if end < start:
+        raise HTTPException(status_code=400, detail="to_date må være etter from_date")
+    if (end - start).days + 1 > max_days:
+        raise HTTPException(status_code=400, detail=f"Maks {max_days} dager per forespørsel")
+    return start, end
+
+
+@app.get("/api/activity/daily")
+def get_activity_daily(from_date: str = "", to_date: str = "", user_id: UUID = Depends(require_user)):
+    """Skritt, puls og treningsøkter per dag (activity_daily), maks ACTIVITY_DAILY_MAX_RANGE_DAYS."""
+    start, end = _activity_range(from_date, to_date, ACTIVITY_DAILY_MAX_RANGE_DAYS)
+    return ORJSONResponse(daily_activity(user_id, start, end))
+
+
+@app.get("/api/activity/hourly")
+def get_activity_hourly(from_date: str = "", to_date: str = "", user_id: UUID = Depends(require_user)):
+    """Skritt og puls per time fra dagsbitene, maks ACTIVITY_HOURLY_MAX_RANGE_DAYS."""
+    start, end = _activity_range(from_date, to_date, ACTIVITY_HOURLY_MAX_RANGE_DAYS)
+    return ORJSONResponse(hourly_activity(user_id, start, end))
+
+
+@app.get("/api/activity/sources")
+def list_activity_sources(user_id: UUID = Depends(require_user)):
+    """Tilkoblede kilder med siste sample (synk-anker for appen) og siste opplasting."""
+    with get_connection(read_only=True, user_id=user_id) as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT source, last_sample_at, last_upload_at
+                FROM activity_sources
+                WHERE user_id = %s
+                ORDER BY source
+                """,
+                (str(user_id),),
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+
 # --- Bruker: søk om coach (venter på admin-godkjenning) ---
 @app.post("/api/me/request-coach")
 def request_coach(user_id: UUID = Depends(require_user)):
@@ -1087,6 +2015,53 @@ def set_user_role(user_id: UUID, body: SetRoleRequest, _admin_id: UUID = Depends
     return {"ok": True}
 
 
+# --- Admin: profilering av trege forespørsler (PROFILING_ENABLED) ---
+@app.get("/api/admin/profiling/traces")
+def list_profiling_traces(_admin_id: UUID = Depends(require_admin)):
+    """Siste spor (nyeste først): rute, varighet, antall spørringer og DB-tid."""
+    return list_traces()
+
+
+@app.get("/api/admin/profiling/traces/{trace_id}")
+def get_profiling_trace(trace_id: str, _admin_id: UUID = Depends(require_admin)):
+    """Fullt spor: SQL-setninger, tilkoblingstid, evt. EXPLAIN ANALYZE og CPU-profil."""
+    trace = get_trace(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Spor ikke funnet")
+    return trace
+
+
+# --- Sanntidshendelser (SSE over LISTEN/NOTIFY) ---
+@app.post("/api/events/token")
+def create_event_stream_token(user_id: UUID = Depends(require_user)):
+    """Kortlevd token til GET /api/events?token=… (EventSource kan ikke sende Authorization)."""
+    return {
+        "token": create_events_token(str(user_id), EVENTS_TOKEN_EXPIRES_SECONDS),
+        "expires_in": EVENTS_TOKEN_EXPIRES_SECONDS,
+    }
+
+
+@app.get("/api/events")
+async def event_stream_endpoint(token: str = ""):
+    """
+    Server-Sent Events for innlogget bruker: meal_logged, meal_deleted, weight_logged
+    (egne og coach-kunders), coach_started, coach_ended og resync. Tokenet sjekkes kun ved
+    oppkobling; strømmen kan være åpen lenge etter at det er utløpt.
+    """
+    if not EVENTS_ENABLED:
+        raise HTTPException(status_code=503, detail="Sanntidshendelser er ikke aktivert")
+    payload = decode_events_token(token)
+    if not payload or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Ugyldig eller utløpt token")
+    if connection_count() >= EVENTS_MAX_CONNECTIONS:
+        raise HTTPException(status_code=503, detail="For mange åpne tilkoblinger, prøv igjen senere")
+    return StreamingResponse(
+        event_stream(str(UUID(payload["sub"]))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --- Media / objektlagring (MinIO lokalt, S3/R2 i prod) ---
 ALLOWED_UPLOAD_CONTENT_TYPES = {
     "image/jpeg",
@@ -1096,7 +2071,35 @@ ALLOWED_UPLOAD_CONTENT_TYPES = {
     "video/mp4",
     "video/webm",
 }
-MAX_UPLOAD_BYTES = 50 * 1024 * 1024  # 50 MB
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))  # 50 MB
+UPLOAD_PRESIGN_EXPIRES_SECONDS = int(os.getenv("UPLOAD_PRESIGN_EXPIRES_SECONDS", "600"))
+# Kvitteringen (upload_token) gjelder så lenge etter at presign-URL-en har gått ut
+UPLOAD_COMPLETE_GRACE_SECONDS = 3600
+# Direkte opplastinger lander her og er ikke offentlige før /api/upload/complete har godkjent
+# og flyttet dem til endelig nøkkel. Det som aldri fullføres, slettes av jobben upload-cleanup.
+UPLOAD_PENDING_PREFIX = "pending-uploads/"
+_UPLOAD_PREFIX = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+_UPLOAD_TYPE_ERROR = "Ugyldig filtype. Tillatt: bilder (jpeg, png, gif, webp), video (mp4, webm)"
+_UPLOAD_SIZE_ERROR = f"Filen er for stor (maks {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"
+
+# Proxy-opplasting: avbryt lesing av body over grensen (+ margin for multipart-overhead)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={"/api/upload": MAX_UPLOAD_BYTES + 64 * 1024},
+    detail=_UPLOAD_SIZE_ERROR,
+)
+
+
+def _upload_prefix(prefix: str) -> str:
+    prefix = (prefix or "media").strip().lower()
+    if not _UPLOAD_PREFIX.match(prefix) or f"{prefix}/" in (EXPORT_PREFIX, UPLOAD_PENDING_PREFIX):
+        raise HTTPException(status_code=400, detail="Ugyldig prefix")
+    return prefix
+
+
+def _upload_result(key: str) -> dict:
+    url = f"/api/media/{key}"
+    return {"url": url, "key": key, "variants": {v: f"{url}?variant={v}" for v in VARIANT_NAMES}}
 
 
 @app.post("/api/upload")
@@ -1106,24 +2109,122 @@ def upload_media(
     user_id: UUID = Depends(require_user),
 ):
     """
-    Last opp bilde eller video. Returnerer URL (path) som brukes i /api/media/...
+    Last opp bilde eller video via API-et. Returnerer URL (path) som brukes i /api/media/...
     prefix kan f.eks. være 'coach' for coach-profilbilder.
+    WebP-varianter (avatar, card, full; poster for video) lages i bakgrunnen etter svaret.
+    Større filer bør gå direkte til lagring: /api/upload/presign + /api/upload/complete.
     """
     if not STORAGE_ENABLED:
         raise HTTPException(status_code=503, detail="Upload er ikke konfigurert (S3/MinIO)")
     ct = file.content_type or ""
     if ct not in ALLOWED_UPLOAD_CONTENT_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Ugyldig filtype. Tillatt: bilder (jpeg, png, gif, webp), video (mp4, webm)",
-        )
-    key = make_key(prefix, file.filename or "file")
+        raise HTTPException(status_code=400, detail=_UPLOAD_TYPE_ERROR)
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=_UPLOAD_SIZE_ERROR)
+    key = make_key(_upload_prefix(prefix), file.filename or "file")
     try:
         upload_fileobj(file.file, key, ct)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Opplasting feilet")
-    url = f"/api/media/{key}"
-    return {"url": url, "key": key}
+    submit_upload_processing(key, ct)
+    return _upload_result(key)
+
+
+class UploadPresignIn(BaseModel):
+    filename: str
+    content_type: str
+    size: int | None = None  # bytes, hvis klienten vet det (avvises tidlig)
+    prefix: str = "media"
+
+
+class UploadCompleteIn(BaseModel):
+    key: str
+    upload_token: str
+
+
+@app.post("/api/upload/presign")
+def presign_upload(body: UploadPresignIn, user_id: UUID = Depends(require_user)):
+    """
+    Direkte opplasting klient → S3/MinIO uten å gå gjennom API-workeren. Returnerer en
+    presignert POST-policy (url + fields) som låser nøkkel, filtype og maks størrelse.
+    Klienten sender multipart/form-data til url med alle fields og til slutt `file`, og
+    kaller deretter /api/upload/complete med key og upload_token. Filen lastes opp under
+    UPLOAD_PENDING_PREFIX og blir først tilgjengelig på key etter complete.
+    """
+    if not STORAGE_ENABLED:
+        raise HTTPException(status_code=503, detail="Upload er ikke konfigurert (S3/MinIO)")
+    if body.content_type not in ALLOWED_UPLOAD_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=_UPLOAD_TYPE_ERROR)
+    if body.size is not None and (body.size <= 0 or body.size > MAX_UPLOAD_BYTES):
+        raise HTTPException(status_code=413, detail=_UPLOAD_SIZE_ERROR)
+    key = make_key(_upload_prefix(body.prefix), body.filename or "file")
+    try:
+        post = presign_post(
+            UPLOAD_PENDING_PREFIX + key, body.content_type, MAX_UPLOAD_BYTES, expires_in=UPLOAD_PRESIGN_EXPIRES_SECONDS
+        )
+    except Exception:
+        raise HTTPException(status_code=500, detail="Kunne ikke lage opplastings-URL")
+    return {
+        "url": post["url"],
+        "fields": post["fields"],
+        "key": key,
+        "max_bytes": MAX_UPLOAD_BYTES,
+        "expires_in": UPLOAD_PRESIGN_EXPIRES_SECONDS,
+        "upload_token": create_upload_token(
+            str(user_id), key, body.content_type, UPLOAD_PRESIGN_EXPIRES_SECONDS + UPLOAD_COMPLETE_GRACE_SECONDS
+        ),
+    }
+
+
+@app.post("/api/upload/complete")
+def complete_upload(
+    body: UploadCompleteIn,
+    user_id: UUID = Depends(require_user),
+):
+    """
+    Bekreft direkte opplasting: sjekker at objektet finnes, at det er lastet opp av denne
+    brukeren (upload_token), og at type og størrelse stemmer. Godkjent fil flyttes fra
+    UPLOAD_PENDING_PREFIX til key og blir offentlig; ugyldige objekter slettes.
+    """
+    token = decode_upload_token(body.upload_token)
+    if not token or token.get("sub") != str(user_id) or token.get("key") != body.key:
+        raise HTTPException(status_code=403, detail="Ugyldig opplastingskvittering")
+    pending = UPLOAD_PENDING_PREFIX + body.key
+    meta = head_object(pending)
+    if meta is None:
+        # Kalt på nytt etter at filen alt er flyttet (f.eks. klienten prøvde igjen etter tidsavbrudd)
+        if head_object(body.key) is not None:
+            return _upload_result(body.key)
+        raise HTTPException(status_code=404, detail="Filen er ikke lastet opp")
+    if meta["size"] > MAX_UPLOAD_BYTES or meta["content_type"] != token.get("ct"):
+        delete_object(pending)
+        raise HTTPException(status_code=400, detail="Filen samsvarer ikke med opplastingen som ble godkjent")
+    if not copy_object(pending, body.key):
+        raise HTTPException(status_code=500, detail="Opplasting feilet")
+    delete_object(pending)  # blir den liggende, tar upload-cleanup den
+    submit_upload_processing(body.key, meta["content_type"])
+    return _upload_result(body.key)
+
+
+def _cleanup_pending_uploads() -> dict:
+    """Planlagt jobb: slett direkte opplastinger som aldri ble fullført før kvitteringen gikk ut."""
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        seconds=UPLOAD_PRESIGN_EXPIRES_SECONDS + UPLOAD_COMPLETE_GRACE_SECONDS
+    )
+    removed = failed = 0
+    for obj in list_objects(UPLOAD_PENDING_PREFIX):
+        if obj["last_modified"] >= cutoff:
+            continue
+        if delete_object(obj["key"]):
+            removed += 1
+        else:
+            failed += 1
+    return {"removed": removed, "failed": failed}
+
+
+register_job(
+    "upload-cleanup", _cleanup_pending_uploads, 3600, description="Slett direkte opplastinger som aldri ble fullført"
+)
 
 
 def _media_type_from_path(path: str) -> str:
@@ -1137,10 +2238,35 @@ def _media_type_from_path(path: str) -> str:
 
 
 @app.get("/api/media/{path:path}")
-def serve_media(path: str):
-    """Stream fil fra objektlagring (MinIO/S3). Public lesing."""
+def serve_media(path: str, variant: str | None = None):
+    """
+    Stream fil fra objektlagring (MinIO/S3). Public lesing.
+    variant=avatar|card|full|poster gir WebP-varianten; for bilder faller vi tilbake til
+    originalen til bakgrunnsbehandlingen er ferdig.
+    """
     if not STORAGE_ENABLED:
         raise HTTPException(status_code=404, detail="Media ikke tilgjengelig")
+    # Dataeksporter er private – kun via presignert URL fra /api/me/exports/<id>. Direkte
+    # opplastinger er ikke offentlige før /api/upload/complete har godkjent dem.
+    if path.lstrip("/").startswith((EXPORT_PREFIX, UPLOAD_PENDING_PREFIX)):
+        raise HTTPException(status_code=404, detail="Fil ikke funnet")
+    if variant:
+        if variant not in VARIANT_NAMES:
+            raise HTTPException(status_code=400, detail=f"Ugyldig variant. Tillatt: {', '.join(VARIANT_NAMES)}")
+        stream = get_object_stream(variant_key(path, variant))
+        if stream is not None:
+            return StreamingResponse(
+                stream, media_type="image/webp", headers={"Cache-Control": VARIANT_CACHE_CONTROL}
+            )
+        if is_video(path):
+            raise HTTPException(status_code=404, detail="Variant ikke klar ennå")
+        stream = get_object_stream(path)
+        if stream is None:
+            raise HTTPException(status_code=404, detail="Fil ikke funnet")
+        # Kort cache så klienten henter varianten når den er klar
+        return StreamingResponse(
+            stream, media_type=_media_type_from_path(path), headers={"Cache-Control": "public, max-age=60"}
+        )
     stream = get_object_stream(path)
     if stream is None:
         raise HTTPException(status_code=404, detail="Fil ikke funnet")
@@ -1202,9 +2328,17 @@ def get_my_coach(user_id: UUID = Depends(require_user)):
     }
 
 
+COACHES_CACHE_TTL_SECONDS = int(os.getenv("COACHES_CACHE_TTL_SECONDS", "600"))
+
+
 @app.get("/api/coaches")
 def list_coaches(user_id: UUID = Depends(require_user)):
-    """Liste over tilgjengelige coach (kunde_og_coach godkjent)."""
+    """Liste over tilgjengelige coach (kunde_og_coach godkjent). Cachet; invalideres av trigger på users."""
+    return ORJSONResponse(get_or_compute("coaches", "list", COACHES_CACHE_TTL_SECONDS, _load_coach_directory))
+
+
+def _load_coach_directory() -> list[dict]:
+    """Fra primær, som _load_global_foods – cachen fylles aldri fra en replika som ligger etter."""
     with get_connection() as conn:
         cur = get_cursor(conn)
         try:
@@ -1313,6 +2447,7 @@ def assign_coach(body: AssignCoachRequest, user_id: UUID = Depends(require_user)
                 (str(user_id), str(coach_id), start, slutt),
             )
             cur.fetchone()
+            publish(cur, [user_id, coach_id], "coach_started", {"user_id": str(user_id), "coach_id": str(coach_id)})
         finally:
             cur.close()
     return {
@@ -1332,25 +2467,156 @@ def avslutt_coach_tilgang(user_id: UUID = Depends(require_user)):
             cur.execute(
                 """
                 UPDATE kunde_coach
-                SET slutt_dato = NOW()
+                SET slutt_dato = NOW(), slutt_varslet = TRUE
                 WHERE kunde_id = %s AND slutt_dato > NOW()
-                RETURNING id
+                RETURNING coach_id
                 """,
                 (str(user_id),),
             )
-            if not cur.fetchone():
+            ended = cur.fetchall()
+            if not ended:
                 raise HTTPException(status_code=400, detail="Du har ingen aktiv coach-tilgang å avslutte.")
+            for r in ended:
+                coach_id = str(r["coach_id"])
+                publish(cur, [user_id, coach_id], "coach_ended", {"user_id": str(user_id), "coach_id": coach_id})
         finally:
             cur.close()
     return {"ok": True, "message": "Coach-tilgang avsluttet. Program og alt du har logget er fortsatt tilgjengelig."}
 
 
+# --- Coach: mine kunder (oversikt for coach-dashboard) ---
+COACH_ROSTER_DAYS = 7
+
+
+@app.get("/api/coach/clients")
+def list_coach_clients(coach_id: UUID = Depends(require_coach)):
+    """
+    Alle aktive kunder for coachen med siste vekt, vekttrend og snitt kcal/makro siste 7 dager.
+    Én spørring for hele listen (ingen oppslag per kunde), slik at 100+ kunder går like raskt.
+    """
+    since = datetime.now(timezone.utc).date() - timedelta(days=COACH_ROSTER_DAYS - 1)
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                WITH clients AS (
+                    SELECT kc.id, kc.kunde_id, kc.start_dato, kc.slutt_dato, u.navn, u.email
+                    FROM kunde_coach kc
+                    JOIN users u ON u.id = kc.kunde_id
+                    WHERE kc.coach_id = %(coach_id)s AND kc.slutt_dato > NOW()
+                ),
+                recipe_totals AS (
+                    SELECT ri.recipe_id,
+                           SUM(fp.kcal_per_100 * ri.grams / 100) AS kcal,
+                           SUM(fp.protein_per_100 * ri.grams / 100) AS protein,
+                           SUM(fp.carbs_per_100 * ri.grams / 100) AS carbs,
+                           SUM(fp.fat_per_100 * ri.grams / 100) AS fat
+                    FROM recipe_ingredients ri
+                    JOIN food_products fp ON fp.id = ri.food_product_id
+                    WHERE ri.recipe_id IN (
+                        SELECT me.recipe_id
+                        FROM clients c
+                        JOIN meals m ON m.user_id = c.kunde_id AND m.log_date >= %(since)s
+                        JOIN meal_entries me ON me.meal_id = m.id AND me.log_date = m.log_date AND me.log_date >= %(since)s
+                        WHERE me.recipe_id IS NOT NULL
+                    )
+                    GROUP BY ri.recipe_id
+                ),
+                nutrition AS (
+                    SELECT m.user_id,
+                           COUNT(DISTINCT m.log_date) AS days_logged,
+                           SUM(COALESCE(fp.kcal_per_100 * me.amount_gram / 100, rt.kcal * me.portions, 0)) AS kcal,
+                           SUM(COALESCE(fp.protein_per_100 * me.amount_gram / 100, rt.protein * me.portions, 0)) AS protein,
+                           SUM(COALESCE(fp.carbs_per_100 * me.amount_gram / 100, rt.carbs * me.portions, 0)) AS carbs,
+                           SUM(COALESCE(fp.fat_per_100 * me.amount_gram / 100, rt.fat * me.portions, 0)) AS fat
+                    FROM clients c
+                    JOIN meals m ON m.user_id = c.kunde_id AND m.log_date >= %(since)s
+                    JOIN meal_entries me ON me.meal_id = m.id AND me.log_date = m.log_date AND me.log_date >= %(since)s
+                    LEFT JOIN food_products fp ON fp.id = me.food_product_id
+                    LEFT JOIN recipe_totals rt ON rt.recipe_id = me.recipe_id
+                    GROUP BY m.user_id
+                )
+                SELECT c.id, c.kunde_id, c.start_dato, c.slutt_dato, c.navn, c.email,
+                       lw.log_date AS last_weight_date, lw.weight_kg AS last_weight_kg,
+                       fw.weight_kg AS first_weight_kg_in_window, fw.log_date AS first_weight_date_in_window,
+                       n.days_logged, n.kcal, n.protein, n.carbs, n.fat,
+                       GREATEST(lm.created_at, lw.created_at) AS last_logged_at
+                FROM clients c
+                LEFT JOIN nutrition n ON n.user_id = c.kunde_id
+                LEFT JOIN LATERAL (
+                    SELECT log_date, weight_kg, created_at
+                    FROM weight_entries
+                    WHERE user_id = c.kunde_id
+                    ORDER BY log_date DESC
+                    LIMIT 1
+                ) lw ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT log_date, weight_kg
+                    FROM weight_entries
+                    WHERE user_id = c.kunde_id AND log_date >= %(since)s
+                    ORDER BY log_date
+                    LIMIT 1
+                ) fw ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT created_at
+                    FROM meals
+                    WHERE user_id = c.kunde_id
+                    ORDER BY log_date DESC, created_at DESC
+                    LIMIT 1
+                ) lm ON TRUE
+                ORDER BY c.navn NULLS LAST, c.email
+                """,
+                {"coach_id": str(coach_id), "since": since},
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    out = []
+    for r in rows:
+        trend = None
+        if (
+            r["last_weight_kg"] is not None
+            and r["first_weight_kg_in_window"] is not None
+            and r["last_weight_date"] > r["first_weight_date_in_window"]
+        ):
+            trend = round(float(r["last_weight_kg"]) - float(r["first_weight_kg_in_window"]), 2)
+        days = r["days_logged"] or 0
+        out.append({
+            "id": str(r["id"]),
+            "kunde_id": str(r["kunde_id"]),
+            "navn": r["navn"] or r["email"],
+            "email": r["email"],
+            "start_dato": r["start_dato"].isoformat() if r["start_dato"] else None,
+            "slutt_dato": r["slutt_dato"].isoformat() if r["slutt_dato"] else None,
+            "last_weight_kg": float(r["last_weight_kg"]) if r["last_weight_kg"] is not None else None,
+            "last_weight_date": str(r["last_weight_date"]) if r["last_weight_date"] else None,
+            "weight_trend_7d_kg": trend,
+            "days_logged_7d": days,
+            "avg_7d": {
+                "kcal": round(float(r["kcal"]) / days, 1) if days else None,
+                "protein": round(float(r["protein"]) / days, 1) if days else None,
+                "carbs": round(float(r["carbs"]) / days, 1) if days else None,
+                "fat": round(float(r["fat"]) / days, 1) if days else None,
+            },
+            "last_logged_at": r["last_logged_at"].isoformat() if r["last_logged_at"] else None,
+        })
+    return out
+
+
 # --- Public / health ---
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus-metrikker (tekstformat) for scraping fra Kubernetes."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/api/users")
 def list_users():
     with get_connection() as conn:
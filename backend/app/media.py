@@ -0,0 +1,169 @@
+"""
+Bildevarianter for opplastet media (kjøres i bakgrunnen etter /api/upload).
+
+For hvert bilde lagres WebP-varianter ved siden av originalen:
+    coach/<id>.jpg → coach/<id>__avatar.webp, coach/<id>__card.webp, coach/<id>__full.webp
+For video hentes et stillbilde (ffmpeg) som blir grunnlag for de samme variantene;
+"poster" er alias for full. /api/media/<key>?variant=card serverer varianten, og faller
+tilbake til originalen (bilder) til varianten er klar.
+
+Eksisterende coach-bilder:  python -m app.media backfill
+"""
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from .database import get_connection, get_cursor
+from .storage import download_fileobj, upload_fileobj
+
+MEDIA_PROCESSING_ENABLED = os.getenv("MEDIA_PROCESSING_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# Maks samtidige behandlinger per prosess (dekoding av store bilder er minnekrevende)
+MEDIA_PROCESSING_CONCURRENCY = int(os.getenv("MEDIA_PROCESSING_CONCURRENCY", "2"))
+MEDIA_WEBP_QUALITY = int(os.getenv("MEDIA_WEBP_QUALITY", "80"))
+
+# navn -> (maks bredde, maks høyde, beskjær til nøyaktig størrelse)
+MEDIA_VARIANTS = {
+    "avatar": (160, 160, True),
+    "card": (640, 640, False),
+    "full": (1600, 1600, False),
+}
+VARIANT_ALIASES = {"poster": "full"}
+VARIANT_NAMES = (*MEDIA_VARIANTS, *VARIANT_ALIASES)
+
+# Variantene er uforanderlige (originalnøkkelen er unik), så de kan caches lenge
+VARIANT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Egen pool, så behandlingen ikke holder igjen tråder i forespørselspoolen mens den venter
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def variant_key(key: str, variant: str) -> str:
+    variant = VARIANT_ALIASES.get(variant, variant)
+    return f"{os.path.splitext(key)[0]}__{variant}.webp"
+
+
+def is_video(key_or_type: str) -> bool:
+    return key_or_type.startswith("video/") or key_or_type.lower().endswith((".mp4", ".webm"))
+
+
+def _poster_frame(path: str) -> Image.Image | None:
+    """Første brukbare stillbilde fra video (1 s inn, ellers første frame). None uten ffmpeg."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        print("Media: ffmpeg mangler, hopper over poster for video")  # noqa: T201
+        return None
+    for seek in ("1", "0"):
+        proc = subprocess.run(
+            [ffmpeg, "-v", "error", "-ss", seek, "-i", path, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"],
+            capture_output=True,
+            timeout=60,
+        )
+        if proc.returncode == 0 and proc.stdout:
+            return Image.open(io.BytesIO(proc.stdout))
+    return None
+
+
+def render_variants(img: Image.Image) -> dict[str, bytes]:
+    """Alle varianter som WebP-bytes. Følger EXIF-rotasjon; animasjoner gir første frame."""
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    out = {}
+    for name, (w, h, crop) in MEDIA_VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(img, (w, h), Image.Resampling.LANCZOS)
+        else:
+            resized = img.copy()
+            resized.thumbnail((w, h), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        resized.save(buf, "WEBP", quality=MEDIA_WEBP_QUALITY, method=4)
+        out[name] = buf.getvalue()
+    return out
+
+
+def process_upload(key: str, content_type: str) -> list[str]:
+    """
+    Lag og lagre varianter for ett objekt. Feil logges og svelges – originalen er allerede
+    lagret og serveres som fallback. Returnerer nøklene som ble skrevet.
+    """
+    if not MEDIA_PROCESSING_ENABLED:
+        return []
+    written = []
+    try:
+        with tempfile.NamedTemporaryFile(suffix=os.path.splitext(key)[1]) as tmp:
+            download_fileobj(key, tmp)
+            tmp.flush()
+            if is_video(content_type) or is_video(key):
+                img = _poster_frame(tmp.name)
+                if img is None:
+                    return []
+            else:
+                img = Image.open(tmp.name)
+                max_w, max_h = MEDIA_VARIANTS["full"][:2]
+                img.draft("RGB", (max_w, max_h))  # JPEG: dekod direkte i redusert oppløsning
+            with img:
+                variants = render_variants(img)
+        for name, data in variants.items():
+            vkey = variant_key(key, name)
+            upload_fileobj(io.BytesIO(data), vkey, "image/webp", cache_control=VARIANT_CACHE_CONTROL)
+            written.append(vkey)
+    except Exception as e:
+        print(f"Media: kunne ikke lage varianter for {key}: {e}")  # noqa: T201
+    return written
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, MEDIA_PROCESSING_CONCURRENCY), thread_name_prefix="media")
+        return _pool
+
+
+def submit_upload_processing(key: str, content_type: str) -> Future | None:
+    """Legg process_upload i mediapoolen (maks MEDIA_PROCESSING_CONCURRENCY samtidig) og returner straks."""
+    if not MEDIA_PROCESSING_ENABLED:
+        return None
+    return _get_pool().submit(process_upload, key, content_type)
+
+
+def shutdown_media_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _coach_image_keys() -> list[str]:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT coach_bilde FROM users WHERE coach_bilde LIKE '/api/media/%'")
+            return [r["coach_bilde"].removeprefix("/api/media/").split("?", 1)[0] for r in cur.fetchall()]
+        finally:
+            cur.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Bildevarianter for opplastet media")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("backfill", help="Lag varianter for eksisterende coach-bilder")
+    p.parse_args(argv)
+    for key in _coach_image_keys():
+        written = process_upload(key, "")
+        print(f"{key}: {len(written)} varianter")  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
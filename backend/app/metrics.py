@@ -0,0 +1,163 @@
+"""
+Prometheus-metrikker for GET /metrics.
+
+- Latens per rute-mal (f.eks. /api/recipes/{recipe_id}), ikke per faktisk URL
+- Pågående forespørsler (in-flight)
+- Antall DB-spørringer og DB-tid per forespørsel (via spørrings-hook i app.database)
+- Latens mot eksterne tjenester per leverandør (OFF, Nutritionix, Edamam, Stripe, PowerOffice, S3)
+- Cache-treff/bom (treffrate = hit / (hit + miss) i PromQL)
+
+Flere uvicorn-workers: sett PROMETHEUS_MULTIPROC_DIR til en tom, skrivbar katalog.
+"""
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+from app.database import register_connect_hook, register_query_hook
+
+REQUEST_LATENCY = Histogram(
+    "hercules_http_request_duration_seconds",
+    "HTTP-latens per rute-mal",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "hercules_http_requests_in_flight",
+    "Pågående HTTP-forespørsler",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "hercules_db_queries_per_request",
+    "Antall DB-spørringer per forespørsel",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "hercules_db_time_per_request_seconds",
+    "Samlet DB-tid (execute) per forespørsel",
+    ["route"],
+)
+DB_QUERY_DURATION = Histogram(
+    "hercules_db_query_duration_seconds",
+    "Varighet per DB-spørring",
+)
+DB_CONNECT_DURATION = Histogram(
+    "hercules_db_connect_duration_seconds",
+    "Tid for å åpne DB-tilkobling",
+)
+EXTERNAL_CALL_LATENCY = Histogram(
+    "hercules_external_call_duration_seconds",
+    "Latens mot eksterne tjenester",
+    ["provider", "outcome"],
+)
+CACHE_REQUESTS = Counter(
+    "hercules_cache_requests_total",
+    "Cache-oppslag per cache og resultat (hit/miss)",
+    ["cache", "result"],
+)
+
+
+class _RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[_RequestStats | None] = ContextVar("hercules_request_stats", default=None)
+
+
+def _on_query(statement, params, duration: float, rowcount: int) -> None:
+    DB_QUERY_DURATION.observe(duration)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += duration
+
+
+def _on_connect(duration: float) -> None:
+    DB_CONNECT_DURATION.observe(duration)
+
+
+register_query_hook(_on_query)
+register_connect_hook(_on_connect)
+
+
+@contextmanager
+def external_call(provider: str):
+    """Mål latens for et kall mot ekstern tjeneste: with external_call("stripe"): ..."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        EXTERNAL_CALL_LATENCY.labels(provider, outcome).observe(time.perf_counter() - start)
+
+
+def cache_result(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def route_template(scope) -> str:
+    """Rute-mal fra FastAPI (satt i scope etter routing); ukjente stier samles som 'unmatched'."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Ren ASGI-middleware (ingen BaseHTTPMiddleware-overhead)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        REQUESTS_IN_FLIGHT.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_FLIGHT.labels(method).dec()
+            _request_stats.reset(token)
+            route = route_template(scope)
+            REQUEST_LATENCY.labels(method, route, str(status["code"])).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.db_seconds)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus tekstformat (+ content-type). Støtter multiprocess-modus."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
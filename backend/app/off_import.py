@@ -0,0 +1,286 @@
+"""
+Bulkimport av Open Food Facts-dump til food_products (forvarming av strekkode-cache).
+
+Leser OFF sin JSONL-dump (openfoodfacts-products.jsonl.gz) eller CSV-dump
+(en.openfoodfacts.org.products.csv.gz, tab-separert) som en strøm – konstant minnebruk
+uansett filstørrelse. Produkter filtreres på land, mappes likt som live-oppslaget
+(_map_openfoodfacts_product) og lastes med COPY til en midlertidig tabell, deretter
+upsert til food_products på strekkode. Poster med næringsverdier som ikke er tall eller ikke
+får plass i kolonnene hoppes over, og NUL-tegn fjernes fra tekst, så én dårlig post aldri
+stopper en hel batch.
+
+Kjør (fra backend/):
+    python -m app.off_import /data/openfoodfacts-products.jsonl.gz --countries en:norway,en:sweden
+    python -m app.off_import dump.csv.gz --resume    # fortsett etter avbrudd
+
+Fremdrift lagres i en state-fil etter hver batch (commit), så --resume hopper over
+allerede importerte poster.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import sys
+import time
+from itertools import islice
+from typing import Iterable, Iterator
+
+from .cache import invalidate
+from .database import get_connection
+from .food_lookup import _map_openfoodfacts_product, _normalize_barcode
+
+DEFAULT_COUNTRIES = ("en:norway",)
+DEFAULT_BATCH_SIZE = 5000
+
+# Kolonner i staging-tabellen (samme rekkefølge som COPY-raden); seq = rekkefølge i batchen
+_COLUMNS = (
+    "seq", "name", "barcode", "source", "brand", "image_url",
+    "kcal_per_100", "protein_per_100", "carbs_per_100", "fat_per_100",
+)
+
+_NUTRIENTS = ("kcal_per_100", "protein_per_100", "carbs_per_100", "fat_per_100")
+_TEXTS = ("name", "brand", "image_url")
+# Største verdi NUMERIC(10,2) tar; én slik post ville stoppet COPY for hele batchen
+_NUMERIC_MAX = 99_999_999.99
+
+# CSV-dumpen har næring som egne kolonner; vi bygger samme "nutriments"-form som API-et
+_CSV_NUTRIMENTS = (
+    "energy-kcal_100g", "energy-kj_100g", "energy_100g",
+    "proteins_100g", "carbohydrates_100g", "fat_100g",
+)
+
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "rt", encoding="utf-8", errors="replace", newline="")
+
+
+def _is_csv(path: str) -> bool:
+    base = path[:-3] if path.endswith(".gz") else path
+    return base.endswith((".csv", ".tsv"))
+
+
+def read_records(path: str, skip: int = 0) -> Iterator[dict]:
+    """Strøm rå OFF-produkter fra dump (JSONL eller CSV). skip = antall poster å hoppe over."""
+    with _open_text(path) as f:
+        if _is_csv(path):
+            csv.field_size_limit(sys.maxsize)
+            reader = csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+            for row in islice(reader, skip, None):
+                yield {
+                    "code": row.get("code"),
+                    "product_name": row.get("product_name"),
+                    "brands": row.get("brands"),
+                    "image_url": row.get("image_url"),
+                    "countries_tags": (row.get("countries_tags") or "").split(","),
+                    "nutriments": {k: row[k] for k in _CSV_NUTRIMENTS if row.get(k)},
+                }
+        else:
+            for line in islice(f, skip, None):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield {}
+
+
+def filter_countries(records: Iterable[dict], countries: set[str]) -> Iterator[dict | None]:
+    """Behold produkter solgt i gitte land. Forkastede poster gis som None (teller for resume)."""
+    for p in records:
+        tags = p.get("countries_tags") or []
+        if not countries or any(t in countries for t in tags):
+            yield p
+        else:
+            yield None
+
+
+def map_products(records: Iterable[dict | None]) -> Iterator[dict | None]:
+    """OFF-produkt → food_products-felter; ugyldig strekkode/næring gir None."""
+    for p in records:
+        if p is None:
+            yield None
+            continue
+        b = _normalize_barcode(str(p.get("code") or ""))
+        if not b or len(b) > 20:
+            yield None
+            continue
+        try:
+            yield _clean(_map_openfoodfacts_product(b, p))
+        except (AttributeError, TypeError, ValueError):
+            yield None
+
+
+def _clean(product: dict) -> dict | None:
+    """
+    Gjør en mappet post trygg for COPY: NUL-tegn fjernes fra tekst (Postgres avviser dem),
+    negative næringsverdier settes til 0 som i live-oppslaget, og poster med verdier som ikke
+    er endelige eller ikke får plass i NUMERIC(10,2) hoppes over.
+    """
+    for field in _TEXTS:
+        if product[field] is not None:
+            product[field] = product[field].replace("\x00", "").strip() or None
+    product["name"] = product["name"] or "Ukjent produkt"
+    for field in _NUTRIENTS:
+        value = product[field]
+        if not math.isfinite(value) or value > _NUMERIC_MAX:
+            return None
+        product[field] = max(0.0, value)
+    return product
+
+
+def batched(items: Iterable[dict | None], size: int) -> Iterator[tuple[int, list[dict]]]:
+    """Grupper i batcher: (antall leste poster, produkter). Leste poster inkluderer forkastede."""
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield len(chunk), [p for p in chunk if p is not None]
+
+
+def _copy_batch(cur, products: list[dict]) -> None:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for seq, p in enumerate(products):
+        w.writerow([seq] + [p[c] if p[c] is not None else "" for c in _COLUMNS[1:]])
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY food_products_import ({', '.join(_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buf,
+    )
+
+
+def _upsert_from_staging(cur) -> int:
+    """
+    Upsert staging → food_products. Oppdaterer kun globale OFF-rader, aldri brukerens egne.
+    Samme strekkode flere ganger i batchen: siste post i dumpen vinner.
+    """
+    cur.execute(
+        """
+        INSERT INTO food_products
+        (name, barcode, source, brand, image_url, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100,
+         fetched_at)
+        SELECT DISTINCT ON (barcode)
+               name, barcode, source, NULLIF(brand, ''), NULLIF(image_url, ''),
+               kcal_per_100, protein_per_100, carbs_per_100, fat_per_100, NOW()
+        FROM food_products_import
+        ORDER BY barcode, seq DESC
+        ON CONFLICT (barcode) WHERE barcode IS NOT NULL AND barcode != ''
+        DO UPDATE SET
+            name = EXCLUDED.name,
+            brand = EXCLUDED.brand,
+            image_url = CASE WHEN food_products.image_source_url = EXCLUDED.image_url
+                             THEN food_products.image_url ELSE EXCLUDED.image_url END,
+            kcal_per_100 = EXCLUDED.kcal_per_100,
+            protein_per_100 = EXCLUDED.protein_per_100,
+            carbs_per_100 = EXCLUDED.carbs_per_100,
+            fat_per_100 = EXCLUDED.fat_per_100,
+            fetched_at = EXCLUDED.fetched_at
+        WHERE food_products.user_id IS NULL AND food_products.source = 'openfoodfacts'
+        """
+    )
+    return cur.rowcount
+
+
+def _load_state(state_path: str, dump_path: str) -> dict:
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get("path") == os.path.abspath(dump_path):
+            return state
+    except (OSError, ValueError):
+        pass
+    return {"path": os.path.abspath(dump_path), "records": 0, "upserted": 0}
+
+
+def _save_state(state_path: str, state: dict) -> None:
+    tmp = f"{state_path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
+
+
+def run_import(
+    path: str,
+    *,
+    countries: set[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    state_path: str | None = None,
+    resume: bool = False,
+) -> dict:
+    """Importer dumpen. Returnerer state med antall leste poster og upserts."""
+    state_path = state_path or f"{path}.import-state.json"
+    state = _load_state(state_path, path) if resume else {
+        "path": os.path.abspath(path), "records": 0, "upserted": 0,
+    }
+    pipeline = batched(
+        map_products(filter_countries(read_records(path, skip=state["records"]), countries)),
+        batch_size,
+    )
+    started = time.monotonic()
+    read_this_run = 0
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS food_products_import (
+                    seq INTEGER, name VARCHAR(255), barcode VARCHAR(20), source VARCHAR(30),
+                    brand VARCHAR(255), image_url TEXT,
+                    kcal_per_100 NUMERIC(10,2), protein_per_100 NUMERIC(10,2),
+                    carbs_per_100 NUMERIC(10,2), fat_per_100 NUMERIC(10,2)
+                ) ON COMMIT DELETE ROWS
+                """
+            )
+            for n_read, products in pipeline:
+                upserted = 0
+                if products:
+                    _copy_batch(cur, products)
+                    upserted = _upsert_from_staging(cur)
+                conn.commit()
+                read_this_run += n_read
+                state["records"] += n_read
+                state["upserted"] += upserted
+                _save_state(state_path, state)
+                elapsed = max(time.monotonic() - started, 1e-6)
+                print(  # noqa: T201
+                    f"[off_import] {state['records']} poster lest, {state['upserted']} upsert, "
+                    f"{read_this_run / elapsed:.0f} rader/s",
+                    file=sys.stderr,
+                )
+        finally:
+            cur.close()
+    return state
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Importer Open Food Facts-dump til food_products")
+    parser.add_argument("path", help="OFF-dump: .jsonl(.gz) eller .csv(.gz)")
+    parser.add_argument(
+        "--countries",
+        default=",".join(DEFAULT_COUNTRIES),
+        help="Komma-separerte countries_tags (tom = alle land)",
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--state", default=None, help="State-fil for resume (default: <dump>.import-state.json)")
+    parser.add_argument("--resume", action="store_true", help="Fortsett fra siste fullførte batch")
+    args = parser.parse_args(argv)
+    countries = {c.strip() for c in args.countries.split(",") if c.strip()}
+    state = run_import(
+        args.path,
+        countries=countries,
+        batch_size=max(1, args.batch_size),
+        state_path=args.state,
+        resume=args.resume,
+    )
+    print(f"[off_import] ferdig: {state['records']} poster lest, {state['upserted']} upsert")  # noqa: T201
+    if state["upserted"]:
+        invalidate("food_products")  # nye produkter i søk med en gang, ikke først etter TTL
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+Månedspartisjoner for meals, meal_entries og weight_entries (range på log_date).
+
+Partisjonene opprettes av SQL-funksjonen ensure_log_partitions() i db/init.sql:
+- ved oppstart for inneværende måned og PARTITION_MONTHS_AHEAD fram,
+- ved behov på skrivestien (ensure_partition_for) når en bruker logger en dato i en måned
+  prosessen ikke har sett før – f.eks. etterregistrering langt tilbake i tid.
+
+Datoer utenfor LOG_DATE_MAX_YEARS_BACK bakover / LOG_DATE_MAX_DAYS_AHEAD fram avvises (400)
+før noe DDL kjøres, så én bruker ikke kan fylle katalogen med partisjoner for år 0001–9999.
+Settet med kjente måneder er per prosess; kobler CLI-en fra en måned, feiler neste INSERT
+i andre workere. with_partition_retry fanger det, glemmer måneden, oppretter og prøver igjen.
+
+Gamle måneder kobles fra med CLI (DETACH ... CONCURRENTLY, blokkerer ikke skriving):
+
+    python -m app.partitions list
+    python -m app.partitions ensure [--from 2023-01-01]
+    python -m app.partitions detach --before 2022-01-01 [--drop]
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, TypeVar
+
+import psycopg2
+from psycopg2 import errorcodes
+
+from .database import DATABASE_URL, get_connection, get_cursor
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# Tillatt log_date på skrivestien: fra i dag minus så mange år til i dag pluss så mange dager
+LOG_DATE_MAX_YEARS_BACK = int(os.getenv("LOG_DATE_MAX_YEARS_BACK", "10"))
+LOG_DATE_MAX_DAYS_AHEAD = int(os.getenv("LOG_DATE_MAX_DAYS_AHEAD", "366"))
+
+T = TypeVar("T")
+
+# Rekkefølge ved frakobling: meal_entries refererer meals, så den må kobles fra først
+PARTITIONED_TABLES = ("meal_entries", "meals", "weight_entries")
+
+_PARTITION_NAME = re.compile(r"^(meals|meal_entries|weight_entries)_(\d{4})_(\d{2})$")
+
+# Måneder (år, måned) denne prosessen vet har partisjoner
+_known_months: set[tuple[int, int]] = set()
+_known_lock = threading.Lock()
+
+
+def _add_months(d: date, months: int) -> date:
+    y, m = divmod(d.year * 12 + d.month - 1 + months, 12)
+    return date(y, m + 1, 1)
+
+
+def parse_log_date(value) -> date:
+    """log_date fra API (YYYY-MM-DD) som date; ValueError ved ugyldig dato."""
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value).strip()[:10])
+
+
+def ensure_partitions(from_date: date, to_date: date) -> int:
+    """
+    Opprett manglende månedspartisjoner i [from_date, to_date]. Egen tilkobling og transaksjon,
+    så partisjonen består selv om forespørselen som trengte den rulles tilbake.
+    """
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT ensure_log_partitions(%s, %s) AS created", (from_date, to_date))
+            created = cur.fetchone()["created"]
+        finally:
+            cur.close()
+    with _known_lock:
+        m = date(from_date.year, from_date.month, 1)
+        while m <= to_date:
+            _known_months.add((m.year, m.month))
+            m = _add_months(m, 1)
+    return created
+
+
+def check_log_date_window(d: date) -> date:
+    """ValueError hvis d er utenfor tillatt vindu for nye registreringer."""
+    today = datetime.now(timezone.utc).date()
+    earliest = _add_months(today, -12 * LOG_DATE_MAX_YEARS_BACK)
+    if not earliest <= d <= today + timedelta(days=LOG_DATE_MAX_DAYS_AHEAD):
+        raise ValueError(f"log_date {d} er utenfor tillatt periode")
+    return d
+
+
+def ensure_partition_for(log_date) -> date:
+    """
+    Sørg for at måneden til log_date har partisjoner før INSERT. Normalt et oppslag i et
+    sett i minnet; første gang per måned per prosess ett ekstra kall. Returnerer datoen.
+    ValueError ved ugyldig dato eller dato utenfor tillatt vindu.
+    """
+    d = check_log_date_window(parse_log_date(log_date))
+    if (d.year, d.month) not in _known_months:
+        ensure_partitions(d, d)
+    return d
+
+
+def _is_missing_partition(e: psycopg2.Error) -> bool:
+    # "no partition of relation ... found for row" er en check_violation
+    return e.pgcode == errorcodes.CHECK_VIOLATION and "partition" in (e.pgerror or "")
+
+
+def with_partition_retry(log_date: date, fn: Callable[[], T]) -> T:
+    """
+    Kjør fn (én transaksjon med INSERT på log_date). Mangler partisjonen likevel – koblet fra
+    av en annen prosess etter at denne så måneden – glemmes måneden, den opprettes og fn
+    kjøres én gang til.
+    """
+    try:
+        return fn()
+    except psycopg2.Error as e:
+        if not _is_missing_partition(e):
+            raise
+    with _known_lock:
+        _known_months.discard((log_date.year, log_date.month))
+    ensure_partitions(log_date, log_date)
+    return fn()
+
+
+def ensure_upcoming_partitions() -> int:
+    """Inneværende måned og PARTITION_MONTHS_AHEAD fram (kalles ved oppstart)."""
+    today = datetime.now(timezone.utc).date()
+    try:
+        return ensure_partitions(today, _add_months(today, PARTITION_MONTHS_AHEAD))
+    except Exception as e:
+        print(f"Partisjoner: kunne ikke opprette kommende måneder: {e}")  # noqa: T201
+        return 0
+
+
+def list_partitions() -> list[dict]:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT parent.relname AS parent, child.relname AS name,
+                       pg_get_expr(child.relpartbound, child.oid) AS bound,
+                       pg_total_relation_size(child.oid) AS bytes
+                FROM pg_inherits i
+                JOIN pg_class parent ON parent.oid = i.inhparent
+                JOIN pg_class child ON child.oid = i.inhrelid
+                WHERE parent.relname = ANY(%s)
+                ORDER BY parent.relname, child.relname
+                """,
+                (list(PARTITIONED_TABLES),),
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+
+def detach_partitions_before(before: date, drop: bool = False) -> list[str]:
+    """
+    Koble fra (og evt. slett) hele måneder som slutter før `before`. DETACH CONCURRENTLY kan
+    ikke kjøres i en transaksjon, så vi bruker en egen autocommit-tilkobling.
+    """
+    old = []
+    for p in list_partitions():
+        match = _PARTITION_NAME.match(p["name"])
+        if not match:
+            continue
+        month = date(int(match.group(2)), int(match.group(3)), 1)
+        if _add_months(month, 1) <= before:
+            old.append((PARTITIONED_TABLES.index(match.group(1)), month, match.group(1), p["name"]))
+    old.sort()
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = True
+    done = []
+    try:
+        cur = conn.cursor()
+        for _, _, parent, name in old:
+            cur.execute(f'ALTER TABLE "{parent}" DETACH PARTITION "{name}" CONCURRENTLY')
+            if drop:
+                cur.execute(f'DROP TABLE "{name}"')
+            elif parent == "meal_entries":
+                # Frakoblet tabell beholder FK mot meals; den ville hindret frakobling av måltidsmåneden
+                cur.execute(
+                    """
+                    SELECT conname FROM pg_constraint
+                    WHERE conrelid = %s::regclass AND contype = 'f' AND confrelid = 'meals'::regclass
+                    """,
+                    (name,),
+                )
+                for (conname,) in cur.fetchall():
+                    cur.execute(f'ALTER TABLE "{name}" DROP CONSTRAINT "{conname}"')
+            done.append(name)
+        cur.close()
+    finally:
+        conn.close()
+    with _known_lock:
+        _known_months.clear()
+    return done
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Månedspartisjoner for måltider og vekt")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="Vis partisjoner og størrelse")
+    ens = sub.add_parser("ensure", help="Opprett manglende partisjoner")
+    ens.add_argument("--from", dest="from_date", type=parse_log_date, help="Første måned (default: i dag)")
+    det = sub.add_parser("detach", help="Koble fra måneder som slutter før --before")
+    det.add_argument("--before", type=parse_log_date, required=True)
+    det.add_argument("--drop", action="store_true", help="Slett partisjonene etter frakobling")
+    args = p.parse_args(argv)
+
+    if args.cmd == "list":
+        for r in list_partitions():
+            print(f"{r['parent']:16} {r['name']:28} {r['bytes'] / 1e6:10.1f} MB  {r['bound']}")  # noqa: T201
+    elif args.cmd == "ensure":
+        today = datetime.now(timezone.utc).date()
+        created = ensure_partitions(args.from_date or today, _add_months(today, PARTITION_MONTHS_AHEAD))
+        print(f"Opprettet {created} partisjoner")  # noqa: T201
+    elif args.cmd == "detach":
+        for name in detach_partitions_before(args.before, args.drop):
+            print(f"{'Slettet' if args.drop else 'Frakoblet'} {name}")  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+Felles mapping fra DB-rader (RealDictCursor) til JSON-payload.
+
+Én definisjon per ressurs i stedet for samme dict bygget inline flere steder. Payloadene
+inneholder kun JSON-native typer (str/float/None), så varme list-endepunkter kan returnere
+dem direkte som ORJSONResponse uten at FastAPI validerer dem på nytt mot response_model.
+"""
+
+# Kolonnene product_payload forventer (bruk i SELECT/RETURNING)
+PRODUCT_COLUMNS = (
+    "id, name, barcode, source, brand, image_url, user_id, "
+    "kcal_per_100, protein_per_100, carbs_per_100, fat_per_100"
+)
+
+
+def product_payload(r) -> dict:
+    """food_products-rad → FoodProductOut-form."""
+    user_id = r["user_id"]
+    return {
+        "id": str(r["id"]),
+        "name": r["name"],
+        "barcode": r["barcode"],
+        "source": r["source"] or "local",
+        "brand": r["brand"],
+        "image_url": r["image_url"],
+        "user_id": str(user_id) if user_id else None,
+        "kcal_per_100": float(r["kcal_per_100"]),
+        "protein_per_100": float(r["protein_per_100"]),
+        "carbs_per_100": float(r["carbs_per_100"]),
+        "fat_per_100": float(r["fat_per_100"]),
+    }
+
+
+def weight_payload(r) -> dict:
+    """weight_entries-rad → {"date", "weight_kg"}."""
+    return {"date": r["log_date"].isoformat(), "weight_kg": float(r["weight_kg"])}
@@ -10,14 +10,18 @@ from typing import Any
 
 import httpx
 
+from app.metrics import cache_result, external_call
+
 # Miljøvariabler (per klient/instans)
 POWEROFFICE_APP_KEY = os.getenv("POWEROFFICE_APP_KEY", "").strip()
 POWEROFFICE_CLIENT_KEY = os.getenv("POWEROFFICE_CLIENT_KEY", "").strip()
 POWEROFFICE_SUBSCRIPTION_KEY = os.getenv("POWEROFFICE_SUBSCRIPTION_KEY", "").strip()
 POWEROFFICE_DEMO = os.getenv("POWEROFFICE_DEMO", "false").strip().lower() in ("1", "true", "yes")
 
-BASE_OAUTH = "https://goapi.poweroffice.net/Demo/OAuth/Token" if POWEROFFICE_DEMO else "https://goapi.poweroffice.net/OAuth/Token"
-BASE_API = "https://goapi.poweroffice.net/Demo/v2" if POWEROFFICE_DEMO else "https://goapi.poweroffice.net/v2"
+# POWEROFFICE_BASE_URL kan overstyres (f.eks. lokal fake i benchmark)
+_BASE = os.getenv("POWEROFFICE_BASE_URL", "https://goapi.poweroffice.net").strip().rstrip("/")
+BASE_OAUTH = f"{_BASE}/Demo/OAuth/Token" if POWEROFFICE_DEMO else f"{_BASE}/OAuth/Token"
+BASE_API = f"{_BASE}/Demo/v2" if POWEROFFICE_DEMO else f"{_BASE}/v2"
 
 _token: str | None = None
 _token_expires_at: float = 0
@@ -33,9 +37,11 @@ def get_token() -> str | None:
     if not _is_configured():
         return None
     if _token and time.time() < _token_expires_at - 60:
+        cache_result("poweroffice_token", True)
         return _token
+    cache_result("poweroffice_token", False)
     basic = base64.b64encode(f"{POWEROFFICE_APP_KEY}:{POWEROFFICE_CLIENT_KEY}".encode()).decode()
-    with httpx.Client() as client:
+    with httpx.Client() as client, external_call("poweroffice"):
         r = client.post(
             BASE_OAUTH,
             headers={
@@ -84,12 +90,13 @@ def ensure_customer(
         return None
     with httpx.Client() as client:
         try:
-            search = client.get(
-                f"{BASE_API}/Customer",
-                headers=h,
-                params={"$filter": f"Email eq '{email}'"},
-                timeout=15.0,
-            )
+            with external_call("poweroffice"):
+                search = client.get(
+                    f"{BASE_API}/Customer",
+                    headers=h,
+                    params={"$filter": f"Email eq '{email}'"},
+                    timeout=15.0,
+                )
             if search.status_code == 200:
                 data = search.json()
                 if isinstance(data, list) and data:
@@ -109,7 +116,8 @@ def ensure_customer(
             payload["Phone"] = phone
         if external_id:
             payload["ExternalCode"] = external_id[:50]
-        r = client.post(f"{BASE_API}/Customer", headers=h, json=payload, timeout=15.0)
+        with external_call("poweroffice"):
+            r = client.post(f"{BASE_API}/Customer", headers=h, json=payload, timeout=15.0)
     if r.status_code not in (200, 201):
         return None
     data = r.json()
@@ -140,7 +148,7 @@ def create_sales_order_draft(
     }
     if description:
         payload["Note"] = description
-    with httpx.Client() as client:
+    with httpx.Client() as client, external_call("poweroffice"):
         r = client.post(f"{BASE_API}/Order", headers=h, json=payload, timeout=15.0)
     if r.status_code not in (200, 201):
         return None
@@ -0,0 +1,185 @@
+"""
+Bakgrunnsoppfrisking av eksterne matvarer (Open Food Facts / Nutritionix / Edamam).
+
+Produkter hentet fra ekstern API caches i food_products. Denne jobben revaliderer de mest
+skannede produktene som er eldre enn PRODUCT_REFRESH_MAX_AGE_DAYS, i små batcher og kun
+i lavtrafikk-vinduet (PRODUCT_REFRESH_HOURS, UTC). Kall mot hver leverandør begrenses
+per minutt slik at vi holder oss innenfor kvoter. Jobben kjører i egen tråd med egne
+DB-tilkoblinger og blokkerer aldri et brukeroppslag.
+
+Aktiveres med PRODUCT_REFRESH_ENABLED=true (startes fra app.main ved oppstart). Tråden
+går i alle workere, men henter bare på planleggerens leder (scheduler.is_leader), så
+kall-grensene per leverandør gjelder for hele installasjonen og ikke per worker.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from .cache import invalidate
+from .database import get_connection, get_cursor
+from .food_lookup import _fetch_edamam, _fetch_nutritionix, _fetch_openfoodfacts
+from .scheduler import is_leader
+
+PRODUCT_REFRESH_ENABLED = os.getenv("PRODUCT_REFRESH_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+PRODUCT_REFRESH_MAX_AGE_DAYS = int(os.getenv("PRODUCT_REFRESH_MAX_AGE_DAYS", "30"))
+PRODUCT_REFRESH_BATCH_SIZE = int(os.getenv("PRODUCT_REFRESH_BATCH_SIZE", "50"))
+PRODUCT_REFRESH_INTERVAL_SECONDS = int(os.getenv("PRODUCT_REFRESH_INTERVAL_SECONDS", "300"))
+# Lavtrafikk-vindu i UTC, "start-slutt" i hele timer (f.eks. 1-5 = 01:00–04:59)
+PRODUCT_REFRESH_HOURS = os.getenv("PRODUCT_REFRESH_HOURS", "1-5").strip()
+
+# Maks kall per minutt per leverandør (kvoter: OFF ber om moderat bruk, Nutritionix/Edamam har dagskvoter)
+PROVIDER_RATE_PER_MINUTE = {
+    "openfoodfacts": int(os.getenv("PRODUCT_REFRESH_RATE_OFF", "30")),
+    "nutritionix": int(os.getenv("PRODUCT_REFRESH_RATE_NUTRITIONIX", "10")),
+    "edamam": int(os.getenv("PRODUCT_REFRESH_RATE_EDAMAM", "10")),
+}
+
+PROVIDER_FETCHERS: dict[str, Callable[[str], dict | None]] = {
+    "openfoodfacts": _fetch_openfoodfacts,
+    "nutritionix": _fetch_nutritionix,
+    "edamam": _fetch_edamam,
+}
+
+
+class _RateLimiter:
+    """Enkel minsteavstand mellom kall (per_minute kall per minutt)."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+
+    def wait(self) -> None:
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+_limiters = {p: _RateLimiter(r) for p, r in PROVIDER_RATE_PER_MINUTE.items()}
+
+
+def _in_off_peak(now: datetime | None = None) -> bool:
+    try:
+        start, end = (int(x) for x in PRODUCT_REFRESH_HOURS.split("-", 1))
+    except ValueError:
+        return True
+    hour = (now or datetime.now(timezone.utc)).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def _claim_stale_batch(limit: int) -> list[dict]:
+    """
+    Plukk de mest skannede, utdaterte produktene og merk dem som oppfrisket med én gang.
+    SKIP LOCKED gjør at flere workers/pods ikke plukker samme rader.
+    """
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE food_products
+                SET refreshed_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM food_products
+                    WHERE user_id IS NULL
+                      AND source IN ('openfoodfacts', 'nutritionix', 'edamam')
+                      AND barcode IS NOT NULL
+                      AND COALESCE(refreshed_at, fetched_at, created_at) < NOW() - make_interval(days => %s)
+                    ORDER BY scan_count DESC, COALESCE(refreshed_at, fetched_at, created_at)
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, barcode, source
+                """,
+                (PRODUCT_REFRESH_MAX_AGE_DAYS, limit),
+            )
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+
+def _apply_refresh(product_id, data: dict) -> None:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE food_products
+                SET name = %s, brand = %s,
+                    -- Speilet bilde beholdes så lenge kilden er den samme (app/image_mirror.py)
+                    image_url = CASE WHEN image_source_url = %s THEN image_url ELSE %s END,
+                    kcal_per_100 = %s, protein_per_100 = %s, carbs_per_100 = %s, fat_per_100 = %s,
+                    fetched_at = NOW(), refreshed_at = NOW()
+                WHERE id = %s
+                """,
+                (
+                    data["name"],
+                    data.get("brand"),
+                    data.get("image_url"),
+                    data.get("image_url"),
+                    max(0, float(data["kcal_per_100"])),
+                    max(0, float(data["protein_per_100"])),
+                    max(0, float(data["carbs_per_100"])),
+                    max(0, float(data["fat_per_100"])),
+                    str(product_id),
+                ),
+            )
+            if cur.rowcount:
+                invalidate("food_products", cur)
+        finally:
+            cur.close()
+
+
+def refresh_stale_products(limit: int = PRODUCT_REFRESH_BATCH_SIZE) -> dict:
+    """
+    Én batch: revalider utdaterte produkter mot leverandøren de kom fra.
+    Ikke funnet / feil hos leverandør beholder eksisterende data (refreshed_at er satt ved claim).
+    """
+    rows = _claim_stale_batch(limit)
+    updated = 0
+    for r in rows:
+        fetch = PROVIDER_FETCHERS.get(r["source"])
+        if not fetch:
+            continue
+        _limiters[r["source"]].wait()
+        data = fetch(r["barcode"])
+        if data:
+            _apply_refresh(r["id"], data)
+            updated += 1
+    return {"checked": len(rows), "updated": updated}
+
+
+def _loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        if _in_off_peak() and is_leader():
+            try:
+                result = refresh_stale_products()
+                if result["checked"]:
+                    print(f"[product_refresh] {result['checked']} sjekket, {result['updated']} oppdatert")  # noqa: T201
+                    continue  # mer å gjøre – neste batch med én gang (rate limit styrer tempo)
+            except Exception as e:
+                print(f"[product_refresh] feil: {e}")  # noqa: T201
+        stop.wait(PRODUCT_REFRESH_INTERVAL_SECONDS)
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def start_background_refresher() -> None:
+    """Start bakgrunnstråd (idempotent). Gjør ingenting hvis PRODUCT_REFRESH_ENABLED ikke er satt."""
+    global _thread
+    if not PRODUCT_REFRESH_ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(_stop,), name="product-refresh", daemon=True)
+    _thread.start()
+
+
+def stop_background_refresher() -> None:
+    _stop.set()
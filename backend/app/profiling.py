@@ -0,0 +1,259 @@
+"""
+Profilering av trege forespørsler (opt-in): hvor går tiden – SQL, tilkobling eller Python?
+
+Aktiveres med PROFILING_ENABLED=true. En forespørsel spores når
+  - den tar lengre tid enn PROFILING_SLOW_MS (default 500), eller
+  - en admin sender header X-Hercules-Profile: 1 (da kjøres også CPU-sampling).
+
+Sporet inneholder hver SQL-setning (tekst, parametre maskert, varighet, rowcount),
+tid for å åpne DB-tilkoblinger, valgfri EXPLAIN ANALYZE for de tregeste SELECT-ene
+(PROFILING_EXPLAIN_SAMPLE = andel spor, 0–1) og en samplet CPU-profil.
+De siste PROFILING_MAX_TRACES sporene hentes via GET /api/admin/profiling/traces.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+import anyio
+
+from app.auth import decode_access_token
+from app.database import (
+    get_connection,
+    get_cursor,
+    register_connect_hook,
+    register_query_hook,
+)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", "500"))
+PROFILING_MAX_TRACES = int(os.getenv("PROFILING_MAX_TRACES", "50"))
+PROFILING_EXPLAIN_SAMPLE = float(os.getenv("PROFILING_EXPLAIN_SAMPLE", "0"))
+PROFILING_EXPLAIN_TOP = 3
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_HEADER = b"x-hercules-profile"
+# Langlevde strømmer (SSE) er ikke trege forespørsler
+UNPROFILED_PATHS = ("/api/events",)
+
+_traces: deque = deque(maxlen=PROFILING_MAX_TRACES)
+_traces_lock = threading.Lock()
+
+
+class _Trace:
+    __slots__ = ("queries", "raw_params", "connects", "threads")
+
+    def __init__(self):
+        self.queries: list[dict] = []
+        self.raw_params: list = []  # kun i minnet til EXPLAIN er kjørt, lagres aldri
+        self.connects: list[float] = []
+        self.threads: set[int] = set()
+
+
+_current: ContextVar[_Trace | None] = ContextVar("hercules_profile_trace", default=None)
+
+
+def _redact(params):
+    """Behold struktur/typer, aldri verdier (kan være e-post, passord-hash osv.)."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: type(v).__name__ for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [type(v).__name__ for v in params]
+    return type(params).__name__
+
+
+def _on_query(statement, params, duration: float, rowcount: int) -> None:
+    trace = _current.get()
+    if trace is None:
+        return
+    text = statement.decode("utf-8", "replace") if isinstance(statement, bytes) else str(statement)
+    trace.queries.append({
+        "sql": " ".join(text.split()),
+        "params": _redact(params),
+        "duration_ms": round(duration * 1000, 3),
+        "rowcount": rowcount,
+    })
+    trace.raw_params.append(params)
+    trace.threads.add(threading.get_ident())
+
+
+def _on_connect(duration: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.connects.append(round(duration * 1000, 3))
+
+
+register_query_hook(_on_query)
+register_connect_hook(_on_connect)
+
+
+class _Sampler:
+    """Samplende CPU-profil: stakker for trådene som tilhører forespørselen."""
+
+    def __init__(self, trace: _Trace, loop_thread: int):
+        self.trace = trace
+        self.loop_thread = loop_thread
+        self.samples: list[tuple[int, str]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def _run(self) -> None:
+        interval = PROFILING_SAMPLE_INTERVAL_MS / 1000
+        me = threading.get_ident()
+        while not self._stop.wait(interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                f = frame
+                while f is not None and len(stack) < 40:
+                    stack.append(f"{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}:{f.f_lineno}")
+                    f = f.f_back
+                self.samples.append((tid, ";".join(reversed(stack))))
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> list[dict]:
+        self._stop.set()
+        self._thread.join(timeout=1)
+        owned = self.trace.threads | {self.loop_thread}
+        counts = Counter(stack for tid, stack in self.samples if tid in owned)
+        return [{"stack": s, "samples": n} for s, n in counts.most_common(30)]
+
+
+def _is_admin_token(auth_header: str) -> bool:
+    token = auth_header[7:] if auth_header.lower().startswith("bearer ") else ""
+    payload = decode_access_token(token) if token else None
+    if not payload or "sub" not in payload:
+        return False
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT rolle FROM users WHERE id = %s", (payload["sub"],))
+            row = cur.fetchone()
+        except Exception:
+            return False
+        finally:
+            cur.close()
+    return bool(row and row["rolle"] == "admin")
+
+
+def _is_read_only(sql: str) -> bool:
+    s = sql.lstrip().upper()
+    if not (s.startswith("SELECT") or s.startswith("WITH")):
+        return False
+    return not any(w in s for w in ("INSERT ", "UPDATE ", "DELETE ", "FOR UPDATE"))
+
+
+def _explain_slowest(trace: _Trace) -> list[dict]:
+    """EXPLAIN ANALYZE for de tregeste lese-spørringene, i egen transaksjon som rulles tilbake."""
+    candidates = sorted(
+        (i for i, q in enumerate(trace.queries) if _is_read_only(q["sql"])),
+        key=lambda i: trace.queries[i]["duration_ms"],
+        reverse=True,
+    )[:PROFILING_EXPLAIN_TOP]
+    plans = []
+    for i in candidates:
+        q = trace.queries[i]
+        try:
+            with get_connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {q['sql']}", trace.raw_params[i])
+                    plans.append({"query_index": i, "plan": cur.fetchone()[0]})
+                finally:
+                    cur.close()
+                    conn.rollback()
+        except Exception as e:
+            plans.append({"query_index": i, "error": str(e)[:200]})
+    return plans
+
+
+def _store(trace_dict: dict) -> None:
+    with _traces_lock:
+        _traces.append(trace_dict)
+
+
+def list_traces() -> list[dict]:
+    """Sammendrag av lagrede spor (nyeste først)."""
+    with _traces_lock:
+        items = list(_traces)
+    return [
+        {k: t[k] for k in ("id", "at", "method", "path", "route", "status", "duration_ms",
+                           "trigger", "query_count", "db_ms", "connect_ms")}
+        for t in reversed(items)
+    ]
+
+
+def get_trace(trace_id: str) -> dict | None:
+    with _traces_lock:
+        for t in _traces:
+            if t["id"] == trace_id:
+                return t
+    return None
+
+
+class ProfilingMiddleware:
+    """Ren ASGI-middleware. Ingen effekt når PROFILING_ENABLED ikke er satt."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILING_ENABLED or scope["type"] != "http" or scope["path"] in UNPROFILED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        forced = False
+        if headers.get(PROFILE_HEADER, b"").strip() in (b"1", b"true"):
+            forced = await anyio.to_thread.run_sync(
+                _is_admin_token, headers.get(b"authorization", b"").decode("latin-1")
+            )
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        trace = _Trace()
+        token = _current.set(trace)
+        sampler = _Sampler(trace, threading.get_ident()) if forced else None
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            _current.reset(token)
+            cpu_profile = sampler.stop() if sampler else None
+            if forced or duration_ms >= PROFILING_SLOW_MS:
+                explain = None
+                if trace.queries and random.random() < PROFILING_EXPLAIN_SAMPLE:
+                    explain = await anyio.to_thread.run_sync(_explain_slowest, trace)
+                route = scope.get("route")
+                _store({
+                    "id": uuid.uuid4().hex,
+                    "at": datetime.now(timezone.utc).isoformat(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(route, "path", None),
+                    "status": status["code"],
+                    "duration_ms": round(duration_ms, 3),
+                    "trigger": "header" if forced else "slow",
+                    "query_count": len(trace.queries),
+                    "db_ms": round(sum(q["duration_ms"] for q in trace.queries), 3),
+                    "connect_ms": round(sum(trace.connects), 3),
+                    "queries": trace.queries,
+                    "connects_ms": trace.connects,
+                    "explain": explain,
+                    "cpu_profile": cpu_profile,
+                })
@@ -0,0 +1,63 @@
+"""
+Les-egne-skrivinger med lesereplikaer, på tvers av worker-prosesser og replikaer.
+
+En skrivende forespørsel (alt annet enn GET/HEAD/OPTIONS) som lykkes får en markør tilbake –
+et epoch-tidspunkt READ_YOUR_WRITES_SECONDS frem – både som cookie (nettleseren sender den
+automatisk bak nginx) og i headeren X-Read-Your-Writes (for klienter uten cookies, som sender
+den tilbake i samme header). Så lenge markøren er gyldig, går brukerens lesing til primær
+uansett hvilken worker som tar forespørselen. Uten DATABASE_READ_URLS gjør middlewaren ingenting.
+"""
+from http.cookies import CookieError, SimpleCookie
+
+from .database import READ_YOUR_WRITES_SECONDS, new_write_marker, replicas_enabled, use_write_marker
+
+COOKIE_NAME = "hercules_rw"
+HEADER_NAME = "X-Read-Your-Writes"
+_SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _client_marker(scope) -> str | None:
+    cookie = None
+    for name, value in scope.get("headers", ()):
+        if name == HEADER_NAME.lower().encode():
+            return value.decode("latin-1")
+        if name == b"cookie":
+            cookie = value.decode("latin-1")
+    if not cookie:
+        return None
+    try:
+        morsel = SimpleCookie(cookie).get(COOKIE_NAME)
+    except CookieError:
+        return None
+    return morsel.value if morsel else None
+
+
+class ReadYourWritesMiddleware:
+    """Ren ASGI-middleware: leser markøren fra klienten og setter en ny etter skriving."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replicas_enabled():
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] in _SAFE_METHODS:
+            use_write_marker(_client_marker(scope))
+            await self.app(scope, receive, send)
+            return
+
+        marker = new_write_marker().encode()
+        cookie = (
+            f"{COOKIE_NAME}={marker.decode()}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+            "Path=/api; HttpOnly; SameSite=Lax"
+        ).encode()
+
+        async def send_with_marker(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = list(message.get("headers", ()))
+                headers += [(b"set-cookie", cookie), (HEADER_NAME.lower().encode(), marker)]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_marker)
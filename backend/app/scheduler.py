@@ -0,0 +1,283 @@
+"""
+Periodiske jobber i appen, kjørt på nøyaktig én replika.
+
+Hver worker har en planleggertråd med egen DB-tilkobling. Den som får
+pg_try_advisory_lock(SCHEDULER_LOCK_ID) er leder så lenge tilkoblingen lever – dør poden,
+slipper Postgres låsen og en annen worker tar over ved neste tikk. Lederen kjører jobbene
+som er forfalt i scheduled_jobs. Hver kjøring reserveres med en betinget UPDATE av
+next_run_at, så en jobb aldri kjører to ganger selv om to ledere skulle overlappe.
+
+Jobber med vindu (hours, UTC, f.eks. "2-5") legges på et tilfeldig tidspunkt i vinduet,
+så batcharbeid spres utenom trafikktoppene i stedet for å komme i støt.
+
+Jobbene registreres med register_job() (app.main). Status (siste/neste kjøring, varighet,
+resultat/feil) vises i GET /api/admin/jobs; POST /api/admin/jobs/<navn>/run kjører ved
+neste tikk. SCHEDULER_ENABLED=false slår av planleggeren i denne prosessen.
+
+Bakgrunnstråder som kaller eksterne leverandører (product_refresh, image_mirror) sjekker
+is_leader(), så kvotene ikke ganges med antall workere og poder.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+import psycopg2
+
+from .database import DATABASE_URL, get_connection, get_cursor
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "30"))
+# Fast nøkkel for leder-låsen (vilkårlig, men lik i alle replikaer)
+SCHEDULER_LOCK_ID = 7_420_001
+
+
+def parse_hours(value: str | None) -> tuple[int, int] | None:
+    """ "2-5" → (2, 5). Tom/ugyldig = ingen begrensning."""
+    try:
+        start, end = (int(x) for x in (value or "").split("-", 1))
+    except ValueError:
+        return None
+    return start % 24, end % 24
+
+
+def _in_window(hours: tuple[int, int], at: datetime) -> bool:
+    start, end = hours
+    if start <= end:
+        return start <= at.hour < end
+    return at.hour >= start or at.hour < end
+
+
+class Job:
+    __slots__ = ("name", "fn", "interval_seconds", "hours", "description")
+
+    def __init__(self, name: str, fn: Callable[[], Any], interval_seconds: int, hours, description: str):
+        self.name = name
+        self.fn = fn
+        self.interval_seconds = interval_seconds
+        self.hours = hours
+        self.description = description
+
+    def next_run(self, after: datetime) -> datetime:
+        at = after + timedelta(seconds=self.interval_seconds)
+        if self.hours is None or _in_window(self.hours, at):
+            return at
+        start, end = self.hours
+        window_seconds = ((end - start) % 24 or 24) * 3600
+        begin = at.replace(hour=start, minute=0, second=0, microsecond=0)
+        if begin < at:
+            begin += timedelta(days=1)
+        return begin + timedelta(seconds=random.uniform(0, window_seconds))
+
+
+_jobs: dict[str, Job] = {}
+
+
+def register_job(
+    name: str,
+    fn: Callable[[], Any],
+    interval_seconds: int,
+    hours: tuple[int, int] | None = None,
+    description: str = "",
+) -> None:
+    """fn kjøres uten argumenter; returverdien (JSON-serialiserbar) lagres som last_result."""
+    _jobs[name] = Job(name, fn, interval_seconds, hours, description)
+
+
+def registered_jobs() -> dict[str, Job]:
+    return dict(_jobs)
+
+
+def _sync_jobs() -> None:
+    """Sørg for rad per registrert jobb; eksisterende next_run_at beholdes."""
+    now = datetime.now(timezone.utc)
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            for job in _jobs.values():
+                cur.execute(
+                    """
+                    INSERT INTO scheduled_jobs (name, interval_seconds, next_run_at)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (name) DO UPDATE SET interval_seconds = EXCLUDED.interval_seconds
+                    """,
+                    (job.name, job.interval_seconds, job.next_run(now - timedelta(seconds=job.interval_seconds))),
+                )
+        finally:
+            cur.close()
+
+
+def _claim(job: Job) -> bool:
+    now = datetime.now(timezone.utc)
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE scheduled_jobs
+                SET next_run_at = %s, last_started_at = NOW(), last_host = %s
+                WHERE name = %s AND next_run_at <= NOW()
+                RETURNING name
+                """,
+                (job.next_run(now), socket.gethostname(), job.name),
+            )
+            return cur.fetchone() is not None
+        finally:
+            cur.close()
+
+
+def _run(job: Job) -> None:
+    start = time.perf_counter()
+    status, error, result = "ok", None, None
+    try:
+        result = job.fn()
+    except Exception as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+        print(f"[scheduler] {job.name} feilet: {error}")  # noqa: T201
+    duration_ms = (time.perf_counter() - start) * 1000
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                UPDATE scheduled_jobs
+                SET last_finished_at = NOW(), last_duration_ms = %s, last_status = %s,
+                    last_error = %s, last_result = %s::jsonb, run_count = run_count + 1
+                WHERE name = %s
+                """,
+                (round(duration_ms, 3), status, error, json.dumps(result, default=str), job.name),
+            )
+        finally:
+            cur.close()
+
+
+_leader = threading.Event()
+
+
+def is_leader() -> bool:
+    """Om denne prosessen holder leder-låsen akkurat nå."""
+    return _leader.is_set()
+
+
+def _run_due_jobs(stop: threading.Event) -> None:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("SELECT name FROM scheduled_jobs WHERE next_run_at <= NOW() ORDER BY next_run_at")
+            due = [r["name"] for r in cur.fetchall()]
+        finally:
+            cur.close()
+    for name in due:
+        if stop.is_set():
+            return
+        job = _jobs.get(name)
+        if job is not None and _claim(job):
+            _run(job)
+
+
+def _loop(stop: threading.Event) -> None:
+    lock_conn = None
+    leader = False
+    while not stop.is_set():
+        try:
+            if lock_conn is None or lock_conn.closed:
+                lock_conn = psycopg2.connect(DATABASE_URL)
+                lock_conn.autocommit = True
+                leader = False
+            cur = lock_conn.cursor()
+            try:
+                if leader:
+                    cur.execute("SELECT 1")  # oppdag brutt tilkobling (= tapt lås)
+                else:
+                    cur.execute("SELECT pg_try_advisory_lock(%s)", (SCHEDULER_LOCK_ID,))
+                    leader = cur.fetchone()[0]
+                    if leader:
+                        print(f"[scheduler] leder: {socket.gethostname()} (pid {os.getpid()})")  # noqa: T201
+                        _sync_jobs()
+            finally:
+                cur.close()
+            if leader:
+                _leader.set()
+                _run_due_jobs(stop)
+        except psycopg2.Error as e:
+            print(f"[scheduler] DB-feil: {e}")  # noqa: T201
+            _leader.clear()
+            if lock_conn is not None:
+                lock_conn.close()
+            lock_conn, leader = None, False
+        # Litt tilfeldighet så replikaene ikke tikker i takt
+        stop.wait(SCHEDULER_TICK_SECONDS * random.uniform(0.8, 1.2))
+    _leader.clear()
+    if lock_conn is not None:
+        lock_conn.close()
+
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+
+
+def start_scheduler() -> None:
+    """Start planleggertråden (idempotent). Gjør ingenting hvis SCHEDULER_ENABLED er av."""
+    global _thread
+    if not SCHEDULER_ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(_stop,), name="scheduler", daemon=True)
+    _thread.start()
+
+
+def stop_scheduler() -> None:
+    _stop.set()
+
+
+def job_status() -> list[dict]:
+    """Status for alle jobber (også uregistrerte rader, f.eks. fra en eldre versjon)."""
+    with get_connection(read_only=True) as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute(
+                """
+                SELECT name, interval_seconds, next_run_at, last_started_at, last_finished_at,
+                       last_duration_ms, last_status, last_error, last_result, last_host, run_count
+                FROM scheduled_jobs
+                ORDER BY name
+                """
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+    out = []
+    for r in rows:
+        job = _jobs.get(r["name"])
+        out.append({
+            "name": r["name"],
+            "description": job.description if job else None,
+            "registered": job is not None,
+            "interval_seconds": r["interval_seconds"],
+            "hours": f"{job.hours[0]}-{job.hours[1]}" if job and job.hours else None,
+            "next_run_at": r["next_run_at"].isoformat() if r["next_run_at"] else None,
+            "last_started_at": r["last_started_at"].isoformat() if r["last_started_at"] else None,
+            "last_finished_at": r["last_finished_at"].isoformat() if r["last_finished_at"] else None,
+            "last_duration_ms": r["last_duration_ms"],
+            "last_status": r["last_status"],
+            "last_error": r["last_error"],
+            "last_result": r["last_result"],
+            "last_host": r["last_host"],
+            "run_count": r["run_count"],
+        })
+    return out
+
+
+def run_soon(name: str) -> bool:
+    """Sett jobben forfalt nå (kjøres av lederen ved neste tikk)."""
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        try:
+            cur.execute("UPDATE scheduled_jobs SET next_run_at = NOW() WHERE name = %s RETURNING name", (name,))
+            return cur.fetchone() is not None
+        finally:
+            cur.close()
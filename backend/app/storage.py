@@ -7,14 +7,19 @@ Prod:   S3 / R2 / annen S3-kompatibel (S3_ENDPOINT_URL tom eller R2-endpoint)
 """
 import os
 import uuid
-from typing import BinaryIO
+from typing import BinaryIO, Iterator
 
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
 
+from app.metrics import external_call
+
 # Miljøvariabler – samme navn som AWS SDK, så enkelt i K8s
 S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "").strip() or None  # MinIO: http://minio:9000
+# Endpoint klienter (nettleser/app) når for direkte opplasting; default = S3_ENDPOINT_URL.
+# Lokalt: http://localhost:9000 (minio:9000 finnes bare i Docker-nettverket)
+S3_PUBLIC_ENDPOINT_URL = os.getenv("S3_PUBLIC_ENDPOINT_URL", "").strip() or S3_ENDPOINT_URL
 S3_BUCKET = os.getenv("S3_BUCKET", "hercules")
 S3_REGION = os.getenv("AWS_REGION", os.getenv("S3_REGION", "us-east-1"))
 S3_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID", os.getenv("S3_ACCESS_KEY", ""))
@@ -23,7 +28,7 @@ S3_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", os.getenv("S3_SECRET_KEY", ""
 STORAGE_ENABLED = bool(S3_BUCKET and (S3_ACCESS_KEY or S3_ENDPOINT_URL))
 
 
-def _client():
+def _client(endpoint_url: str | None = S3_ENDPOINT_URL):
     if not STORAGE_ENABLED:
         return None
     kwargs = {
@@ -31,8 +36,8 @@ def _client():
         "region_name": S3_REGION,
         "config": Config(signature_version="s3v4"),
     }
-    if S3_ENDPOINT_URL:
-        kwargs["endpoint_url"] = S3_ENDPOINT_URL
+    if endpoint_url:
+        kwargs["endpoint_url"] = endpoint_url
     if S3_ACCESS_KEY and S3_SECRET_KEY:
         kwargs["aws_access_key_id"] = S3_ACCESS_KEY
         kwargs["aws_secret_access_key"] = S3_SECRET_KEY
@@ -63,6 +68,7 @@ def upload_fileobj(
     content_type: str,
     *,
     bucket: str | None = None,
+    cache_control: str | None = None,
 ) -> str:
     """
     Last opp fil til bucket. Returnerer storage-nøkkel (key) som brukes i /api/media/<key>.
@@ -72,22 +78,92 @@ def upload_fileobj(
     b = bucket or S3_BUCKET
     ensure_bucket(b)
     client = _client()
-    client.upload_fileobj(
-        file_obj,
-        b,
-        key,
-        ExtraArgs={"ContentType": content_type},
-    )
+    extra = {"ContentType": content_type}
+    if cache_control:
+        extra["CacheControl"] = cache_control
+    with external_call("s3"):
+        client.upload_fileobj(
+            file_obj,
+            b,
+            key,
+            ExtraArgs=extra,
+        )
     return key
 
 
+def download_fileobj(key: str, file_obj: BinaryIO, *, bucket: str | None = None) -> None:
+    """Last ned objekt til fil (f.eks. tempfil for bildebehandling)."""
+    if not STORAGE_ENABLED:
+        raise RuntimeError("Storage is not configured (S3_BUCKET / credentials)")
+    with external_call("s3"):
+        _client().download_fileobj(bucket or S3_BUCKET, key, file_obj)
+
+
+def presign_post(
+    key: str,
+    content_type: str,
+    max_bytes: int,
+    *,
+    expires_in: int = 600,
+    bucket: str | None = None,
+) -> dict:
+    """
+    Presignert POST-policy for direkte opplasting klient → S3/MinIO. Policyen låser nøkkel,
+    Content-Type og størrelse (content-length-range), så S3 avviser alt annet.
+    Returnerer {"url": ..., "fields": {...}} – fields sendes som skjemafelt før filen.
+    """
+    if not STORAGE_ENABLED:
+        raise RuntimeError("Storage is not configured (S3_BUCKET / credentials)")
+    b = bucket or S3_BUCKET
+    ensure_bucket(b)
+    return _client(S3_PUBLIC_ENDPOINT_URL).generate_presigned_post(
+        Bucket=b,
+        Key=key,
+        Fields={"Content-Type": content_type},
+        Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_bytes]],
+        ExpiresIn=expires_in,
+    )
+
+
+def presign_get(
+    key: str,
+    *,
+    expires_in: int = 600,
+    filename: str | None = None,
+    bucket: str | None = None,
+) -> str:
+    """
+    Presignert GET-URL for private objekter (f.eks. dataeksport) – lastes ned direkte fra
+    S3/MinIO uten å gå via /api/media. filename gir Content-Disposition: attachment.
+    """
+    if not STORAGE_ENABLED:
+        raise RuntimeError("Storage is not configured (S3_BUCKET / credentials)")
+    params = {"Bucket": bucket or S3_BUCKET, "Key": key}
+    if filename:
+        params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+    return _client(S3_PUBLIC_ENDPOINT_URL).generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+
+def head_object(key: str, *, bucket: str | None = None) -> dict | None:
+    """Størrelse og type for et objekt, eller None hvis det ikke finnes."""
+    if not STORAGE_ENABLED:
+        return None
+    try:
+        with external_call("s3"):
+            resp = _client().head_object(Bucket=bucket or S3_BUCKET, Key=key)
+    except ClientError:
+        return None
+    return {"size": resp.get("ContentLength", 0), "content_type": resp.get("ContentType", "")}
+
+
 def get_object_stream(key: str, *, bucket: str | None = None):
     """Hent objekt som stream – for GET /api/media."""
     if not STORAGE_ENABLED:
         return None
     b = bucket or S3_BUCKET
     try:
-        resp = _client().get_object(Bucket=b, Key=key)
+        with external_call("s3"):
+            resp = _client().get_object(Bucket=b, Key=key)
         return resp.get("Body")
     except ClientError:
         return None
@@ -99,12 +175,36 @@ def delete_object(key: str, *, bucket: str | None = None) -> bool:
         return False
     b = bucket or S3_BUCKET
     try:
-        _client().delete_object(Bucket=b, Key=key)
+        with external_call("s3"):
+            _client().delete_object(Bucket=b, Key=key)
+        return True
+    except ClientError:
+        return False
+
+
+def copy_object(src_key: str, dst_key: str, *, bucket: str | None = None) -> bool:
+    """Kopier objekt i samme bucket (server-side, uten å laste ned). False hvis kilden mangler."""
+    if not STORAGE_ENABLED:
+        return False
+    b = bucket or S3_BUCKET
+    try:
+        with external_call("s3"):
+            _client().copy_object(Bucket=b, Key=dst_key, CopySource={"Bucket": b, "Key": src_key})
         return True
     except ClientError:
         return False
 
 
+def list_objects(prefix: str, *, bucket: str | None = None) -> Iterator[dict]:
+    """Alle objekter under prefix: {"key", "last_modified"} (side for side, 1000 om gangen)."""
+    if not STORAGE_ENABLED:
+        return
+    paginator = _client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket or S3_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", ()):
+            yield {"key": obj["Key"], "last_modified": obj["LastModified"]}
+
+
 def make_key(prefix: str, filename: str) -> str:
     """Lag unik key med prefix, f.eks. coach/<uuid>.jpg."""
     ext = os.path.splitext(filename)[1].lower() or ".bin"
@@ -0,0 +1,152 @@
+"""
+Kompakt lagring av høyfrekvente aktivitetsdata (skritt, puls).
+
+Én rad per sample ville gjort aktivitetstabellen til den klart største i databasen
+(puls hvert minutt = 1440 rader per bruker per dag, ~60 byte rad + indeks hver). I stedet
+lagres én rad per (bruker, dag, type, kilde) i activity_chunks, med alle dagens samples
+som tre sammenhengende arrays, zlib-komprimert:
+
+    n × int32    tidspunkt i sekunder fra lokal midnatt, delta-kodet (jevne intervaller → lik
+                 delta, som komprimerer til nesten ingenting)
+    n × int32    varighet i sekunder (skritt-intervall; 0 for puls)
+    n × float32  verdi
+
+Dekoding og aggregering gjøres med NumPy (frombuffer + cumsum, bincount per time), så en
+måned med minuttdata er noen få hundre kB å lese og under et millisekund å summere per dag.
+Dag er lokal kalenderdag i ACTIVITY_TIMEZONE; sommertid gir 23- eller 25-timers dager.
+"""
+import os
+import zlib
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+ACTIVITY_TIMEZONE = os.getenv("ACTIVITY_TIMEZONE", "Europe/Oslo")
+_TZ = ZoneInfo(ACTIVITY_TIMEZONE)
+
+# Lengste varighet et sample kan ha (int32 i dagsbiten); parse_batch avviser lengre
+MAX_SAMPLE_SECONDS = 24 * 3600
+
+# (tidspunkt, varighet, verdi) for én dag: int64 sekunder fra midnatt, int32, float32
+Series = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def day_start(day: date) -> int:
+    """Lokal midnatt som Unix-sekunder."""
+    return int(datetime.combine(day, time(), _TZ).timestamp())
+
+
+def local_day(epoch: float) -> date:
+    return datetime.fromtimestamp(epoch, _TZ).date()
+
+
+def encode(series: Series) -> bytes:
+    offsets, durations, values = series
+    deltas = np.diff(offsets, prepend=0).astype("<i4")
+    return zlib.compress(
+        deltas.tobytes() + durations.astype("<i4").tobytes() + values.astype("<f4").tobytes(), 6
+    )
+
+
+def decode(data: bytes, n: int) -> Series:
+    raw = zlib.decompress(data)
+    offsets = np.cumsum(np.frombuffer(raw, "<i4", n, 0), dtype=np.int64)
+    durations = np.frombuffer(raw, "<i4", n, 4 * n)
+    values = np.frombuffer(raw, "<f4", n, 8 * n)
+    return offsets, durations, values
+
+
+def dedupe(series: Series) -> Series:
+    """Sorter på tidspunkt; ved like tidspunkt vinner den siste (nyeste opplasting)."""
+    offsets, durations, values = series
+    last = len(offsets) - 1 - np.unique(offsets[::-1], return_index=True)[1]
+    return offsets[last], durations[last], values[last]
+
+
+def merge(old: Series, new: Series) -> Series:
+    return dedupe(tuple(np.concatenate((o, n)) for o, n in zip(old, new)))
+
+
+def diff_counts(old: Series, new: Series) -> tuple[int, int]:
+    """(nye, endrede) samples i new sammenlignet med old (begge sortert og deduplisert)."""
+    if not len(old[0]):
+        return len(new[0]), 0
+    pos = np.minimum(np.searchsorted(old[0], new[0]), len(old[0]) - 1)
+    hit = old[0][pos] == new[0]
+    same = hit & (old[1][pos] == new[1]) & (old[2][pos] == new[2])
+    return int((~hit).sum()), int((hit & ~same).sum())
+
+
+def split_by_day(epochs: np.ndarray, durations: np.ndarray, values: np.ndarray) -> dict[date, Series]:
+    """Samples (Unix-sekunder) → {lokal dag: serie med sekunder fra midnatt}, deduplisert."""
+    first = local_day(int(epochs.min()))
+    last = local_day(int(epochs.max()))
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    starts = np.array([day_start(d) for d in days] + [day_start(last + timedelta(days=1))], dtype=np.int64)
+    idx = np.searchsorted(starts, epochs, side="right") - 1
+    out = {}
+    for i in np.unique(idx):
+        mask = idx == i
+        out[days[i]] = dedupe((
+            epochs[mask] - starts[i],
+            np.clip(durations[mask], 0, MAX_SAMPLE_SECONDS).astype(np.int32),
+            values[mask].astype(np.float32),
+        ))
+    return out
+
+
+def hours_in_day(day: date) -> int:
+    return (day_start(day + timedelta(days=1)) - day_start(day)) // 3600
+
+
+def hour_labels(day: date) -> list[str]:
+    """Lokal starttid per time (ISO med offset) – 23/25 timer ved sommertidsskifte."""
+    start = day_start(day)
+    return [
+        datetime.fromtimestamp(start + 3600 * h, timezone.utc).astimezone(_TZ).isoformat()
+        for h in range(hours_in_day(day))
+    ]
+
+
+def hourly_steps(chunks: list[Series], hours: int) -> np.ndarray:
+    """Skritt per time. Flere kilder (klokke + telefon) teller samme skritt, så vi tar
+    største kilde per time i stedet for summen."""
+    per_source = [
+        np.bincount(np.minimum(off // 3600, hours - 1), weights=val, minlength=hours)
+        for off, _dur, val in chunks
+    ]
+    return np.max(per_source, axis=0) if per_source else np.zeros(hours)
+
+
+def hourly_heart_rate(chunks: list[Series], hours: int) -> dict[str, np.ndarray]:
+    """Snitt/min/maks puls og antall målinger per time, over alle kilder."""
+    if chunks:
+        hour = np.minimum(np.concatenate([c[0] for c in chunks]) // 3600, hours - 1)
+        val = np.concatenate([c[2] for c in chunks]).astype(np.float64)
+    else:
+        hour, val = np.zeros(0, dtype=np.int64), np.zeros(0)
+    count = np.bincount(hour, minlength=hours)
+    total = np.bincount(hour, weights=val, minlength=hours)
+    lo = np.full(hours, np.inf)
+    hi = np.full(hours, -np.inf)
+    np.minimum.at(lo, hour, val)
+    np.maximum.at(hi, hour, val)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = total / count
+    return {"avg": avg, "min": lo, "max": hi, "count": count}
+
+
+def daily_summary(chunks_by_kind: dict[str, list[Series]], day: date) -> dict:
+    """Dagsaggregat for activity_daily (skritt, puls) fra dagens chunks."""
+    hours = hours_in_day(day)
+    steps = hourly_steps(chunks_by_kind.get("steps", []), hours)
+    hr = chunks_by_kind.get("heart_rate", [])
+    values = np.concatenate([c[2] for c in hr]) if hr else np.zeros(0, dtype=np.float32)
+    return {
+        "steps": int(round(float(steps.sum()))),
+        "hr_avg": round(float(values.mean()), 1) if len(values) else None,
+        "hr_min": float(values.min()) if len(values) else None,
+        "hr_max": float(values.max()) if len(values) else None,
+        "hr_samples": int(len(values)),
+    }
@@ -0,0 +1,9 @@
+"""
+Benchmark og lasttest for Hercules-backend.
+
+- seed:     bygger lokal Postgres fra db/init.sql og fyller syntetiske data (reproduserbart)
+- fakes:    lokale fake-servere for Open Food Facts, Stripe og PowerOffice
+- workload: blandet, vektet arbeidslast mot API-et (list_meals, food-products, strekkode …)
+- run:      CLI – seed + kjør + rapport (JSON), se docs/BENCHMARK.md
+- compare:  sammenlign to rapporter
+"""
@@ -0,0 +1,58 @@
+"""
+Sammenlign to benchmark-rapporter (JSON fra bench.run).
+
+    python -m bench.compare baseline.json candidate.json [--threshold 10]
+
+Returnerer exit-kode 1 hvis p95 eller spørringer per forespørsel har blitt verre enn terskelen (%)
+for noe endepunkt – egnet i CI.
+"""
+import argparse
+import json
+import sys
+
+
+def _pct(old: float, new: float) -> float:
+    if not old:
+        return 0.0 if not new else 100.0
+    return (new - old) / old * 100
+
+
+def compare(base: dict, cand: dict, threshold: float) -> tuple[list[str], bool]:
+    lines = []
+    regressed = False
+    for name in sorted(set(base["endpoints"]) | set(cand["endpoints"])):
+        b = base["endpoints"].get(name)
+        c = cand["endpoints"].get(name)
+        if not b or not c:
+            lines.append(f"{name:32} {'kun i ' + ('kandidat' if c else 'baseline')}")
+            continue
+        d_p95 = _pct(b["p95_ms"], c["p95_ms"])
+        d_rps = _pct(b["throughput_rps"], c["throughput_rps"])
+        d_q = _pct(b["queries_per_request"], c["queries_per_request"])
+        bad = d_p95 > threshold or d_q > threshold
+        regressed = regressed or bad
+        lines.append(
+            f"{name:32} p95 {b['p95_ms']:8.1f} → {c['p95_ms']:8.1f} ms ({d_p95:+6.1f}%)  "
+            f"rps {d_rps:+6.1f}%  q/req {b['queries_per_request']:.1f} → {c['queries_per_request']:.1f}"
+            + ("  REGRESJON" if bad else "")
+        )
+    return lines, regressed
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Sammenlign benchmark-rapporter")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--threshold", type=float, default=10.0, help="Tillatt forverring i prosent")
+    args = p.parse_args(argv)
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        cand = json.load(f)
+    lines, regressed = compare(base, cand, args.threshold)
+    print("\n".join(lines))  # noqa: T201
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Lokale fake-servere for eksterne tjenester, så benchmark aldri går mot internett.
+
+Én HTTP-server med tre prefiks:
+  /off/...          Open Food Facts  (OFF_BASE_URL=<base>/off/api/v2/product)
+  /stripe/...       Stripe           (STRIPE_API_BASE=<base>/stripe)
+  /poweroffice/...  PowerOffice Go   (POWEROFFICE_BASE_URL=<base>/poweroffice)
+
+latency_ms legger på fast forsinkelse per kall for å etterligne ekte nettverk.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _off_product(barcode: str) -> dict:
+    # Deterministisk: strekkoder der siste siffer er partall "finnes", resten gir status 0
+    if not barcode.isdigit() or int(barcode[-1]) % 2:
+        return {"status": 0, "status_verbose": "product not found"}
+    n = int(barcode[-6:-1])
+    return {
+        "status": 1,
+        "code": barcode,
+        "product": {
+            "product_name": f"Fake-produkt {n}",
+            "brands": "Bench",
+            "image_url": None,
+            "nutriments": {
+                "energy-kcal_100g": 50 + n % 400,
+                "proteins_100g": n % 25,
+                "carbohydrates_100g": n % 60,
+                "fat_100g": n % 20,
+            },
+        },
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    latency_s = 0.0
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def _send(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _drain(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+
+    def do_GET(self):  # noqa: N802
+        time.sleep(self.latency_s)
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/off/api/v2/product/"):
+            self._send(200, _off_product(path.rsplit("/", 1)[-1]))
+        elif path.startswith("/poweroffice/") and path.endswith("/Customer"):
+            self._send(200, [])
+        elif path.startswith("/stripe/"):
+            self._send(200, {"id": "in_fake", "object": "invoice", "lines": {"data": []}})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):  # noqa: N802
+        self._drain()
+        time.sleep(self.latency_s)
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/poweroffice/") and path.endswith("/OAuth/Token"):
+            self._send(200, {"access_token": "fake-token", "expires_in": 1200})
+        elif path.startswith("/poweroffice/"):
+            self._send(201, {"Id": 1})
+        elif path.startswith("/stripe/v1/payment_intents"):
+            self._send(200, {
+                "id": "pi_fake", "object": "payment_intent", "status": "succeeded",
+                "latest_charge": {"id": "ch_fake", "object": "charge"},
+            })
+        elif path.startswith("/stripe/v1/customers"):
+            self._send(200, {"id": "cus_fake", "object": "customer"})
+        elif path.startswith("/stripe/v1/payment_methods"):
+            self._send(200, {"id": "pm_fake", "object": "payment_method"})
+        else:
+            self._send(404, {"error": "not found"})
+
+
+class FakeServers:
+    """Start/stopp fake-serverne i egen tråd. Bruk env() for miljøvariabler til appen."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        handler = type("Handler", (_Handler,), {"latency_s": latency_ms / 1000})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="bench-fakes", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict[str, str]:
+        return {
+            "OFF_BASE_URL": f"{self.base_url}/off/api/v2/product",
+            "STRIPE_API_BASE": f"{self.base_url}/stripe",
+            "POWEROFFICE_BASE_URL": f"{self.base_url}/poweroffice",
+        }
+
+    def start(self) -> "FakeServers":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,219 @@
+"""
+Syntetiske data for benchmark. Alt genereres set-basert i Postgres (generate_series),
+med setseed() for reproduserbare tall – samme parametre gir samme datamengde og fordeling.
+"""
+import os
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+
+import bcrypt
+import psycopg2
+
+INIT_SQL = os.path.join(os.path.dirname(__file__), "..", "db", "init.sql")
+BENCH_PASSWORD = "bench123"
+BENCH_EMAIL_PREFIX = "bench-user-"
+BENCH_COACH_PREFIX = "bench-coach-"
+
+
+@dataclass
+class SeedConfig:
+    users: int = 50
+    years: float = 1.0
+    meals_per_day: int = 3
+    entries_per_meal: int = 3
+    products: int = 5000
+    coaches: int = 5
+    recipes_per_user: int = 2
+    seed: float = 0.42
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def ean13(base12: str) -> str:
+    """Gyldig EAN-13 (med kontrollsiffer) fra 12 siffer – samme regel som seed-SQL-en."""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(base12))
+    return base12 + str((10 - total % 10) % 10)
+
+
+def product_barcode(n: int) -> str:
+    """Strekkode for seedet produkt nr. n (1..products)."""
+    return ean13("70" + str(n).zfill(10))
+
+
+def reset_schema(dsn: str) -> None:
+    """Dropp alt i public-schema og kjør db/init.sql på nytt."""
+    with open(INIT_SQL, encoding="utf-8") as f:
+        init_sql = f.read()
+    conn = psycopg2.connect(dsn)
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        cur.execute(init_sql)
+        cur.close()
+    finally:
+        conn.close()
+
+
+def seed(dsn: str, cfg: SeedConfig) -> dict:
+    """Fyll databasen. Returnerer antall rader per tabell."""
+    end = date.today()
+    start = end - timedelta(days=max(1, int(cfg.years * 365)) - 1)
+    # Samme hash for alle benchmark-brukere: bcrypt kjøres kun én gang ved seeding
+    pw_hash = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt(rounds=12)).decode()
+    params = {
+        "users": cfg.users,
+        "coaches": cfg.coaches,
+        "products": cfg.products,
+        "start": start,
+        "end": end,
+        "meals_per_day": max(1, min(cfg.meals_per_day, 5)),
+        "entries_per_meal": max(1, cfg.entries_per_meal),
+        "recipes_per_user": max(0, cfg.recipes_per_user),
+        "pw_hash": pw_hash,
+        "user_prefix": BENCH_EMAIL_PREFIX,
+        "coach_prefix": BENCH_COACH_PREFIX,
+    }
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT setseed(%s)", (cfg.seed,))
+        cur.execute(
+            """
+            INSERT INTO food_products (name, barcode, source, brand, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100)
+            SELECT (ARRAY['Havre', 'Melk', 'Yoghurt', 'Brød', 'Ost', 'Kylling', 'Laks', 'Ris', 'Pasta', 'Eple'])[1 + g %% 10]
+                   || ' ' || (ARRAY['naturell', 'lett', 'grov', 'original', 'økologisk'])[1 + (g / 10) %% 5] || ' ' || g,
+                   b.b12 || c.check_digit,
+                   'openfoodfacts',
+                   'Merke ' || (g %% 200),
+                   round((20 + random() * 500)::numeric, 2),
+                   round((random() * 30)::numeric, 2),
+                   round((random() * 70)::numeric, 2),
+                   round((random() * 30)::numeric, 2)
+            FROM generate_series(1, %(products)s) g
+            CROSS JOIN LATERAL (SELECT '70' || lpad(g::text, 10, '0') AS b12) b
+            CROSS JOIN LATERAL (
+                SELECT (10 - SUM(substr(b.b12, i, 1)::int * CASE WHEN i %% 2 = 0 THEN 3 ELSE 1 END) %% 10) %% 10 AS check_digit
+                FROM generate_series(1, 12) i
+            ) c
+            """,
+            params,
+        )
+        cur.execute(
+            """
+            INSERT INTO users (email, passord_hash, rolle, navn, coach_sokt, coach_godkjent, coach_program_lengder)
+            SELECT %(coach_prefix)s || g || '@bench.local', %(pw_hash)s, 'kunde_og_coach', 'Coach ' || g, TRUE, TRUE, '4,8,12'
+            FROM generate_series(1, %(coaches)s) g
+            """,
+            params,
+        )
+        cur.execute(
+            """
+            INSERT INTO users (email, passord_hash, rolle, navn)
+            SELECT %(user_prefix)s || g || '@bench.local', %(pw_hash)s, 'kunde', 'Bruker ' || g
+            FROM generate_series(1, %(users)s) g
+            """,
+            params,
+        )
+        # Hver bruker får én aktiv coach (round-robin)
+        cur.execute(
+            """
+            WITH u AS (
+                SELECT id, row_number() OVER (ORDER BY email) AS rn
+                FROM users WHERE email LIKE %(user_prefix)s || '%%'
+            ), c AS (
+                SELECT id, row_number() OVER (ORDER BY email) - 1 AS rn
+                FROM users WHERE email LIKE %(coach_prefix)s || '%%'
+            )
+            INSERT INTO kunde_coach (kunde_id, coach_id, start_dato, slutt_dato)
+            SELECT u.id, c.id, NOW() - INTERVAL '2 weeks', NOW() + INTERVAL '10 weeks'
+            FROM u JOIN c ON c.rn = u.rn %% GREATEST(%(coaches)s, 1)
+            """,
+            params,
+        )
+        cur.execute(
+            """
+            WITH p AS (SELECT array_agg(id) AS ids FROM food_products)
+            , r AS (
+                INSERT INTO recipes (user_id, name)
+                SELECT u.id, 'Oppskrift ' || g
+                FROM users u CROSS JOIN generate_series(1, %(recipes_per_user)s) g
+                WHERE u.email LIKE %(user_prefix)s || '%%'
+                RETURNING id
+            )
+            INSERT INTO recipe_ingredients (recipe_id, food_product_id, grams)
+            SELECT DISTINCT ON (r.id, fp) r.id, fp, round((20 + random() * 200)::numeric, 2)
+            FROM r CROSS JOIN p CROSS JOIN generate_series(1, 4) g
+            CROSS JOIN LATERAL (SELECT p.ids[1 + floor(random() * cardinality(p.ids))::int] AS fp) x
+            """,
+            params,
+        )
+        cur.execute("SELECT ensure_log_partitions(%(start)s::date, %(end)s::date)", params)
+        cur.execute(
+            """
+            INSERT INTO meals (user_id, log_date, name, time_slot)
+            SELECT u.id, d::date, s.name, s.slot
+            FROM users u
+            CROSS JOIN generate_series(%(start)s::date, %(end)s::date, INTERVAL '1 day') d
+            CROSS JOIN (VALUES (1, 'Frokost', TIME '07:30'), (2, 'Lunsj', TIME '12:00'),
+                               (3, 'Middag', TIME '17:30'), (4, 'Mellommåltid', TIME '15:00'),
+                               (5, 'Kvelds', TIME '21:00')) s(n, name, slot)
+            WHERE u.email LIKE %(user_prefix)s || '%%' AND s.n <= %(meals_per_day)s
+            """,
+            params,
+        )
+        cur.execute(
+            """
+            WITH p AS (SELECT array_agg(id) AS ids FROM food_products)
+            INSERT INTO meal_entries (meal_id, log_date, food_product_id, amount_gram)
+            SELECT m.id, m.log_date, p.ids[1 + floor(random() * cardinality(p.ids))::int], round((30 + random() * 250)::numeric, 2)
+            FROM meals m CROSS JOIN p CROSS JOIN generate_series(1, %(entries_per_meal)s) g
+            """,
+            params,
+        )
+        # Hvert femte måltid får også en oppskrift-porsjon (list_meals sin oppskriftsgren)
+        cur.execute(
+            """
+            INSERT INTO meal_entries (meal_id, log_date, recipe_id, portions)
+            SELECT m.id, m.log_date, r.id, 1
+            FROM meals m
+            JOIN LATERAL (SELECT id FROM recipes WHERE user_id = m.user_id LIMIT 1) r ON TRUE
+            WHERE random() < 0.2
+            """
+        )
+        # Tilnærmet frecency (siste dag + ln(antall)) – nok til at /api/food-products/recent har data
+        cur.execute(
+            """
+            INSERT INTO user_food_usage (user_id, food_product_id, use_count, last_used_at, last_amount_gram, rank)
+            SELECT m.user_id, me.food_product_id, COUNT(*), MAX(m.log_date), MAX(me.amount_gram),
+                   food_usage_rank(MAX(m.log_date)) + LN(COUNT(*))
+            FROM meal_entries me
+            JOIN meals m ON m.id = me.meal_id AND m.log_date = me.log_date
+            WHERE me.food_product_id IS NOT NULL
+            GROUP BY m.user_id, me.food_product_id
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO weight_entries (user_id, log_date, weight_kg)
+            SELECT u.id, d::date,
+                   round((70 + (abs(hashtext(u.id::text)) %% 30) - 0.01 * (d::date - %(start)s::date) + random())::numeric, 2)
+            FROM users u
+            CROSS JOIN generate_series(%(start)s::date, %(end)s::date, INTERVAL '1 day') d
+            WHERE u.email LIKE %(user_prefix)s || '%%'
+            """,
+            params,
+        )
+        conn.commit()
+        cur.execute("ANALYZE")
+        counts = {}
+        for table in ("users", "food_products", "recipes", "meals", "meal_entries", "user_food_usage", "weight_entries",
+                      "kunde_coach"):
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0]
+        cur.close()
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
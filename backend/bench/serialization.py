@@ -0,0 +1,109 @@
+"""
+Mikro-benchmark for serialisering av matvarelister (list_food_products), uten DB og HTTP.
+
+    python -m bench.serialization [--rows 100 1000] [--repeat 200]
+
+Sammenligner per payload-størrelse:
+  før   – dict bygget inline, validert mot list[FoodProductOut] og encodet med stdlib json
+          (det FastAPI gjør med response_model + JSONResponse)
+  etter – payloads.product_payload + orjson (ORJSONResponse returnert direkte)
+og viser størrelse/tid for gzip og brotli (hvis installert) på resultatet.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+import orjson
+from pydantic import TypeAdapter
+
+from app.compression import brotli, compress
+from app.main import FoodProductOut
+from app.payloads import product_payload
+
+
+def _rows(n: int, rng: random.Random) -> list[dict]:
+    # Samme typer som RealDictCursor gir: UUID og Decimal (NUMERIC)
+    return [
+        {
+            "id": uuid.UUID(int=rng.getrandbits(128)),
+            "name": f"Produkt {i} {rng.choice(('havre', 'melk', 'ost', 'yoghurt'))}",
+            "barcode": f"70{rng.randrange(10**11):011d}",
+            "source": "openfoodfacts",
+            "brand": "Bench",
+            "image_url": None,
+            "user_id": None,
+            "kcal_per_100": Decimal(f"{rng.uniform(10, 800):.2f}"),
+            "protein_per_100": Decimal(f"{rng.uniform(0, 40):.2f}"),
+            "carbs_per_100": Decimal(f"{rng.uniform(0, 80):.2f}"),
+            "fat_per_100": Decimal(f"{rng.uniform(0, 60):.2f}"),
+        }
+        for i in range(n)
+    ]
+
+
+_adapter = TypeAdapter(list[FoodProductOut])
+
+
+def before(rows: list[dict]) -> bytes:
+    payload = [
+        {
+            "id": str(r["id"]),
+            "name": r["name"],
+            "barcode": r.get("barcode"),
+            "source": r.get("source"),
+            "brand": r.get("brand"),
+            "image_url": r.get("image_url"),
+            "user_id": str(r["user_id"]) if r.get("user_id") else None,
+            "kcal_per_100": float(r["kcal_per_100"]),
+            "protein_per_100": float(r["protein_per_100"]),
+            "carbs_per_100": float(r["carbs_per_100"]),
+            "fat_per_100": float(r["fat_per_100"]),
+        }
+        for r in rows
+    ]
+    validated = _adapter.dump_python(_adapter.validate_python(payload), mode="json")
+    return json.dumps(validated, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def after(rows: list[dict]) -> bytes:
+    return orjson.dumps([product_payload(r) for r in rows])
+
+
+def _time(fn, arg, repeat: int) -> float:
+    fn(arg)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Mikro-benchmark: serialisering av matvarelister")
+    p.add_argument("--rows", type=int, nargs="+", default=[100, 1000])
+    p.add_argument("--repeat", type=int, default=200)
+    args = p.parse_args(argv)
+    rng = random.Random(42)
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    for n in args.rows:
+        rows = _rows(n, rng)
+        assert json.loads(before(rows)) == json.loads(after(rows))
+        t_before = _time(before, rows, args.repeat)
+        t_after = _time(after, rows, args.repeat)
+        body = after(rows)
+        print(  # noqa: T201
+            f"{n:5} rader  før {t_before:9.1f} µs  etter {t_after:9.1f} µs  "
+            f"({t_before / t_after:4.1f}x)  {len(body) / 1024:7.1f} KiB"
+        )
+        for enc in encodings:
+            t_enc = _time(lambda b, e=enc: compress(b, e), body, max(1, args.repeat // 4))
+            size = len(compress(body, enc))
+            print(f"{'':12}{enc:5} {t_enc:9.1f} µs  {size / 1024:7.1f} KiB ({size / len(body):.0%})")  # noqa: T201
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Blandet arbeidslast. Hver operasjon er (navn, vekt, funksjon); funksjonen gjør ett HTTP-kall
+med en tilfeldig (men seedet) bruker og returnerer responsen. Vektene etterligner vanlig bruk:
+mest lesing av dagens måltider og matsøk, litt strekkode og logging.
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+import httpx
+
+from bench.seed import product_barcode
+
+SEARCH_TERMS = ("havre", "melk", "yoghurt", "ost", "kylling", "laks", "ris", "pasta", "eple", "grov")
+
+
+@dataclass
+class WorkloadContext:
+    user_tokens: list[str]
+    coach_tokens: list[str]
+    products: int
+    start: date
+    end: date
+    product_ids: list[str] = field(default_factory=list)
+
+    def user(self, rng: random.Random) -> dict[str, str]:
+        return {"Authorization": f"Bearer {rng.choice(self.user_tokens)}"}
+
+    def coach(self, rng: random.Random) -> dict[str, str]:
+        return {"Authorization": f"Bearer {rng.choice(self.coach_tokens)}"}
+
+    def day(self, rng: random.Random) -> str:
+        # 80 % siste uke (typisk bruk), resten tilfeldig i historikken
+        span = (self.end - self.start).days
+        back = rng.randint(0, min(6, span)) if rng.random() < 0.8 else rng.randint(0, span)
+        return (self.end - timedelta(days=back)).isoformat()
+
+
+def list_meals(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    return c.get("/api/meals", params={"date": ctx.day(rng)}, headers=ctx.user(rng))
+
+
+def list_meals_week(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    end = date.fromisoformat(ctx.day(rng))
+    params = {"from_date": (end - timedelta(days=6)).isoformat(), "to_date": end.isoformat()}
+    if rng.random() < 0.5:
+        params["summary_only"] = "true"
+    return c.get("/api/meals", params=params, headers=ctx.user(rng))
+
+
+def search_food(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    return c.get("/api/food-products", params={"q": rng.choice(SEARCH_TERMS)}, headers=ctx.user(rng))
+
+
+def recent_food(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    # Det "legg til mat"-dialogen henter når den åpnes
+    return c.get("/api/food-products/recent", headers=ctx.user(rng))
+
+
+def barcode_hit(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    b = product_barcode(rng.randint(1, ctx.products))
+    return c.get("/api/food/by-barcode", params={"barcode": b}, headers=ctx.user(rng))
+
+
+def barcode_external(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    # Utenfor seedet område → lokal bom, deretter fake OFF (partall = funnet og lagret)
+    b = product_barcode(ctx.products + rng.randint(1, 1_000_000))
+    return c.get("/api/food/by-barcode", params={"barcode": b}, headers=ctx.user(rng))
+
+
+def weight_history(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    days = rng.choice((30, 90, 365))
+    return c.get(
+        "/api/weight/history",
+        params={"from_date": (ctx.end - timedelta(days=days)).isoformat(), "to_date": ctx.end.isoformat()},
+        headers=ctx.user(rng),
+    )
+
+
+def create_meal(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    entries = [
+        {"food_product_id": rng.choice(ctx.product_ids), "amount_gram": rng.randint(30, 300)}
+        for _ in range(rng.randint(1, 4))
+    ]
+    return c.post(
+        "/api/meals",
+        json={"log_date": ctx.end.isoformat(), "name": "Bench", "entries": entries},
+        headers=ctx.user(rng),
+    )
+
+
+def me(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    return c.get("/api/me", headers=ctx.user(rng))
+
+
+def coach_clients(c: httpx.Client, rng: random.Random, ctx: WorkloadContext) -> httpx.Response:
+    return c.get("/api/coach/clients", headers=ctx.coach(rng))
+
+
+# (navn, vekt, funksjon)
+DEFAULT_MIX = (
+    ("list_meals", 30, list_meals),
+    ("list_meals_week", 5, list_meals_week),
+    ("list_food_products_search", 18, search_food),
+    ("list_food_products_recent", 5, recent_food),
+    ("lookup_by_barcode_local", 12, barcode_hit),
+    ("lookup_by_barcode_external", 3, barcode_external),
+    ("get_weight_history", 10, weight_history),
+    ("create_meal", 7, create_meal),
+    ("me", 10, me),
+    ("coach_clients", 5, coach_clients),
+)
+
+
+def pick(rng: random.Random, mix=DEFAULT_MIX):
+    names, weights, funcs = zip(*mix)
+    i = rng.choices(range(len(mix)), weights=weights, k=1)[0]
+    return names[i], funcs[i]
@@ -21,6 +21,7 @@ CREATE TABLE users (
     first_charge_done       BOOLEAN NOT NULL DEFAULT FALSE,
     payment_method_type     VARCHAR(20),
     payment_failed_at       TIMESTAMPTZ,
+    payment_action_required_at TIMESTAMPTZ,
     payment_retry_count     INT NOT NULL DEFAULT 0,
     next_payment_retry_at   TIMESTAMPTZ,
     account_blocked_at      TIMESTAMPTZ,
@@ -32,6 +33,9 @@ CREATE INDEX idx_users_email ON users (email);
 CREATE INDEX idx_users_rolle ON users (rolle);
 CREATE INDEX idx_users_next_payment_retry ON users(next_payment_retry_at)
   WHERE next_payment_retry_at IS NOT NULL AND account_blocked_at IS NULL;
+-- Jobben trial-charges: utløpt prøveuke uten første trekk
+CREATE INDEX idx_users_trial_charge ON users(trial_ends_at)
+  WHERE first_charge_done = FALSE AND account_blocked_at IS NULL AND next_payment_retry_at IS NULL;
 
 COMMENT ON TABLE users IS 'Brukere med rolle: admin, kunde, kunde_og_coach. coach_* brukes for coach-profil og godkjenning.';
 COMMENT ON COLUMN users.coach_beskrivelse IS 'Kort beskrivelse av coachen (vises i coach-liste)';
@@ -43,6 +47,7 @@ COMMENT ON COLUMN users.stripe_customer_id IS 'Stripe Customer ID for abonnement
 COMMENT ON COLUMN users.first_charge_done IS 'Om første trekk (etter trial) er gjennomført';
 COMMENT ON COLUMN users.payment_method_type IS 'Foretrukket metode: kort, vipps, paypal';
 COMMENT ON COLUMN users.payment_failed_at IS 'Siste mislykkede betaling';
+COMMENT ON COLUMN users.payment_action_required_at IS 'Første trekk venter på bekreftelse fra brukeren (3-D Secure)';
 COMMENT ON COLUMN users.payment_retry_count IS 'Antall retries';
 COMMENT ON COLUMN users.next_payment_retry_at IS 'Neste ukentlige retry';
 COMMENT ON COLUMN users.account_blocked_at IS 'Konto sperret etter siste retry siste dag i måneden';
@@ -55,12 +60,16 @@ CREATE TABLE kunde_coach (
     start_dato     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     slutt_dato     TIMESTAMPTZ NOT NULL,
     opprettet      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    slutt_varslet  BOOLEAN NOT NULL DEFAULT FALSE,
     UNIQUE(kunde_id, coach_id)
 );
 
 CREATE INDEX idx_kunde_coach_kunde ON kunde_coach(kunde_id);
-CREATE INDEX idx_kunde_coach_coach ON kunde_coach(coach_id);
+-- coach_id først: aktive kunder for en coach (slutt_dato > NOW()) leses fra samme indeks
+CREATE INDEX idx_kunde_coach_coach_slutt ON kunde_coach(coach_id, slutt_dato);
 CREATE INDEX idx_kunde_coach_slutt ON kunde_coach(slutt_dato);
+-- Jobben coach-access-expiry: utløpte tilganger som ikke er varslet ennå
+CREATE INDEX idx_kunde_coach_slutt_varsel ON kunde_coach(slutt_dato) WHERE slutt_varslet = FALSE;
 
 COMMENT ON TABLE kunde_coach IS 'Kundes valg av coach; tilgang i 12 uker. Program og logger tilhører kunden etter slutt_dato.';
 
@@ -112,11 +121,17 @@ CREATE TABLE food_products (
     source          VARCHAR(30) NOT NULL DEFAULT 'local',
     brand           VARCHAR(255),
     image_url       TEXT,
+    image_source_url TEXT,
+    image_mirror_attempted_at TIMESTAMPTZ,
     user_id         UUID REFERENCES users(id) ON DELETE CASCADE,
     kcal_per_100    NUMERIC(10,2) NOT NULL DEFAULT 0,
     protein_per_100 NUMERIC(10,2) NOT NULL DEFAULT 0,
     carbs_per_100   NUMERIC(10,2) NOT NULL DEFAULT 0,
     fat_per_100     NUMERIC(10,2) NOT NULL DEFAULT 0,
+    fetched_at      TIMESTAMPTZ,
+    refreshed_at    TIMESTAMPTZ,
+    scan_count      INT NOT NULL DEFAULT 0,
+    last_scanned_at TIMESTAMPTZ,
     created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
@@ -124,8 +139,26 @@ CREATE UNIQUE INDEX idx_food_products_barcode ON food_products(barcode) WHERE ba
 CREATE INDEX idx_food_products_name ON food_products(LOWER(name));
 CREATE INDEX idx_food_products_user ON food_products(user_id) WHERE user_id IS NOT NULL;
 
-COMMENT ON COLUMN food_products.barcode IS 'EAN-13 eller annen strekkode; brukes for oppslag mot eksterne API én gang, deretter cachet lokalt.';
+COMMENT ON COLUMN food_products.barcode IS 'Kanonisk GTIN (EAN-13, EAN-8 eller GTIN-14, se _normalize_barcode); brukes for oppslag mot eksterne API én gang, deretter cachet lokalt.';
 COMMENT ON COLUMN food_products.source IS 'local | openfoodfacts | nutritionix | edamam | user';
+-- Bakgrunnsoppfrisking: mest skannede eksterne produkter først
+CREATE INDEX idx_food_products_refresh ON food_products(scan_count DESC, COALESCE(refreshed_at, fetched_at))
+  WHERE user_id IS NULL AND source IN ('openfoodfacts', 'nutritionix', 'edamam');
+
+COMMENT ON COLUMN food_products.fetched_at IS 'Når data sist ble hentet fra ekstern kilde (NULL = lokal/bruker)';
+COMMENT ON COLUMN food_products.refreshed_at IS 'Siste revalidering mot ekstern kilde (bakgrunnsjobb, app/product_refresh.py)';
+COMMENT ON COLUMN food_products.scan_count IS 'Antall strekkode-oppslag som traff produktet; styrer rekkefølge for oppfrisking';
+COMMENT ON COLUMN food_products.image_source_url IS 'Opprinnelig eksternt bilde-URL når image_url er speilet til /api/media (app/image_mirror.py)';
+
+-- Bildespeiling: produkter som fortsatt har eksternt bilde, mest skannede først
+CREATE INDEX idx_food_products_image_mirror ON food_products(scan_count DESC) WHERE image_url LIKE 'http%';
+
+-- Speilede bilder: én lagret kopi per innhold (SHA-256 av nedlastede bytes)
+CREATE TABLE media_images (
+    content_hash CHAR(64) PRIMARY KEY,
+    storage_key  TEXT NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
 COMMENT ON COLUMN food_products.user_id IS 'NULL = global matvare (seed eller hentet fra API); satt = brukerens egen matvare.';
 
 CREATE TABLE recipes (
@@ -148,46 +181,317 @@ CREATE TABLE recipe_ingredients (
 
 CREATE INDEX idx_recipe_ingredients_recipe ON recipe_ingredients(recipe_id);
 
+-- Måltider og vekt vokser med hver registrering fra hver bruker. Tabellene er derfor
+-- range-partisjonert per måned på log_date: ferske data (det nesten alle spørringer treffer)
+-- ligger i små partisjoner med egne indekser, og gamle måneder kan kobles fra (DETACH) billig.
+-- log_date er med i primærnøkkelen (krav for partisjonerte tabeller), og meal_entries har
+-- måltidets log_date slik at den partisjoneres likt og kan beskjæres på samme dato.
+-- Partisjoner opprettes med ensure_log_partitions() (se under og app/partitions.py).
 CREATE TABLE meals (
-    id        UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id        UUID NOT NULL DEFAULT gen_random_uuid(),
     user_id   UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     log_date  DATE NOT NULL,
     name      VARCHAR(255),
     time_slot TIME,
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, log_date)
+) PARTITION BY RANGE (log_date);
 
 CREATE INDEX idx_meals_user_date ON meals(user_id, log_date);
 
 CREATE TABLE meal_entries (
-    id               UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-    meal_id          UUID NOT NULL REFERENCES meals(id) ON DELETE CASCADE,
+    id               UUID NOT NULL DEFAULT gen_random_uuid(),
+    meal_id          UUID NOT NULL,
+    log_date         DATE NOT NULL,
     food_product_id  UUID REFERENCES food_products(id) ON DELETE CASCADE,
     recipe_id        UUID REFERENCES recipes(id) ON DELETE CASCADE,
     amount_gram      NUMERIC(10,2),
     portions         NUMERIC(6,2),
+    PRIMARY KEY (id, log_date),
+    FOREIGN KEY (meal_id, log_date) REFERENCES meals(id, log_date) ON DELETE CASCADE,
     CONSTRAINT meal_entry_source CHECK (
         (food_product_id IS NOT NULL AND recipe_id IS NULL AND amount_gram IS NOT NULL) OR
         (recipe_id IS NOT NULL AND food_product_id IS NULL AND portions IS NOT NULL)
     )
-);
+) PARTITION BY RANGE (log_date);
 
-CREATE INDEX idx_meal_entries_meal ON meal_entries(meal_id);
+CREATE INDEX idx_meal_entries_meal ON meal_entries(meal_id, log_date);
 
 -- Vekt: én registrering per bruker per dag (overskrives ved ny registrering samme dag)
 CREATE TABLE weight_entries (
-    id         UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id         UUID NOT NULL DEFAULT gen_random_uuid(),
     user_id    UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     log_date   DATE NOT NULL,
     weight_kg  NUMERIC(5,2) NOT NULL,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, log_date),
     UNIQUE(user_id, log_date)
-);
+) PARTITION BY RANGE (log_date);
 
 CREATE INDEX idx_weight_entries_user_date ON weight_entries(user_id, log_date);
 
+-- Oppretter månedspartisjoner (<tabell>_YYYY_MM) for meals, meal_entries og weight_entries
+-- fra og med måneden til p_from til og med måneden til p_to. Idempotent; advisory lock
+-- hindrer at to prosesser oppretter samme partisjon samtidig. Returnerer antall nye partisjoner.
+CREATE OR REPLACE FUNCTION ensure_log_partitions(p_from DATE, p_to DATE) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+    t       TEXT;
+    m       DATE;
+    part    TEXT;
+    created INT := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_log_partitions'));
+    FOREACH t IN ARRAY ARRAY['meals', 'meal_entries', 'weight_entries'] LOOP
+        m := date_trunc('month', p_from)::date;
+        WHILE m <= p_to LOOP
+            part := format('%s_%s', t, to_char(m, 'YYYY_MM'));
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                    part, t, m, (m + INTERVAL '1 month')::date
+                );
+                created := created + 1;
+            END IF;
+            m := (m + INTERVAL '1 month')::date;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+-- Ny install: siste 12 måneder og 3 fram. Appen oppretter resten ved behov.
+SELECT ensure_log_partitions((CURRENT_DATE - INTERVAL '12 months')::date, (CURRENT_DATE + INTERVAL '3 months')::date);
+
 COMMENT ON TABLE weight_entries IS 'Vekt registrert dag for dag; samme dag overskriver tidligere verdi.';
 
+-- Måltidsmaler: lagret måltid (f.eks. fast frokost) som kan legges inn på en dag med ett kall
+CREATE TABLE meal_templates (
+    id         UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id    UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name       VARCHAR(255) NOT NULL,
+    time_slot  TIME,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_meal_templates_user ON meal_templates(user_id);
+
+CREATE TABLE meal_template_entries (
+    id               UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    template_id      UUID NOT NULL REFERENCES meal_templates(id) ON DELETE CASCADE,
+    food_product_id  UUID REFERENCES food_products(id) ON DELETE CASCADE,
+    recipe_id        UUID REFERENCES recipes(id) ON DELETE CASCADE,
+    amount_gram      NUMERIC(10,2),
+    portions         NUMERIC(6,2),
+    CONSTRAINT meal_template_entry_source CHECK (
+        (food_product_id IS NOT NULL AND recipe_id IS NULL AND amount_gram IS NOT NULL) OR
+        (recipe_id IS NOT NULL AND food_product_id IS NULL AND portions IS NOT NULL)
+    )
+);
+
+CREATE INDEX idx_meal_template_entries_template ON meal_template_entries(template_id);
+
+-- Brukerens mest brukte/nylige matvarer (oppdateres ved logging, leses av /api/food-products/recent).
+-- rank er "frecency" på log-skala: ln(Σ exp(t_i / τ)) over alle loggføringer, τ = 14 dager / ln 2.
+-- Siden alle bruker samme τ kan rank sammenlignes direkte og indekseres, uten periodisk nedskriving.
+CREATE OR REPLACE FUNCTION food_usage_rank(ts TIMESTAMPTZ) RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT EXTRACT(EPOCH FROM ts)::double precision / (14 * 86400 / LN(2))
+$$;
+
+CREATE TABLE user_food_usage (
+    user_id          UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    food_product_id  UUID NOT NULL REFERENCES food_products(id) ON DELETE CASCADE,
+    use_count        INTEGER NOT NULL DEFAULT 1,
+    last_used_at     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_amount_gram NUMERIC(10,2),
+    rank             DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (user_id, food_product_id)
+);
+
+CREATE INDEX idx_user_food_usage_rank ON user_food_usage(user_id, rank DESC);
+
+-- Delt cache (app/cache.py). app_cache er L2 for CACHE_BACKEND=postgres: UNLOGGED (ingen WAL,
+-- tømmes ved krasj – greit for cache). cache_versions: versjon per navnerom; cache_bump øker
+-- den og varsler alle workere (NOTIFY hercules_cache) ved commit.
+CREATE UNLOGGED TABLE app_cache (
+    key        TEXT PRIMARY KEY,
+    value      BYTEA NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX idx_app_cache_expires ON app_cache(expires_at);
+
+CREATE TABLE cache_versions (
+    namespace TEXT PRIMARY KEY,
+    version   BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION cache_bump(p_namespace TEXT) RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v BIGINT;
+BEGIN
+    INSERT INTO cache_versions (namespace, version) VALUES (p_namespace, 1)
+    ON CONFLICT (namespace) DO UPDATE SET version = cache_versions.version + 1
+    RETURNING version INTO v;
+    PERFORM pg_notify('hercules_cache', json_build_object('ns', p_namespace, 'v', v)::text);
+    RETURN v;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION cache_invalidate_key(p_namespace TEXT, p_key TEXT) RETURNS VOID
+LANGUAGE sql AS $$
+    SELECT pg_notify('hercules_cache', json_build_object('ns', p_namespace, 'key', p_key)::text)
+$$;
+
+-- Alle endringer i users (uansett kodevei) invaliderer /api/me-profilen og coach-katalogen
+CREATE OR REPLACE FUNCTION users_cache_invalidate() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.rolle = 'kunde_og_coach' AND NEW.coach_godkjent THEN
+            PERFORM cache_bump('coaches');
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM cache_invalidate_key('me', OLD.id::text);
+        IF OLD.rolle = 'kunde_og_coach' THEN
+            PERFORM cache_bump('coaches');
+        END IF;
+    ELSE
+        IF (OLD.email, OLD.rolle, OLD.navn, OLD.coach_sokt, OLD.coach_godkjent, OLD.trial_ends_at,
+            OLD.stripe_customer_id, OLD.first_charge_done, OLD.account_blocked_at)
+           IS DISTINCT FROM
+           (NEW.email, NEW.rolle, NEW.navn, NEW.coach_sokt, NEW.coach_godkjent, NEW.trial_ends_at,
+            NEW.stripe_customer_id, NEW.first_charge_done, NEW.account_blocked_at) THEN
+            PERFORM cache_invalidate_key('me', OLD.id::text);
+        END IF;
+        IF (OLD.rolle = 'kunde_og_coach' OR NEW.rolle = 'kunde_og_coach')
+           AND (OLD.email, OLD.rolle, OLD.navn, OLD.coach_godkjent, OLD.coach_beskrivelse,
+                OLD.coach_spesialiseringer, OLD.coach_bilde, OLD.coach_program_lengder)
+               IS DISTINCT FROM
+               (NEW.email, NEW.rolle, NEW.navn, NEW.coach_godkjent, NEW.coach_beskrivelse,
+                NEW.coach_spesialiseringer, NEW.coach_bilde, NEW.coach_program_lengder) THEN
+            PERFORM cache_bump('coaches');
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER users_cache_invalidate
+    AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION users_cache_invalidate();
+
+-- Planlagte jobber (app/scheduler.py): én rad per jobb, status fra siste kjøring
+CREATE TABLE scheduled_jobs (
+    name              TEXT PRIMARY KEY,
+    interval_seconds  INTEGER NOT NULL,
+    next_run_at       TIMESTAMPTZ NOT NULL,
+    last_started_at   TIMESTAMPTZ,
+    last_finished_at  TIMESTAMPTZ,
+    last_duration_ms  DOUBLE PRECISION,
+    last_status       VARCHAR(10),
+    last_error        TEXT,
+    last_result       JSONB,
+    last_host         TEXT,
+    run_count         INTEGER NOT NULL DEFAULT 0
+);
+
+-- Dataeksport (GDPR) bygget i bakgrunnen (app/export.py): zip i objektlagring under exports/,
+-- slettes av jobben export-cleanup etter expires_at. Maks én pågående eksport per bruker.
+CREATE TABLE data_exports (
+    id           UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id      UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status       VARCHAR(10) NOT NULL DEFAULT 'pending',
+    storage_key  TEXT,
+    size_bytes   BIGINT,
+    error        TEXT,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at  TIMESTAMPTZ,
+    expires_at   TIMESTAMPTZ
+);
+
+CREATE INDEX idx_data_exports_user ON data_exports(user_id, created_at DESC);
+CREATE UNIQUE INDEX idx_data_exports_pending ON data_exports(user_id) WHERE status = 'pending';
+CREATE INDEX idx_data_exports_expires ON data_exports(expires_at) WHERE expires_at IS NOT NULL;
+
+-- Aktivitet fra klokker/helseapper (app/activity.py). Treningsøkter (lavfrekvent) én rad per
+-- sample; samme kilde, type og starttid er samme sample (primærnøkkelen dedupliserer).
+-- Skritt og puls ligger i activity_chunks.
+CREATE TABLE activity_samples (
+    user_id     UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind        VARCHAR(20) NOT NULL,
+    started_at  TIMESTAMPTZ NOT NULL,
+    source      VARCHAR(20) NOT NULL,
+    ended_at    TIMESTAMPTZ,
+    value       DOUBLE PRECISION NOT NULL,
+    activity    VARCHAR(40),
+    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, kind, started_at, source)
+);
+
+COMMENT ON COLUMN activity_samples.kind IS 'workout (value = kcal, activity = type økt). Skritt/puls: activity_chunks';
+
+-- Per bruker og kilde: siste sample (synk-anker for mobilappen) og siste opplasting
+CREATE TABLE activity_sources (
+    user_id        UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    source         VARCHAR(20) NOT NULL,
+    last_sample_at TIMESTAMPTZ,
+    last_upload_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, source)
+);
+
+-- Skritt og puls (høyfrekvent) lagres komprimert per bruker, dag, type og kilde (app/timeseries.py):
+-- data = zlib(delta-kodede sekunder fra lokal midnatt | varigheter | verdier), n = antall samples.
+-- Allerede komprimert, så EXTERNAL (ingen ny pglz-komprimering ved TOAST).
+CREATE TABLE activity_chunks (
+    user_id    UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day        DATE NOT NULL,
+    kind       VARCHAR(20) NOT NULL,
+    source     VARCHAR(20) NOT NULL,
+    n          INTEGER NOT NULL,
+    data       BYTEA NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, day, kind, source)
+);
+ALTER TABLE activity_chunks ALTER COLUMN data SET STORAGE EXTERNAL;
+
+-- Dagsaggregat (Analyse, /api/activity/daily), oppdateres for berørte dager ved hver opplasting
+CREATE TABLE activity_daily (
+    user_id         UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day             DATE NOT NULL,
+    steps           INTEGER NOT NULL DEFAULT 0,
+    hr_avg          REAL,
+    hr_min          REAL,
+    hr_max          REAL,
+    hr_samples      INTEGER NOT NULL DEFAULT 0,
+    workouts        INTEGER NOT NULL DEFAULT 0,
+    workout_kcal    DOUBLE PRECISION NOT NULL DEFAULT 0,
+    workout_minutes DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, day)
+);
+
+-- Estimert energiforbruk (TDEE) per bruker fra inntak og vekttrend, skrevet av jobben
+-- energy-estimates (app/energy.py) og vist i /api/me. Brukere uten nok data har ingen rad.
+CREATE TABLE energy_estimates (
+    user_id              UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    window_start         DATE NOT NULL,
+    window_end           DATE NOT NULL,
+    intake_days          INTEGER NOT NULL,
+    weight_days          INTEGER NOT NULL,
+    intake_kcal          INTEGER NOT NULL,
+    weight_trend_kg_week NUMERIC(5,2) NOT NULL,
+    tdee_kcal            INTEGER NOT NULL,
+    tdee_error_kcal      INTEGER NOT NULL,
+    target_lose_kcal     INTEGER NOT NULL,
+    target_gain_kcal     INTEGER NOT NULL,
+    computed_at          TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON COLUMN energy_estimates.tdee_error_kcal IS 'Usikkerhet (1 standardavvik) fra vekttrend og variasjon i inntak';
+
 -- Noen vanlige matvarer (per 100 g)
 INSERT INTO food_products (name, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100) VALUES
 ('Havregryn', 389, 16.9, 66.3, 6.9),
@@ -0,0 +1,126 @@
+-- Migrering: meals, meal_entries og weight_entries → månedspartisjonert på log_date.
+-- For eksisterende databaser opprettet med init.sql fra før partisjoneringen.
+-- Nye installasjoner trenger ikke denne (init.sql lager partisjonerte tabeller direkte).
+--
+-- Kjør i vedlikeholdsvindu (tabellene låses under kopiering):
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/001_partition_log_tables.sql
+--
+-- Hele migreringen er én transaksjon: feiler noe, står de gamle tabellene urørt.
+
+BEGIN;
+
+-- 1) Flytt gamle tabeller (og indeks-/constraint-navn, som er globale i schemaet) til side
+ALTER TABLE meal_entries RENAME TO meal_entries_old;
+ALTER TABLE meals RENAME TO meals_old;
+ALTER TABLE weight_entries RENAME TO weight_entries_old;
+ALTER INDEX meal_entries_pkey RENAME TO meal_entries_old_pkey;
+ALTER INDEX meals_pkey RENAME TO meals_old_pkey;
+ALTER INDEX weight_entries_pkey RENAME TO weight_entries_old_pkey;
+ALTER INDEX weight_entries_user_id_log_date_key RENAME TO weight_entries_old_user_id_log_date_key;
+ALTER INDEX idx_meal_entries_meal RENAME TO idx_meal_entries_old_meal;
+ALTER INDEX idx_meals_user_date RENAME TO idx_meals_old_user_date;
+ALTER INDEX idx_weight_entries_user_date RENAME TO idx_weight_entries_old_user_date;
+
+-- 2) Nye partisjonerte tabeller (samme definisjon som i init.sql)
+CREATE TABLE meals (
+    id        UUID NOT NULL DEFAULT gen_random_uuid(),
+    user_id   UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    log_date  DATE NOT NULL,
+    name      VARCHAR(255),
+    time_slot TIME,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, log_date)
+) PARTITION BY RANGE (log_date);
+
+CREATE INDEX idx_meals_user_date ON meals(user_id, log_date);
+
+CREATE TABLE meal_entries (
+    id               UUID NOT NULL DEFAULT gen_random_uuid(),
+    meal_id          UUID NOT NULL,
+    log_date         DATE NOT NULL,
+    food_product_id  UUID REFERENCES food_products(id) ON DELETE CASCADE,
+    recipe_id        UUID REFERENCES recipes(id) ON DELETE CASCADE,
+    amount_gram      NUMERIC(10,2),
+    portions         NUMERIC(6,2),
+    PRIMARY KEY (id, log_date),
+    FOREIGN KEY (meal_id, log_date) REFERENCES meals(id, log_date) ON DELETE CASCADE,
+    CONSTRAINT meal_entry_source CHECK (
+        (food_product_id IS NOT NULL AND recipe_id IS NULL AND amount_gram IS NOT NULL) OR
+        (recipe_id IS NOT NULL AND food_product_id IS NULL AND portions IS NOT NULL)
+    )
+) PARTITION BY RANGE (log_date);
+
+CREATE INDEX idx_meal_entries_meal ON meal_entries(meal_id, log_date);
+
+CREATE TABLE weight_entries (
+    id         UUID NOT NULL DEFAULT gen_random_uuid(),
+    user_id    UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    log_date   DATE NOT NULL,
+    weight_kg  NUMERIC(5,2) NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, log_date),
+    UNIQUE(user_id, log_date)
+) PARTITION BY RANGE (log_date);
+
+CREATE INDEX idx_weight_entries_user_date ON weight_entries(user_id, log_date);
+
+COMMENT ON TABLE weight_entries IS 'Vekt registrert dag for dag; samme dag overskriver tidligere verdi.';
+
+CREATE OR REPLACE FUNCTION ensure_log_partitions(p_from DATE, p_to DATE) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+    t       TEXT;
+    m       DATE;
+    part    TEXT;
+    created INT := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_log_partitions'));
+    FOREACH t IN ARRAY ARRAY['meals', 'meal_entries', 'weight_entries'] LOOP
+        m := date_trunc('month', p_from)::date;
+        WHILE m <= p_to LOOP
+            part := format('%s_%s', t, to_char(m, 'YYYY_MM'));
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                    part, t, m, (m + INTERVAL '1 month')::date
+                );
+                created := created + 1;
+            END IF;
+            m := (m + INTERVAL '1 month')::date;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+-- 3) Partisjoner for hver måned som har data, pluss inneværende og 3 måneder fram
+SELECT ensure_log_partitions(month, month)
+FROM (
+    SELECT DISTINCT date_trunc('month', log_date)::date AS month FROM meals_old
+    UNION
+    SELECT DISTINCT date_trunc('month', log_date)::date FROM weight_entries_old
+) months;
+SELECT ensure_log_partitions(CURRENT_DATE, (CURRENT_DATE + INTERVAL '3 months')::date);
+
+-- 4) Kopier data. meal_entries får måltidets log_date.
+INSERT INTO meals (id, user_id, log_date, name, time_slot, created_at)
+SELECT id, user_id, log_date, name, time_slot, created_at FROM meals_old;
+
+INSERT INTO meal_entries (id, meal_id, log_date, food_product_id, recipe_id, amount_gram, portions)
+SELECT e.id, e.meal_id, m.log_date, e.food_product_id, e.recipe_id, e.amount_gram, e.portions
+FROM meal_entries_old e
+JOIN meals_old m ON m.id = e.meal_id;
+
+INSERT INTO weight_entries (id, user_id, log_date, weight_kg, created_at)
+SELECT id, user_id, log_date, weight_kg, created_at FROM weight_entries_old;
+
+-- 5) Rydd opp
+DROP TABLE meal_entries_old;
+DROP TABLE meals_old;
+DROP TABLE weight_entries_old;
+
+COMMIT;
+
+ANALYZE meals;
+ANALYZE meal_entries;
+ANALYZE weight_entries;
@@ -0,0 +1,24 @@
+-- Migrering: oppfrisking av eksterne matvarer (app/product_refresh.py) – kolonner for hentetid
+-- og skann. Må kjøres før 002 (indeksen for bildespeiling bruker scan_count).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/001a_food_product_refresh.sql
+
+BEGIN;
+
+ALTER TABLE food_products ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMPTZ;
+ALTER TABLE food_products ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMPTZ;
+ALTER TABLE food_products ADD COLUMN IF NOT EXISTS scan_count INT NOT NULL DEFAULT 0;
+ALTER TABLE food_products ADD COLUMN IF NOT EXISTS last_scanned_at TIMESTAMPTZ;
+
+-- Eksterne produkter fra før kolonnene fantes regnes som hentet da de ble opprettet
+UPDATE food_products SET fetched_at = created_at
+WHERE fetched_at IS NULL AND source IN ('openfoodfacts', 'nutritionix', 'edamam');
+
+-- Bakgrunnsoppfrisking: mest skannede eksterne produkter først
+CREATE INDEX IF NOT EXISTS idx_food_products_refresh ON food_products(scan_count DESC, COALESCE(refreshed_at, fetched_at))
+  WHERE user_id IS NULL AND source IN ('openfoodfacts', 'nutritionix', 'edamam');
+
+COMMENT ON COLUMN food_products.fetched_at IS 'Når data sist ble hentet fra ekstern kilde (NULL = lokal/bruker)';
+COMMENT ON COLUMN food_products.refreshed_at IS 'Siste revalidering mot ekstern kilde (bakgrunnsjobb, app/product_refresh.py)';
+COMMENT ON COLUMN food_products.scan_count IS 'Antall strekkode-oppslag som traff produktet; styrer rekkefølge for oppfrisking';
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Migrering: speiling av eksterne produktbilder (app/image_mirror.py).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/002_food_product_image_mirror.sql
+
+BEGIN;
+
+ALTER TABLE food_products ADD COLUMN IF NOT EXISTS image_source_url TEXT;
+ALTER TABLE food_products ADD COLUMN IF NOT EXISTS image_mirror_attempted_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN food_products.image_source_url IS 'Opprinnelig eksternt bilde-URL når image_url er speilet til /api/media (app/image_mirror.py)';
+
+CREATE INDEX IF NOT EXISTS idx_food_products_image_mirror ON food_products(scan_count DESC) WHERE image_url LIKE 'http%';
+
+CREATE TABLE IF NOT EXISTS media_images (
+    content_hash CHAR(64) PRIMARY KEY,
+    storage_key  TEXT NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+COMMIT;
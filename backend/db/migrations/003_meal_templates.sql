@@ -0,0 +1,31 @@
+-- Migrering: måltidsmaler (POST /api/meal-templates, /api/meal-templates/{id}/apply).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/003_meal_templates.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS meal_templates (
+    id         UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id    UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name       VARCHAR(255) NOT NULL,
+    time_slot  TIME,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_meal_templates_user ON meal_templates(user_id);
+
+CREATE TABLE IF NOT EXISTS meal_template_entries (
+    id               UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    template_id      UUID NOT NULL REFERENCES meal_templates(id) ON DELETE CASCADE,
+    food_product_id  UUID REFERENCES food_products(id) ON DELETE CASCADE,
+    recipe_id        UUID REFERENCES recipes(id) ON DELETE CASCADE,
+    amount_gram      NUMERIC(10,2),
+    portions         NUMERIC(6,2),
+    CONSTRAINT meal_template_entry_source CHECK (
+        (food_product_id IS NOT NULL AND recipe_id IS NULL AND amount_gram IS NOT NULL) OR
+        (recipe_id IS NOT NULL AND food_product_id IS NULL AND portions IS NOT NULL)
+    )
+);
+
+CREATE INDEX IF NOT EXISTS idx_meal_template_entries_template ON meal_template_entries(template_id);
+
+COMMIT;
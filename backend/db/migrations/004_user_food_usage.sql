@@ -0,0 +1,43 @@
+-- Migrering: user_food_usage (nylig/mest brukte matvarer per bruker) + utfylling fra historikk.
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/004_user_food_usage.sql
+
+BEGIN;
+
+-- Brukerens mest brukte/nylige matvarer (oppdateres ved logging, leses av /api/food-products/recent).
+-- rank er "frecency" på log-skala: ln(Σ exp(t_i / τ)) over alle loggføringer, τ = 14 dager / ln 2.
+-- Siden alle bruker samme τ kan rank sammenlignes direkte og indekseres, uten periodisk nedskriving.
+CREATE OR REPLACE FUNCTION food_usage_rank(ts TIMESTAMPTZ) RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT EXTRACT(EPOCH FROM ts)::double precision / (14 * 86400 / LN(2))
+$$;
+
+CREATE TABLE IF NOT EXISTS user_food_usage (
+    user_id          UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    food_product_id  UUID NOT NULL REFERENCES food_products(id) ON DELETE CASCADE,
+    use_count        INTEGER NOT NULL DEFAULT 1,
+    last_used_at     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_amount_gram NUMERIC(10,2),
+    rank             DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (user_id, food_product_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_food_usage_rank ON user_food_usage(user_id, rank DESC);
+
+-- Historikk: én loggføring per linje, tidspunkt = måltidets created_at.
+-- rank = max + ln(Σ exp(r - max)) for numerisk stabilitet.
+INSERT INTO user_food_usage (user_id, food_product_id, use_count, last_used_at, last_amount_gram, rank)
+SELECT user_id, food_product_id, COUNT(*), MAX(created_at),
+       (ARRAY_AGG(amount_gram ORDER BY created_at DESC))[1],
+       MAX(max_r) + LN(SUM(EXP(r - max_r)))
+FROM (
+    SELECT m.user_id, me.food_product_id, me.amount_gram, m.created_at,
+           food_usage_rank(m.created_at) AS r,
+           MAX(food_usage_rank(m.created_at)) OVER (PARTITION BY m.user_id, me.food_product_id) AS max_r
+    FROM meal_entries me
+    JOIN meals m ON m.id = me.meal_id AND m.log_date = me.log_date
+    WHERE me.food_product_id IS NOT NULL
+) h
+GROUP BY user_id, food_product_id
+ON CONFLICT (user_id, food_product_id) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,79 @@
+-- Migrering: delt cache (app_cache, cache_versions) og invalidering fra users.
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/005_cache.sql
+
+BEGIN;
+
+-- Delt cache (app/cache.py). app_cache er L2 for CACHE_BACKEND=postgres: UNLOGGED (ingen WAL,
+-- tømmes ved krasj – greit for cache). cache_versions: versjon per navnerom; cache_bump øker
+-- den og varsler alle workere (NOTIFY hercules_cache) ved commit.
+CREATE UNLOGGED TABLE IF NOT EXISTS app_cache (
+    key        TEXT PRIMARY KEY,
+    value      BYTEA NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_app_cache_expires ON app_cache(expires_at);
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    namespace TEXT PRIMARY KEY,
+    version   BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION cache_bump(p_namespace TEXT) RETURNS BIGINT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v BIGINT;
+BEGIN
+    INSERT INTO cache_versions (namespace, version) VALUES (p_namespace, 1)
+    ON CONFLICT (namespace) DO UPDATE SET version = cache_versions.version + 1
+    RETURNING version INTO v;
+    PERFORM pg_notify('hercules_cache', json_build_object('ns', p_namespace, 'v', v)::text);
+    RETURN v;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION cache_invalidate_key(p_namespace TEXT, p_key TEXT) RETURNS VOID
+LANGUAGE sql AS $$
+    SELECT pg_notify('hercules_cache', json_build_object('ns', p_namespace, 'key', p_key)::text)
+$$;
+
+-- Alle endringer i users (uansett kodevei) invaliderer /api/me-profilen og coach-katalogen
+CREATE OR REPLACE FUNCTION users_cache_invalidate() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.rolle = 'kunde_og_coach' AND NEW.coach_godkjent THEN
+            PERFORM cache_bump('coaches');
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM cache_invalidate_key('me', OLD.id::text);
+        IF OLD.rolle = 'kunde_og_coach' THEN
+            PERFORM cache_bump('coaches');
+        END IF;
+    ELSE
+        IF (OLD.email, OLD.rolle, OLD.navn, OLD.coach_sokt, OLD.coach_godkjent, OLD.trial_ends_at,
+            OLD.stripe_customer_id, OLD.first_charge_done, OLD.account_blocked_at)
+           IS DISTINCT FROM
+           (NEW.email, NEW.rolle, NEW.navn, NEW.coach_sokt, NEW.coach_godkjent, NEW.trial_ends_at,
+            NEW.stripe_customer_id, NEW.first_charge_done, NEW.account_blocked_at) THEN
+            PERFORM cache_invalidate_key('me', OLD.id::text);
+        END IF;
+        IF (OLD.rolle = 'kunde_og_coach' OR NEW.rolle = 'kunde_og_coach')
+           AND (OLD.email, OLD.rolle, OLD.navn, OLD.coach_godkjent, OLD.coach_beskrivelse,
+                OLD.coach_spesialiseringer, OLD.coach_bilde, OLD.coach_program_lengder)
+               IS DISTINCT FROM
+               (NEW.email, NEW.rolle, NEW.navn, NEW.coach_godkjent, NEW.coach_beskrivelse,
+                NEW.coach_spesialiseringer, NEW.coach_bilde, NEW.coach_program_lengder) THEN
+            PERFORM cache_bump('coaches');
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS users_cache_invalidate ON users;
+CREATE TRIGGER users_cache_invalidate
+    AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION users_cache_invalidate();
+
+COMMIT;
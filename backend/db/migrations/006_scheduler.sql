@@ -0,0 +1,29 @@
+-- Migrering: planlagte jobber i appen (app/scheduler.py).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/006_scheduler.sql
+
+BEGIN;
+
+-- Planlagte jobber (app/scheduler.py): én rad per jobb, status fra siste kjøring
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name              TEXT PRIMARY KEY,
+    interval_seconds  INTEGER NOT NULL,
+    next_run_at       TIMESTAMPTZ NOT NULL,
+    last_started_at   TIMESTAMPTZ,
+    last_finished_at  TIMESTAMPTZ,
+    last_duration_ms  DOUBLE PRECISION,
+    last_status       VARCHAR(10),
+    last_error        TEXT,
+    last_result       JSONB,
+    last_host         TEXT,
+    run_count         INTEGER NOT NULL DEFAULT 0
+);
+
+ALTER TABLE kunde_coach ADD COLUMN IF NOT EXISTS slutt_varslet BOOLEAN NOT NULL DEFAULT FALSE;
+-- Allerede utløpte tilganger skal ikke varsles på nytt
+UPDATE kunde_coach SET slutt_varslet = TRUE WHERE slutt_dato <= NOW() AND slutt_varslet = FALSE;
+CREATE INDEX IF NOT EXISTS idx_kunde_coach_slutt_varsel ON kunde_coach(slutt_dato) WHERE slutt_varslet = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_users_trial_charge ON users(trial_ends_at)
+  WHERE first_charge_done = FALSE AND account_blocked_at IS NULL AND next_payment_retry_at IS NULL;
+
+COMMIT;
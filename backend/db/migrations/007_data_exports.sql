@@ -0,0 +1,24 @@
+-- Migrering: dataeksport (GDPR) bygget i bakgrunnen, app/export.py.
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/007_data_exports.sql
+
+BEGIN;
+
+-- Dataeksport (GDPR) bygget i bakgrunnen (app/export.py): zip i objektlagring under exports/,
+-- slettes av jobben export-cleanup etter expires_at. Maks én pågående eksport per bruker.
+CREATE TABLE IF NOT EXISTS data_exports (
+    id           UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id      UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status       VARCHAR(10) NOT NULL DEFAULT 'pending',
+    storage_key  TEXT,
+    size_bytes   BIGINT,
+    error        TEXT,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at  TIMESTAMPTZ,
+    expires_at   TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_data_exports_user ON data_exports(user_id, created_at DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_data_exports_pending ON data_exports(user_id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_data_exports_expires ON data_exports(expires_at) WHERE expires_at IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- Migrering: aktivitetsdata fra klokker/helseapper (app/activity.py).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/008_activity_samples.sql
+
+BEGIN;
+
+-- Aktivitet fra klokker/helseapper (app/activity.py). Én rad per sample; samme kilde, type og
+-- starttid er samme sample (primærnøkkelen dedupliserer ved ny opplasting).
+CREATE TABLE IF NOT EXISTS activity_samples (
+    user_id     UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    kind        VARCHAR(20) NOT NULL,
+    started_at  TIMESTAMPTZ NOT NULL,
+    source      VARCHAR(20) NOT NULL,
+    ended_at    TIMESTAMPTZ,
+    value       DOUBLE PRECISION NOT NULL,
+    activity    VARCHAR(40),
+    received_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, kind, started_at, source)
+);
+
+COMMENT ON COLUMN activity_samples.kind IS 'steps (antall) | heart_rate (slag/min) | workout (kcal, activity = type økt)';
+
+-- Per bruker og kilde: siste sample (synk-anker for mobilappen) og siste opplasting
+CREATE TABLE IF NOT EXISTS activity_sources (
+    user_id        UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    source         VARCHAR(20) NOT NULL,
+    last_sample_at TIMESTAMPTZ,
+    last_upload_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, source)
+);
+
+COMMIT;
@@ -0,0 +1,41 @@
+-- Migrering: kompakt lagring av skritt/puls og dagsaggregater (app/timeseries.py).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/009_activity_chunks.sql
+-- Deretter (fra backend/) flyttes skritt/puls lagret som rader til dagsbiter:
+--   python -m app.activity compact
+
+BEGIN;
+
+-- Skritt og puls (høyfrekvent) lagres komprimert per bruker, dag, type og kilde (app/timeseries.py):
+-- data = zlib(delta-kodede sekunder fra lokal midnatt | varigheter | verdier), n = antall samples.
+-- Allerede komprimert, så EXTERNAL (ingen ny pglz-komprimering ved TOAST).
+CREATE TABLE IF NOT EXISTS activity_chunks (
+    user_id    UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day        DATE NOT NULL,
+    kind       VARCHAR(20) NOT NULL,
+    source     VARCHAR(20) NOT NULL,
+    n          INTEGER NOT NULL,
+    data       BYTEA NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, day, kind, source)
+);
+ALTER TABLE activity_chunks ALTER COLUMN data SET STORAGE EXTERNAL;
+
+-- Dagsaggregat (Analyse, /api/activity/daily), oppdateres for berørte dager ved hver opplasting
+CREATE TABLE IF NOT EXISTS activity_daily (
+    user_id         UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day             DATE NOT NULL,
+    steps           INTEGER NOT NULL DEFAULT 0,
+    hr_avg          REAL,
+    hr_min          REAL,
+    hr_max          REAL,
+    hr_samples      INTEGER NOT NULL DEFAULT 0,
+    workouts        INTEGER NOT NULL DEFAULT 0,
+    workout_kcal    DOUBLE PRECISION NOT NULL DEFAULT 0,
+    workout_minutes DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, day)
+);
+
+COMMENT ON COLUMN activity_samples.kind IS 'workout (value = kcal, activity = type økt). Skritt/puls: activity_chunks';
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- Migrering: tabell for estimert energiforbruk (jobben energy-estimates, app/energy.py).
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/010_energy_estimates.sql
+
+BEGIN;
+
+-- Estimert energiforbruk (TDEE) per bruker fra inntak og vekttrend, skrevet av jobben
+-- energy-estimates (app/energy.py) og vist i /api/me. Brukere uten nok data har ingen rad.
+CREATE TABLE IF NOT EXISTS energy_estimates (
+    user_id              UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    window_start         DATE NOT NULL,
+    window_end           DATE NOT NULL,
+    intake_days          INTEGER NOT NULL,
+    weight_days          INTEGER NOT NULL,
+    intake_kcal          INTEGER NOT NULL,
+    weight_trend_kg_week NUMERIC(5,2) NOT NULL,
+    tdee_kcal            INTEGER NOT NULL,
+    tdee_error_kcal      INTEGER NOT NULL,
+    target_lose_kcal     INTEGER NOT NULL,
+    target_gain_kcal     INTEGER NOT NULL,
+    computed_at          TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON COLUMN energy_estimates.tdee_error_kcal IS 'Usikkerhet (1 standardavvik) fra vekttrend og variasjon i inntak';
+
+COMMIT;
@@ -0,0 +1,127 @@
+-- Migrering: kanoniske strekkoder (GTIN) i food_products, se _normalize_barcode i app/food_lookup.py.
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/011_canonical_barcodes.sql
+--
+-- Samme vare lagret som UPC-A, EAN-13 med ledende 0 og GTIN-14 flettes til én rad per eier:
+-- referanser (måltider, oppskrifter, maler, brukshistorikk) flyttes til raden som beholdes
+-- (samme vare to ganger i én oppskrift blir én ingrediens med summerte gram),
+-- scan_count summeres, og duplikatene slettes. Deretter får én rad per vare den kanoniske
+-- strekkoden. Rader med ugyldig strekkode (feil lengde/kontrollsiffer) røres ikke. Varianter
+-- som eies av ulike brukere (eller global + egen) flettes ikke, så brukerens egne
+-- næringsverdier beholdes – oppslag prøver alle skrivemåter og finner dem fortsatt.
+
+BEGIN;
+
+-- Samme regel som _normalize_barcode: NULL ved ugyldig, ellers ledende nuller fjernet
+-- ned til EAN-13 (EAN-8 for 000000-prefiks i GTIN-14)
+CREATE FUNCTION pg_temp.gtin_canonical(code TEXT) RETURNS TEXT
+LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+    d   TEXT := regexp_replace(code, '\s', '', 'g');
+    s   INT := 0;
+    g14 TEXT;
+BEGIN
+    IF d !~ '^[0-9]+$' OR length(d) NOT IN (8, 12, 13, 14) THEN
+        RETURN NULL;
+    END IF;
+    -- Kontrollsiffer: vekt 3 og 1 vekselvis fra høyre, sifferet før kontrollsifferet har vekt 3
+    FOR i IN 1 .. length(d) - 1 LOOP
+        s := s + substr(d, length(d) - i, 1)::INT * CASE WHEN i % 2 = 1 THEN 3 ELSE 1 END;
+    END LOOP;
+    IF (10 - s % 10) % 10 <> right(d, 1)::INT THEN
+        RETURN NULL;
+    END IF;
+    g14 := lpad(d, 14, '0');
+    IF left(g14, 6) = '000000' THEN
+        RETURN right(g14, 8);
+    ELSIF left(g14, 1) = '0' THEN
+        RETURN right(g14, 13);
+    END IF;
+    RETURN g14;
+END;
+$$;
+
+CREATE TEMP TABLE barcode_canon ON COMMIT DROP AS
+SELECT id, user_id, barcode, pg_temp.gtin_canonical(barcode) AS canonical, scan_count, created_at
+FROM food_products
+WHERE barcode IS NOT NULL AND barcode <> '';
+DELETE FROM barcode_canon WHERE canonical IS NULL;
+
+-- Én rad beholdes per (vare, eier): helst den som allerede er kanonisk, så mest skannet, så eldst
+CREATE TEMP TABLE barcode_merge ON COMMIT DROP AS
+SELECT id AS old_id, first_value(id) OVER w AS new_id
+FROM barcode_canon
+WINDOW w AS (PARTITION BY canonical, user_id ORDER BY barcode = canonical DESC, scan_count DESC, created_at, id);
+DELETE FROM barcode_merge WHERE old_id = new_id;
+
+UPDATE meal_entries me SET food_product_id = m.new_id
+FROM barcode_merge m WHERE me.food_product_id = m.old_id;
+-- Oppskrifter har UNIQUE(recipe_id, food_product_id): varianter av samme vare i én oppskrift
+-- slås først sammen til én rad med summerte gram (helst raden som alt peker på den som
+-- beholdes), resten slettes – ellers stopper flyttingen under på unik-indeksen
+CREATE TEMP TABLE ingredient_merged ON COMMIT DROP AS
+SELECT ri.id,
+       SUM(ri.grams) OVER g AS grams,
+       first_value(ri.id) OVER (g ORDER BY m.new_id IS NULL DESC, ri.id) AS keep_id
+FROM recipe_ingredients ri
+LEFT JOIN barcode_merge m ON m.old_id = ri.food_product_id
+WHERE ri.food_product_id IN (SELECT old_id FROM barcode_merge UNION SELECT new_id FROM barcode_merge)
+WINDOW g AS (PARTITION BY ri.recipe_id, COALESCE(m.new_id, ri.food_product_id));
+DELETE FROM recipe_ingredients ri
+USING ingredient_merged x WHERE ri.id = x.id AND x.id <> x.keep_id;
+UPDATE recipe_ingredients ri SET grams = x.grams
+FROM ingredient_merged x WHERE ri.id = x.id AND x.id = x.keep_id AND ri.grams <> x.grams;
+UPDATE recipe_ingredients ri SET food_product_id = m.new_id
+FROM barcode_merge m WHERE ri.food_product_id = m.old_id;
+UPDATE meal_template_entries te SET food_product_id = m.new_id
+FROM barcode_merge m WHERE te.food_product_id = m.old_id;
+
+-- Brukshistorikk: én rad per (bruker, matvare). rank er ln(Σ exp(…)), så sammenslåing er
+-- log-sum-exp av radene (se food_usage_rank i init.sql)
+CREATE TEMP TABLE usage_merged ON COMMIT DROP AS
+SELECT user_id, food_product_id, SUM(use_count) AS use_count, MAX(last_used_at) AS last_used_at,
+       (array_agg(last_amount_gram ORDER BY last_used_at DESC))[1] AS last_amount_gram,
+       MAX(max_rank) + LN(SUM(EXP(rank - max_rank))) AS rank
+FROM (
+    SELECT u.user_id, COALESCE(m.new_id, u.food_product_id) AS food_product_id, u.use_count, u.last_used_at,
+           u.last_amount_gram, u.rank,
+           MAX(u.rank) OVER (PARTITION BY u.user_id, COALESCE(m.new_id, u.food_product_id)) AS max_rank
+    FROM user_food_usage u
+    LEFT JOIN barcode_merge m ON m.old_id = u.food_product_id
+    WHERE u.food_product_id IN (SELECT old_id FROM barcode_merge UNION SELECT new_id FROM barcode_merge)
+) u
+GROUP BY user_id, food_product_id;
+DELETE FROM user_food_usage
+WHERE food_product_id IN (SELECT old_id FROM barcode_merge UNION SELECT new_id FROM barcode_merge);
+INSERT INTO user_food_usage (user_id, food_product_id, use_count, last_used_at, last_amount_gram, rank)
+SELECT user_id, food_product_id, use_count, last_used_at, last_amount_gram, rank FROM usage_merged;
+
+UPDATE food_products fp
+SET scan_count = fp.scan_count + s.scans,
+    last_scanned_at = GREATEST(fp.last_scanned_at, s.last_scanned_at)
+FROM (
+    SELECT m.new_id, SUM(f.scan_count) AS scans, MAX(f.last_scanned_at) AS last_scanned_at
+    FROM barcode_merge m
+    JOIN food_products f ON f.id = m.old_id
+    GROUP BY m.new_id
+) s
+WHERE fp.id = s.new_id;
+
+-- Referansene er flyttet, så ON DELETE CASCADE treffer ingen måltider
+DELETE FROM food_products WHERE id IN (SELECT old_id FROM barcode_merge);
+
+-- Kanonisk strekkode på én rad per vare: den som har den fra før, ellers global før egne
+UPDATE food_products fp SET barcode = k.canonical
+FROM (
+    SELECT DISTINCT ON (c.canonical) c.id, c.canonical
+    FROM barcode_canon c
+    JOIN food_products f ON f.id = c.id
+    ORDER BY c.canonical, c.barcode = c.canonical DESC, c.user_id IS NULL DESC, c.scan_count DESC, c.created_at
+) k
+WHERE fp.id = k.id AND fp.barcode <> k.canonical;
+
+SELECT COUNT(*) AS merged_duplicates FROM barcode_merge;
+
+-- Matsøket er cachet (app/cache.py); sammenslåtte og slettede varer skal ikke vises derfra
+SELECT cache_bump('food_products');
+
+COMMIT;
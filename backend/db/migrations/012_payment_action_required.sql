@@ -0,0 +1,13 @@
+-- Migrering: flagg for betaling som venter på brukeren (3-D Secure), se _charge_expired_trials i app/main.py.
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f db/migrations/012_payment_action_required.sql
+--
+-- GET /api/me krever betaling først når jobben trial-charges har prøvd: payment_failed_at
+-- (trekket feilet) eller payment_action_required_at (banken krever bekreftelse fra brukeren).
+
+BEGIN;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS payment_action_required_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN users.payment_action_required_at IS 'Første trekk venter på bekreftelse fra brukeren (3-D Secure)';
+
+COMMIT;
@@ -0,0 +1,189 @@
+"""app/cache.py: invalidering via cache_bump/NOTIFY, single-flight og XFetch."""
+import threading
+import time
+import uuid
+
+import pytest
+
+from conftest import requires_db
+
+requires_db()
+
+from app import cache  # noqa: E402
+from app.database import get_connection, get_cursor  # noqa: E402
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture(scope="module")
+def listening(database):
+    cache.start_cache_listener()
+    assert _wait_for(lambda: cache._listening), "LISTEN-tilkoblingen kom ikke opp"
+    yield
+    cache.stop_cache_listener()
+
+
+@pytest.fixture
+def ns(listening):
+    """Eget navnerom per test, så testene ikke ser hverandres oppføringer."""
+    cache._l1.clear()
+    return f"test-{uuid.uuid4().hex[:12]}"
+
+
+class _Counter:
+    def __init__(self, value_fn=None, delay: float = 0.0):
+        self.calls = 0
+        self.delay = delay
+        self.value_fn = value_fn or (lambda n: {"n": n})
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        if self.delay:
+            time.sleep(self.delay)
+        return self.value_fn(n)
+
+
+def test_hit_after_first_compute(ns):
+    compute = _Counter()
+    assert cache.get_or_compute(ns, "k", 60, compute) == {"n": 1}
+    assert cache.get_or_compute(ns, "k", 60, compute) == {"n": 1}
+    assert compute.calls == 1
+
+
+def test_invalidate_bumps_version_and_recomputes(ns):
+    compute = _Counter()
+    cache.get_or_compute(ns, "k", 60, compute)
+    before = cache._namespace_version(ns)
+
+    cache.invalidate(ns)
+
+    assert _wait_for(lambda: cache._namespace_version(ns) > before)
+    assert cache.get_or_compute(ns, "k", 60, compute) == {"n": 2}
+    assert compute.calls == 2
+
+
+def test_invalidate_in_transaction_applies_on_commit(ns):
+    compute = _Counter()
+    cache.get_or_compute(ns, "k", 60, compute)
+    before = cache._namespace_version(ns)
+
+    with pytest.raises(RuntimeError):
+        with get_connection() as conn:
+            cache.invalidate(ns, get_cursor(conn))
+            raise RuntimeError("rollback")
+    time.sleep(0.3)
+    assert cache._namespace_version(ns) == before
+    assert cache.get_or_compute(ns, "k", 60, compute) == {"n": 1}
+
+    with get_connection() as conn:
+        cache.invalidate(ns, get_cursor(conn))
+    assert _wait_for(lambda: cache._namespace_version(ns) > before)
+    assert cache.get_or_compute(ns, "k", 60, compute) == {"n": 2}
+
+
+def test_invalidate_key_only_drops_that_key(ns):
+    a, b = _Counter(), _Counter()
+    cache.get_or_compute(ns, "a", 60, a)
+    cache.get_or_compute(ns, "b", 60, b)
+
+    cache.invalidate_key(ns, "a")
+
+    assert _wait_for(lambda: cache.get_or_compute(ns, "a", 60, a) == {"n": 2})
+    assert cache.get_or_compute(ns, "b", 60, b) == {"n": 1}
+
+
+def test_single_flight_computes_once(ns):
+    compute = _Counter(delay=0.3)
+    results = []
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        results.append(cache.get_or_compute(ns, "k", 60, compute))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert compute.calls == 1
+    assert results == [{"n": 1}] * 8
+
+
+def test_compute_overlapping_invalidation_is_not_stored(ns):
+    version = cache._namespace_version(ns)
+
+    def compute_then_invalidate(n):
+        cache.invalidate(ns)
+        assert _wait_for(lambda: cache._namespace_version(ns) > version)
+        return {"n": n}
+
+    compute = _Counter(value_fn=compute_then_invalidate)
+    assert cache.get_or_compute(ns, "k", 60, compute) == {"n": 1}
+    # Verdien ble lest før invalideringen ble sett, så den skal ikke ligge i cachen
+    assert cache._l1.get(f"{ns}:{version}:k") is None
+    assert cache._l1.get(f"{ns}:{cache._namespace_version(ns)}:k") is None
+
+
+def test_xfetch_refreshes_early_near_expiry(monkeypatch):
+    monkeypatch.setattr(cache.random, "random", lambda: 0.5)  # -ln(0.5) ≈ 0.69
+    now = time.time()
+    # Beregning på 1 s og 0,5 s igjen: 1 × 0,69 ≥ 0,5 → oppfrisk nå
+    assert cache._refresh_early({"v": 1, "d": 1.0, "x": now + 0.5})
+    # Samme beregning med 60 s igjen: ingen tidlig oppfrisking
+    assert not cache._refresh_early({"v": 1, "d": 1.0, "x": now + 60})
+
+
+def test_xfetch_serves_current_value_while_one_refreshes(ns, monkeypatch):
+    monkeypatch.setattr(cache.random, "random", lambda: 0.5)
+    compute = _Counter()
+    cache.get_or_compute(ns, "k", 60, compute)
+    full_key = f"{ns}:{cache._namespace_version(ns)}:k"
+    # Dyr verdi nær utløp: neste oppslag frisker opp tidlig, før den faktisk går ut
+    cache._l1.set(full_key, {"v": {"n": 1}, "d": 10.0, "x": time.time() + 1}, 1)
+
+    slow = _Counter(delay=0.3)
+    refresher = threading.Thread(target=lambda: cache.get_or_compute(ns, "k", 60, slow))
+    refresher.start()
+    assert _wait_for(lambda: slow.calls == 1)
+    # Mens oppfriskingen pågår, får andre den gjeldende verdien uten å beregne selv
+    other = _Counter()
+    assert cache.get_or_compute(ns, "k", 60, other) == {"n": 1}
+    assert other.calls == 0
+    refresher.join()
+    assert cache._l1.get(full_key)["v"] == {"n": 1} and cache._l1.get(full_key)["x"] > time.time() + 30
+
+
+def test_new_product_invalidates_food_search(listening):
+    from app.food_lookup import _save_product
+
+    before = cache._namespace_version("food_products")
+    barcode = f"2{uuid.uuid4().int % 10**12:012d}"
+    with get_connection() as conn:
+        row = _save_product(
+            conn,
+            name="Testvare",
+            barcode=barcode,
+            source="openfoodfacts",
+            kcal_per_100=100,
+            protein_per_100=1,
+            carbs_per_100=2,
+            fat_per_100=3,
+        )
+    try:
+        assert row["inserted"]
+        assert _wait_for(lambda: cache._namespace_version("food_products") > before)
+    finally:
+        with get_connection() as conn:
+            get_cursor(conn).execute("DELETE FROM food_products WHERE id = %s", (str(row["id"]),))
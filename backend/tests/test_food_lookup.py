@@ -0,0 +1,76 @@
+"""Strekkoder i app/food_lookup.py: kanonisk GTIN, frie koder og hvilke oppslag som går eksternt."""
+import uuid
+
+import pytest
+
+from app import food_lookup
+from app.database import get_connection, get_cursor
+from app.food_lookup import _normalize_barcode, barcode_variants, lookup_by_barcode, user_barcode
+
+
+@pytest.mark.parametrize(
+    "raw, canonical",
+    [
+        ("7038010009457", "7038010009457"),  # EAN-13
+        ("012345678905", "0012345678905"),  # UPC-A → EAN-13 med ledende 0
+        ("00012345678905", "0012345678905"),  # GTIN-14 med ledende 00
+        ("10012345678902", "10012345678902"),  # emballasjeindikator beholdes
+        ("96385074", "96385074"),  # EAN-8
+        (" 7038010009457\n", "7038010009457"),
+    ],
+)
+def test_normalize_barcode(raw, canonical):
+    assert _normalize_barcode(raw) == canonical
+
+
+@pytest.mark.parametrize("raw", ["", None, "7038010009458", "ABC-123", "12345"])
+def test_normalize_rejects_non_gtin(raw):
+    assert _normalize_barcode(raw) is None
+
+
+def test_barcode_variants_unique_and_canonical_first():
+    variants = barcode_variants("0012345678905")
+    assert variants[0] == "0012345678905"
+    assert set(variants) == {"0012345678905", "012345678905", "00012345678905"}
+    assert len(variants) == len(set(variants))
+
+
+def test_user_barcode_keeps_free_codes_but_rejects_gtin_typos():
+    assert user_barcode("012345678905") == "0012345678905"
+    assert user_barcode("  HYLLE-17 ") == "HYLLE-17"
+    assert user_barcode("12345") == "12345"
+    assert user_barcode("7038010009458") is None  # feil kontrollsiffer
+    assert user_barcode("x" * 21) is None
+    assert user_barcode("   ") is None
+
+
+@pytest.fixture
+def no_providers(monkeypatch):
+    def fail(barcode):
+        raise AssertionError(f"leverandør spurt om {barcode!r}")
+
+    for name in ("_fetch_openfoodfacts", "_fetch_nutritionix", "_fetch_edamam"):
+        monkeypatch.setattr(food_lookup, name, fail)
+
+
+def test_free_code_is_found_exactly_without_providers(database, no_providers):
+    code = f"EGEN-{uuid.uuid4().hex[:8]}"
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        cur.execute("INSERT INTO users (email, passord_hash) VALUES (%s, 'x') RETURNING id", (f"{code}@example.com",))
+        user_id = cur.fetchone()["id"]
+        cur.execute(
+            """
+            INSERT INTO food_products
+            (name, barcode, source, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100)
+            VALUES ('Egen vare', %s, 'user', %s, 100, 1, 2, 3)
+            """,
+            (code, str(user_id)),
+        )
+    try:
+        assert lookup_by_barcode(f" {code} ", user_id)["name"] == "Egen vare"
+        assert lookup_by_barcode(code.lower(), user_id) is None  # eksakt, ikke fuzzy
+        assert lookup_by_barcode(code, uuid.uuid4()) is None  # andres egne varer vises ikke
+    finally:
+        with get_connection() as conn:
+            get_cursor(conn).execute("DELETE FROM users WHERE id = %s", (str(user_id),))
@@ -0,0 +1,132 @@
+"""app/off_import.py mot en liten fast dump (tests/fixtures): parsing, mapping og upsert."""
+from pathlib import Path
+
+import pytest
+
+from app.database import get_connection, get_cursor
+from app.off_import import batched, filter_countries, map_products, read_records, run_import
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+JSONL = str(FIXTURES / "off_sample.jsonl")
+CSV = str(FIXTURES / "off_sample.csv")
+NORWAY = {"en:norway"}
+BARCODES = ["2900000000018", "2900000000032", "2900000000049", "0290000000081"]
+
+
+def _mapped(path: str, countries=NORWAY) -> list[dict | None]:
+    return list(map_products(filter_countries(read_records(path), countries)))
+
+
+def test_read_records_streams_every_line_including_broken():
+    records = list(read_records(JSONL))
+    assert len(records) == 11
+    assert records[-1] == {}
+    assert [r.get("code") for r in read_records(JSONL, skip=9)] == ["0290000000081", None]
+
+
+def test_read_records_csv_builds_nutriments():
+    brunost, knekkebrod, kj = read_records(CSV)
+    assert brunost["nutriments"] == {
+        "energy-kcal_100g": "465", "proteins_100g": "9.5", "carbohydrates_100g": "42", "fat_100g": "29",
+    }
+    assert knekkebrod["countries_tags"] == ["en:sweden"]
+    assert kj["countries_tags"] == ["en:norway", "en:sweden"]
+
+
+def test_map_keeps_valid_norwegian_products():
+    products = [p for p in _mapped(JSONL) if p]
+    assert [p["barcode"] for p in products] == BARCODES + ["0290000000081"]
+    brunost = products[0]
+    assert brunost == {
+        "name": "Brunost",
+        "barcode": "2900000000018",
+        "source": "openfoodfacts",
+        "brand": "Tine",
+        "image_url": "https://images.openfoodfacts.org/a.jpg",
+        "kcal_per_100": 465.0,
+        "protein_per_100": 9.5,
+        "carbs_per_100": 42.0,
+        "fat_per_100": 29.0,
+    }
+    assert products[1]["kcal_per_100"] == 250.0  # 1046 kJ / 4,184
+
+
+def test_map_skips_or_cleans_bad_values():
+    by_code = dict(zip((r.get("code") for r in read_records(JSONL)), _mapped(JSONL)))
+    assert by_code["2900000000025"] is None  # annet land
+    assert by_code["2900000000026"] is None  # feil kontrollsiffer
+    assert by_code["2900000000056"] is None  # får ikke plass i NUMERIC(10,2)
+    assert by_code["2900000000063"] is None  # NaN
+    assert by_code["290000000074"] is None  # product_name er ikke tekst
+    nul = by_code["2900000000049"]
+    assert nul["name"] == "Nultegn" and nul["brand"] == "Merke"
+    assert nul["protein_per_100"] == 0.0
+
+
+def test_batched_counts_discarded_records():
+    batches = list(batched(_mapped(JSONL), 4))
+    assert [n for n, _ in batches] == [4, 4, 3]
+    assert sum(len(products) for _, products in batches) == 5
+
+
+@pytest.fixture
+def clean_barcodes(database):
+    def delete():
+        with get_connection() as conn:
+            get_cursor(conn).execute("DELETE FROM food_products WHERE barcode = ANY(%s)", (BARCODES,))
+
+    delete()
+    yield
+    delete()
+
+
+def _rows() -> dict[str, dict]:
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        cur.execute(
+            "SELECT barcode, name, brand, user_id, kcal_per_100, protein_per_100 FROM food_products"
+            " WHERE barcode = ANY(%s)",
+            (BARCODES,),
+        )
+        return {r["barcode"]: r for r in cur.fetchall()}
+
+
+def test_import_upserts_and_resumes(clean_barcodes, tmp_path):
+    state_path = str(tmp_path / "state.json")
+    state = run_import(JSONL, countries=NORWAY, batch_size=4, state_path=state_path)
+    assert state["records"] == 11
+    assert state["upserted"] == 4  # UPC-A og EAN-13 av samme vare blir én rad
+
+    rows = _rows()
+    assert sorted(rows) == sorted(BARCODES)
+    assert rows["2900000000049"]["name"] == "Nultegn"
+    assert float(rows["2900000000032"]["kcal_per_100"]) == 250.0
+    assert float(rows["0290000000081"]["kcal_per_100"]) == 55.0  # siste post i dumpen vinner
+
+    again = run_import(JSONL, countries=NORWAY, batch_size=4, state_path=state_path, resume=True)
+    assert again["records"] == 11 and again["upserted"] == 4
+
+
+def test_import_never_overwrites_user_food(clean_barcodes, tmp_path):
+    with get_connection() as conn:
+        cur = get_cursor(conn)
+        cur.execute("SELECT id FROM users LIMIT 1")
+        user = cur.fetchone()
+        if user is None:
+            cur.execute(
+                "INSERT INTO users (email, passord_hash) VALUES ('off-import-test@example.com', 'x') RETURNING id"
+            )
+            user = cur.fetchone()
+        cur.execute(
+            """
+            INSERT INTO food_products
+            (name, barcode, source, user_id, kcal_per_100, protein_per_100, carbs_per_100, fat_per_100)
+            VALUES ('Min brunost', '2900000000018', 'user', %s, 1, 1, 1, 1)
+            """,
+            (str(user["id"]),),
+        )
+
+    run_import(JSONL, countries=NORWAY, batch_size=20, state_path=str(tmp_path / "state.json"))
+
+    mine = _rows()["2900000000018"]
+    assert mine["name"] == "Min brunost" and mine["user_id"] == user["id"]
@@ -0,0 +1,76 @@
+import { useEffect, useRef } from "react";
+import { useAuth } from "@/contexts/AuthContext";
+
+export type ServerEvent = {
+  type: "ready" | "resync" | "meal_logged" | "meal_deleted" | "weight_logged" | "coach_started" | "coach_ended";
+  data: Record<string, string>;
+};
+
+const RECONNECT_MS = 5000;
+
+const getApiUrl = () => {
+  if (import.meta.env.DEV) return import.meta.env.VITE_API_URL || "";
+  return "";
+};
+
+/**
+ * Abonner på /api/events (Server-Sent Events) mens komponenten er montert.
+ * "ready" kommer ved hver (gjen)oppkobling og "resync" når hendelser kan ha gått tapt –
+ * hent da data på nytt som før.
+ */
+export function useServerEvents(onEvent: (event: ServerEvent) => void) {
+  const { token } = useAuth();
+  const handler = useRef(onEvent);
+
+  useEffect(() => {
+    handler.current = onEvent;
+  }, [onEvent]);
+
+  useEffect(() => {
+    if (!token || typeof EventSource === "undefined") return;
+    let source: EventSource | null = null;
+    let retry: ReturnType<typeof setTimeout> | undefined;
+    let closed = false;
+
+    const scheduleReconnect = () => {
+      if (!closed) retry = setTimeout(connect, RECONNECT_MS);
+    };
+
+    const connect = async () => {
+      try {
+        // EventSource kan ikke sende Authorization-header, så vi henter et kortlevd token
+        const res = await fetch(`${getApiUrl()}/api/events/token`, {
+          method: "POST",
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (!res.ok) return scheduleReconnect();
+        const { token: streamToken } = await res.json();
+        if (closed) return;
+        source = new EventSource(`${getApiUrl()}/api/events?token=${encodeURIComponent(streamToken)}`);
+        source.onmessage = (e) => {
+          try {
+            handler.current(JSON.parse(e.data) as ServerEvent);
+          } catch {
+            /* ignorer ugyldig melding */
+          }
+        };
+        source.onerror = () => {
+          // Nettleseren kobler selv til igjen; er strømmen lukket (f.eks. utløpt token) gjør vi det
+          if (source?.readyState === EventSource.CLOSED) {
+            source.close();
+            scheduleReconnect();
+          }
+        };
+      } catch {
+        scheduleReconnect();
+      }
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      source?.close();
+    };
+  }, [token]);
+}
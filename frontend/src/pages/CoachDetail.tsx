@@ -11,6 +11,10 @@ const getApiUrl = () => {
   return "";
 };
 
+// Ferdigskalert WebP fra /api/media (?variant=avatar|card|full); eksterne URL-er brukes som de er
+const mediaVariant = (url: string, variant: "avatar" | "card" | "full") =>
+  url.startsWith("/api/media/") ? `${url}?variant=${variant}` : url;
+
 type CoachDetailType = {
   id: string;
   navn: string;
@@ -111,7 +115,7 @@ const CoachDetail = () => {
             <div className="aspect-[2/1] bg-muted flex items-center justify-center overflow-hidden">
               {coach.coach_bilde ? (
                 <img
-                  src={coach.coach_bilde}
+                  src={mediaVariant(coach.coach_bilde, "full")}
                   alt={coach.navn}
                   className="w-full h-full object-cover"
                 />
@@ -4,6 +4,7 @@ import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card";
 import { ChevronLeft, UserCircle, Loader2, ChevronRight } from "lucide-react";
 import { useAuth } from "@/contexts/AuthContext";
+import { useServerEvents, type ServerEvent } from "@/hooks/use-server-events";
 import Navbar from "@/components/Navbar";
 import { format, parseISO } from "date-fns";
 import { nb } from "date-fns/locale";
@@ -13,6 +14,10 @@ const getApiUrl = () => {
   return "";
 };
 
+// Ferdigskalert WebP fra /api/media (?variant=avatar|card|full); eksterne URL-er brukes som de er
+const mediaVariant = (url: string, variant: "avatar" | "card" | "full") =>
+  url.startsWith("/api/media/") ? `${url}?variant=${variant}` : url;
+
 type CoachInfo = {
   id: string;
   coach_id: string;
@@ -78,6 +83,17 @@ const CoachSide = () => {
     if (myCoach === null) fetchCoaches();
   }, [user, token, myCoach, fetchCoaches]);
 
+  // Coach-tilgang startet/avsluttet (f.eks. fra en annen enhet): hent på nytt i stedet for polling
+  const onServerEvent = useCallback(
+    (event: ServerEvent) => {
+      if (event.type === "coach_started" || event.type === "coach_ended" || event.type === "resync") {
+        fetchMyCoach();
+      }
+    },
+    [fetchMyCoach],
+  );
+  useServerEvents(onServerEvent);
+
   const avsluttTilgang = async () => {
     if (!token) return;
     setError(null);
@@ -146,7 +162,7 @@ const CoachSide = () => {
           <Card className="mb-8 border-border overflow-hidden">
             {coach.coach_bilde && (
               <div className="aspect-[3/1] bg-muted overflow-hidden">
-                <img src={coach.coach_bilde} alt={coach.coach_navn} className="w-full h-full object-cover" />
+                <img src={mediaVariant(coach.coach_bilde, "full")} alt={coach.coach_navn} className="w-full h-full object-cover" />
               </div>
             )}
             <CardHeader>
@@ -226,7 +242,7 @@ const CoachSide = () => {
                     <div className="aspect-[2/1] bg-muted flex items-center justify-center overflow-hidden">
                       {c.coach_bilde ? (
                         <img
-                          src={c.coach_bilde}
+                          src={mediaVariant(c.coach_bilde, "card")}
                           alt={c.navn}
                           className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
                         />
@@ -176,7 +176,7 @@ const Kaloritelling = () => {
   const handleDeleteMeal = async (mealId: string) => {
     if (!token) return;
     try {
-      await fetch(`${getApiUrl()}/api/meals/${mealId}`, {
+      await fetch(`${getApiUrl()}/api/meals/${mealId}?log_date=${selectedDate}`, {
         method: "DELETE",
         headers: { Authorization: `Bearer ${token}` },
       });
@@ -467,7 +467,7 @@ function AddMealForm({
       .then((r) => r.ok ? r.json() : [])
       .then(setRecipes)
       .catch(() => setRecipes([]));
-    fetch(`${getApiUrl()}/api/food-products`, { headers: { Authorization: `Bearer ${token}` } })
+    fetch(`${getApiUrl()}/api/food-products/recent`, { headers: { Authorization: `Bearer ${token}` } })
       .then((r) => r.ok ? r.json() : [])
       .then(setFoodProducts)
       .catch(() => setFoodProducts([]));